@@ -0,0 +1,48 @@
+"""Times 10k puts against Config and JournalledConfig.
+
+Run from the repository root:
+
+    python -m benchmarks.config_journal
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+
+from cogs.utils.config import Config, JournalledConfig
+
+PUTS = 10000
+
+async def run(cls, *, concurrent):
+    # Config writes its temporary file next to a relative name
+    name = f'{cls.__name__.lower()}-{concurrent}.json'
+    config = cls(name, loop=asyncio.get_running_loop())
+    start = time.perf_counter()
+    if concurrent:
+        await asyncio.gather(*(config.put(i, True) for i in range(PUTS)))
+    else:
+        for i in range(PUTS):
+            await config.put(i, True)
+    elapsed = time.perf_counter() - start
+
+    # make sure nothing was lost on the way
+    reloaded = cls(name, loop=asyncio.get_running_loop())
+    assert len(reloaded) == PUTS, len(reloaded)
+    return elapsed
+
+async def main():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            for concurrent in (False, True):
+                mode = 'concurrent' if concurrent else 'sequential'
+                for cls in (Config, JournalledConfig):
+                    elapsed = await run(cls, concurrent=concurrent)
+                    print(f'{cls.__name__:>16} {mode:>10}: {PUTS / elapsed:>10,.0f} puts/s ({elapsed:.2f}s)')
+        finally:
+            os.chdir(cwd)
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+"""Times ExpiringCache lookups against the version that scanned every entry.
+
+The baseline is the old __verify_cache_integrity, which went over the whole
+cache on every access. Caches of up to 100k entries are compared, the size
+the per-guild caches reach on a large bot.
+
+Run from the repository root:
+
+    python -m benchmarks.expiring_cache
+"""
+
+import time
+
+from cogs.utils.cache import ExpiringCache
+
+LOOKUPS = 20000
+
+class ScanningExpiringCache(dict):
+    """ExpiringCache as it was, checking every entry for expiry on each access."""
+
+    def __init__(self, seconds):
+        self.__ttl = seconds
+        super().__init__()
+
+    def __verify_cache_integrity(self):
+        current_time = time.monotonic()
+        to_remove = [k for (k, (v, t)) in self.items() if current_time > (t + self.__ttl)]
+        for k in to_remove:
+            del self[k]
+
+    def __contains__(self, key):
+        self.__verify_cache_integrity()
+        return super().__contains__(key)
+
+    def __getitem__(self, key):
+        self.__verify_cache_integrity()
+        return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, (value, time.monotonic()))
+
+def run(cls, size, lookups):
+    # nothing expires during the run, so every lookup pays for the full check
+    expiring = cls(3600)
+    for i in range(size):
+        expiring[i] = i
+
+    start = time.perf_counter()
+    for i in range(lookups):
+        expiring[i % size]
+        (i + size) in expiring
+    return (time.perf_counter() - start) / (lookups * 2)
+
+def main():
+    for size in (100, 1000, 10000, 100000):
+        # the scan is linear in the size, so it gets fewer lookups past 1000 entries
+        scanning = run(ScanningExpiringCache, size, max(100, LOOKUPS * 1000 // max(size, 1000)))
+        ordered = run(ExpiringCache, size, LOOKUPS)
+        print(f'{size:>6} entries: scanning {1 / scanning:>12,.0f} ops/s, '
+              f'ordered {1 / ordered:>12,.0f} ops/s ({scanning / ordered:,.0f}x)')
+
+if __name__ == '__main__':
+    main()
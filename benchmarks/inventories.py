@@ -0,0 +1,91 @@
+"""objects.inv sized symbol sets for the rtfm benchmarks.
+
+The real inventories can't be fetched here, so the symbols are collected by
+walking the modules and classes of the standard library and discord.py, which
+gives names with the same shape and roughly the same count as the ones in
+docs.python.org's (about 16k) and discordpy.readthedocs.io's inventories.
+"""
+
+import importlib
+import inspect
+import zlib
+
+PYTHON_MODULES = (
+    'abc argparse array ast asyncio base64 bisect builtins bz2 calendar cmath codecs collections '
+    'collections.abc concurrent.futures configparser contextlib copy csv ctypes dataclasses datetime '
+    'decimal difflib dis email enum errno fractions functools gc getpass gettext glob gzip hashlib '
+    'heapq hmac html html.parser http http.client http.server imaplib importlib inspect io ipaddress '
+    'itertools json logging logging.handlers lzma mailbox math mimetypes multiprocessing operator os '
+    'os.path pathlib pickle platform pprint queue random re secrets select selectors shlex shutil '
+    'signal smtplib socket sqlite3 ssl stat statistics string struct subprocess sys tarfile tempfile '
+    'textwrap threading time timeit tokenize traceback types typing unicodedata unittest unittest.mock '
+    'urllib.parse urllib.request uuid warnings weakref xml.etree.ElementTree zipfile zlib'
+).split()
+
+DISCORD_MODULES = ('discord', 'discord.abc', 'discord.ext.commands', 'discord.ext.tasks', 'discord.utils')
+
+def _role(obj):
+    if inspect.ismodule(obj):
+        return 'py:module'
+    if inspect.isclass(obj):
+        return 'py:exception' if issubclass(obj, BaseException) else 'py:class'
+    if callable(obj):
+        return 'py:function'
+    return 'py:data'
+
+def collect(module_names):
+    """Returns a sorted list of ``(name, role)`` for the modules and everything public in them."""
+    symbols = {}
+    for module_name in module_names:
+        module = importlib.import_module(module_name)
+        symbols[module_name] = 'py:module'
+        for name, obj in vars(module).items():
+            if name.startswith('_'):
+                continue
+            qualified = f'{module_name}.{name}'
+            symbols[qualified] = _role(obj)
+            if not inspect.isclass(obj):
+                continue
+            for attr, member in vars(obj).items():
+                if attr.startswith('_') and not (attr.startswith('__') and attr.endswith('__')):
+                    continue
+                if isinstance(member, property):
+                    role = 'py:attribute'
+                elif callable(member) or isinstance(member, (classmethod, staticmethod)):
+                    role = 'py:method'
+                else:
+                    role = 'py:attribute'
+                symbols[f'{qualified}.{attr}'] = role
+    return sorted(symbols.items())
+
+def python_symbols():
+    return collect(PYTHON_MODULES)
+
+def discord_symbols():
+    return collect(DISCORD_MODULES)
+
+def make_inventory(project, version, symbols):
+    """Returns the raw bytes of a version 2 objects.inv listing ``symbols``."""
+    lines = []
+    for name, role in symbols:
+        module = name.rpartition('.')[0] if role != 'py:module' else name
+        page = module.split('.')[0]
+        location = f'library/{page}.html#$' if role != 'py:module' else f'library/{page}.html#module-$'
+        lines.append(f'{name} {role} 1 {location} -')
+        # Sphinx also writes a label for most sections and the glossary
+        # has terms with spaces in them
+        if role in ('py:module', 'py:class'):
+            label = name.lower().replace('.', '-')
+            lines.append(f'{label} std:label -1 library/{page}.html#{label} {name}')
+        if role == 'py:module':
+            term = name.replace('.', ' ') + ' module'
+            lines.append(f'{term} std:term -1 glossary.html#term-{label} -')
+
+    header = (
+        '# Sphinx inventory version 2\n'
+        f'# Project: {project}\n'
+        f'# Version: {version}\n'
+        '# The remainder of this file is compressed using zlib.\n'
+    )
+    body = ('\n'.join(lines) + '\n').encode('utf-8')
+    return header.encode('utf-8') + zlib.compress(body, 9)
@@ -0,0 +1,103 @@
+"""Times parse_inventory against the objects.inv reader it replaced.
+
+The old reader kept the decompressed text in one buffer and sliced every
+line off the front of it, copying the rest of the buffer each time, then
+matched every line with the Sphinx entry regex. The inventories are built
+from the installed modules (see benchmarks.inventories), a Python sized one
+with about 20k entries and a discord.py sized one. Both parsers have to
+return the same entries.
+
+Run from the repository root:
+
+    python -m benchmarks.inventory_parse
+"""
+
+import io
+import re
+import time
+import zlib
+
+from benchmarks.inventories import discord_symbols, make_inventory, python_symbols
+from cogs.utils.inventory import parse_inventory
+
+ROUNDS = 5
+
+class OldSphinxObjectFileReader:
+    """SphinxObjectFileReader as it was in cogs/rtfx.py."""
+    BUFSIZE = 16 * 1024
+
+    def __init__(self, buffer):
+        self.stream = io.BytesIO(buffer)
+
+    def readline(self):
+        return self.stream.readline().decode('utf-8')
+
+    def read_compressed_chunks(self):
+        decompressor = zlib.decompressobj()
+        while True:
+            chunk = self.stream.read(self.BUFSIZE)
+            if len(chunk) == 0:
+                break
+            yield decompressor.decompress(chunk)
+        yield decompressor.flush()
+
+    def read_compressed_lines(self):
+        buf = b''
+        for chunk in self.read_compressed_chunks():
+            buf += chunk
+            pos = buf.find(b'\n')
+            while pos != -1:
+                yield buf[:pos].decode('utf-8')
+                buf = buf[pos + 1:]
+                pos = buf.find(b'\n')
+
+def old_parse(data):
+    # the parsing half of the old RTFX.parse_object_inv
+    stream = OldSphinxObjectFileReader(data)
+    if stream.readline().rstrip() != '# Sphinx inventory version 2':
+        raise RuntimeError('Invalid objects.inv file version.')
+    stream.readline()
+    stream.readline()
+    if 'zlib' not in stream.readline():
+        raise RuntimeError('Invalid objects.inv file, not z-lib compatible.')
+
+    entries = []
+    entry_regex = re.compile(r'(?x)(.+?)\s+(\S*:\S*)\s+(-?\d+)\s+(\S+)\s+(.*)')
+    for line in stream.read_compressed_lines():
+        match = entry_regex.match(line.rstrip())
+        if not match:
+            continue
+
+        name, directive, priority, location, dispname = match.groups()
+        if location.endswith('$'):
+            location = location[:-1] + name
+        entries.append((name, directive, priority, location, dispname))
+    return entries
+
+def best_of(parse, data):
+    best = float('inf')
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        result = parse(data)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    failed = False
+    for project, symbols in (('Python', python_symbols()), ('discord.py', discord_symbols())):
+        data = make_inventory(project, '1.0', symbols)
+        size = len(zlib.decompressobj().decompress(data[data.index(b'zlib.\n') + 6:]))
+        old, old_entries = best_of(old_parse, data)
+        new, inventory = best_of(parse_inventory, data)
+        same = old_entries == inventory.entries
+        failed = failed or not same
+        print(f'{project:>10}: {len(inventory):>6} entries, {len(data) / 1024:>5.0f}KiB compressed, '
+              f'{size / 1024:>6.0f}KiB inflated')
+        print(f'{"":>10}  old {old * 1000:>7.1f}ms, new {new * 1000:>7.1f}ms ({old / new:.1f}x), '
+              f'{"same entries" if same else "ENTRIES DIFFER"}')
+
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
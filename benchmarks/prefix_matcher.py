@@ -0,0 +1,73 @@
+"""Times prefix resolution with PrefixMatcher against scanning a prefix list.
+
+The list scan is what get_context did before: build the guild's prefix list
+for every message and return the first entry the content starts with. Guilds
+with 1, 5 and 10 prefixes are compared, since the scan gets slower with every
+prefix a guild adds.
+
+Run from the repository root:
+
+    python -m benchmarks.prefix_matcher
+"""
+
+import random
+import string
+import time
+
+from cogs.utils.prefixes import PrefixMatcher
+
+MESSAGES = 200000
+USER_ID = 80088516616269824
+OWNER_ID = 1
+
+def prefix_list(guild_prefixes, author_id):
+    base = [f'<@!{USER_ID}> ', f'<@{USER_ID}> ']
+    base.extend(guild_prefixes)
+    if author_id == OWNER_ID:
+        if 'hey babe ' not in base:
+            base.append('hey babe ')
+    return base
+
+def scan(guild_prefixes, content, author_id):
+    for prefix in prefix_list(guild_prefixes, author_id):
+        if content.startswith(prefix):
+            return prefix
+    return None
+
+def make_messages(prefixes, *, hit_rate):
+    words = [''.join(random.choices(string.ascii_lowercase, k=random.randint(2, 8))) for _ in range(500)]
+    messages = []
+    for _ in range(MESSAGES):
+        content = ' '.join(random.choices(words, k=random.randint(1, 12)))
+        if random.random() < hit_rate:
+            content = random.choice(prefixes + [f'<@!{USER_ID}> ', 'hey babe ']) + content
+        messages.append((content, random.choice((OWNER_ID, 2, 3, 4))))
+    return messages
+
+# guilds take the first 1, 5 or 10 of these, some of them overlap
+PREFIXES = ['?', 'r.', '!', '!!', 'robo ', 'hey', '$', '>>', 'vj!', 'pls ']
+
+def main():
+    random.seed(0)
+    for count in (1, 5, 10):
+        # in the reverse sorted order set_guild_prefixes stores them in
+        guild_prefixes = sorted(PREFIXES[:count], reverse=True)
+        public = PrefixMatcher([f'<@!{USER_ID}> ', f'<@{USER_ID}> '] + guild_prefixes, owner_prefixes=('hey babe ',))
+
+        for hit_rate in (0.05, 0.5):
+            messages = make_messages(guild_prefixes, hit_rate=hit_rate)
+
+            start = time.perf_counter()
+            expected = [scan(guild_prefixes, content, author_id) for content, author_id in messages]
+            scanned = time.perf_counter() - start
+
+            start = time.perf_counter()
+            got = [public.match(content, owner=author_id == OWNER_ID) for content, author_id in messages]
+            matched = time.perf_counter() - start
+
+            assert got == expected, 'the matcher disagrees with the list scan'
+            print(f'{count:>2} prefixes, {hit_rate:>4.0%} prefixed: list scan {MESSAGES / scanned:>12,.0f} msgs/s, '
+                  f'matcher {MESSAGES / matched:>12,.0f} msgs/s ({scanned / matched:.1f}x)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Replays a simulated raid through SpamChecker and the checker it replaced.
+
+Five thousand regulars chat across twenty channels while a wave of fresh
+accounts joins a fraction of a second apart and floods the channels with
+slightly varied copies of the same messages, about 50k messages a minute
+at the peak. Both checkers see the same messages on the same simulated
+clock and the throughput, the number of messages flagged and the number of
+buckets left behind are compared. With --memory the replays run under
+tracemalloc and the peak memory each checker allocated is reported instead
+of the throughput.
+
+Run from the repository root:
+
+    python -m benchmarks.raid_replay
+    python -m benchmarks.raid_replay --memory
+"""
+
+import argparse
+import datetime
+import random
+import time
+import tracemalloc
+import types
+
+from discord.ext import commands
+
+from benchmarks.expiring_cache import ScanningExpiringCache
+from cogs import mod
+
+CHANNELS = 20
+REGULARS = 5000
+RAIDERS = 6000
+DURATION = 300.0
+RAID_START = 60.0
+# how often Mod.evict_spam_buckets runs
+EVICT_EVERY = 15.0
+
+class CooldownByContent(commands.CooldownMapping):
+    def _bucket_key(self, message):
+        return (message.channel.id, message.content)
+
+class CooldownSpamChecker:
+    """SpamChecker as it was, on discord.py cooldown mappings.
+
+    The mappings are given the replay clock so that their expiry sweeps see
+    the same time as the messages.
+    """
+
+    def __init__(self):
+        self.by_content = CooldownByContent.from_cooldown(15, 17.0, commands.BucketType.member)
+        self.by_user = commands.CooldownMapping.from_cooldown(10, 12.0, commands.BucketType.user)
+        self.last_join = None
+        self.new_user = commands.CooldownMapping.from_cooldown(30, 35.0, commands.BucketType.channel)
+        self.fast_joiners = ScanningExpiringCache(1800.0)
+        self.hit_and_run = commands.CooldownMapping.from_cooldown(10, 12.0, commands.BucketType.channel)
+
+    def __len__(self):
+        return (len(self.by_content._cache) + len(self.by_user._cache) + len(self.new_user._cache)
+                + len(self.hit_and_run._cache) + len(self.fast_joiners))
+
+    def is_new(self, member):
+        now = datetime.datetime.utcnow()
+        seven_days_ago = now - datetime.timedelta(days=7)
+        ninety_days_ago = now - datetime.timedelta(days=90)
+        return member.created_at > ninety_days_ago and member.joined_at > seven_days_ago
+
+    def is_spamming(self, message, current):
+        if message.author.id in self.fast_joiners:
+            if self.hit_and_run.get_bucket(message, current).update_rate_limit(current):
+                return True
+
+        if self.is_new(message.author):
+            if self.new_user.get_bucket(message, current).update_rate_limit(current):
+                return True
+
+        if self.by_user.get_bucket(message, current).update_rate_limit(current):
+            return True
+
+        if self.by_content.get_bucket(message, current).update_rate_limit(current):
+            return True
+
+        return False
+
+    def is_fast_join(self, member):
+        is_fast = self.last_join is not None and (member.joined_at - self.last_join).total_seconds() <= 2.0
+        self.last_join = member.joined_at
+        if is_fast:
+            self.fast_joiners[member.id] = True
+        return is_fast
+
+def make_events():
+    """Returns ``(offset, kind, payload)`` tuples sorted by offset in seconds."""
+    utcnow = datetime.datetime.utcnow()
+    guild = types.SimpleNamespace(id=1)
+    channels = [types.SimpleNamespace(id=100 + i) for i in range(CHANNELS)]
+    words = ['free', 'nitro', 'click', 'here', 'now', 'gift', 'steam', 'claim', 'today', 'hello',
+             'what', 'is', 'up', 'lol', 'anyone', 'playing', 'tonight', 'nice', 'thanks', 'ok']
+
+    events = []
+    for i in range(REGULARS):
+        member = types.SimpleNamespace(id=10_000 + i, created_at=utcnow - datetime.timedelta(days=800),
+                                       joined_at=utcnow - datetime.timedelta(days=200))
+        offset = random.uniform(0, 30)
+        while offset < DURATION:
+            content = ' '.join(random.choices(words[9:], k=random.randint(2, 10)))
+            events.append((offset, 'message', types.SimpleNamespace(
+                guild=guild, channel=random.choice(channels), author=member, content=content)))
+            offset += random.expovariate(1 / 15)
+
+    spam = [' '.join(random.choices(words[:9], k=6)) for _ in range(40)]
+    offset = RAID_START
+    for i in range(RAIDERS):
+        offset += random.uniform(0.01, 0.07)
+        joined_at = utcnow + datetime.timedelta(seconds=offset)
+        member = types.SimpleNamespace(id=1_000_000 + i, created_at=utcnow - datetime.timedelta(days=2),
+                                       joined_at=joined_at)
+        events.append((offset, 'join', member))
+        sent = offset + random.uniform(0.5, 3.0)
+        for _ in range(random.randint(5, 40)):
+            # most raiders vary their message a little to get past content checks
+            content = random.choice(spam)
+            if random.random() < 0.7:
+                content += ' ' + str(random.randrange(10000))
+            events.append((sent, 'message', types.SimpleNamespace(
+                guild=guild, channel=random.choice(channels), author=member, content=content)))
+            sent += random.uniform(0.2, 1.5)
+
+    events.sort(key=lambda event: event[0])
+    return events
+
+def replay(events, checker, spamming, *, evict=None, messages):
+    # allocated up front so that it doesn't count towards the traced peak
+    flagged = [False] * messages
+    index = 0
+    peak = 0
+    next_evict = EVICT_EVERY
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+
+    start = time.perf_counter()
+    for offset, kind, payload in events:
+        if kind == 'join':
+            checker.is_fast_join(payload)
+            continue
+
+        flagged[index] = spamming(payload, offset)
+        index += 1
+        if evict is not None and offset >= next_evict:
+            evict(offset)
+            next_evict += EVICT_EVERY
+        peak = max(peak, len(checker))
+    elapsed = time.perf_counter() - start
+
+    memory = None
+    if tracemalloc.is_tracing():
+        memory = tracemalloc.get_traced_memory()[1] - baseline
+    return elapsed, flagged, peak, len(checker), memory
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--memory', action='store_true',
+                        help='trace allocations to report peak memory, the throughput is meaningless then')
+    args = parser.parse_args()
+
+    random.seed(0)
+    events = make_events()
+    messages = sum(1 for _, kind, _ in events if kind == 'message')
+    print(f'{messages} messages ({messages / DURATION * 60:,.0f}/min) and {RAIDERS} raider joins over {DURATION:.0f}s')
+
+    if args.memory:
+        tracemalloc.start()
+
+    base = time.time()
+    old = CooldownSpamChecker()
+    old_run = replay(events, old, lambda message, offset: old.is_spamming(message, base + offset), messages=messages)
+    del old
+
+    # SpamChecker reads the monotonic clock itself, point it at the replay
+    clock = types.SimpleNamespace(now=0.0)
+    real_monotonic = mod.monotonic
+    mod.monotonic = lambda: clock.now
+    try:
+        new = mod.SpamChecker()
+
+        def spamming(message, offset):
+            clock.now = offset
+            return new.is_spamming(message)
+
+        new_run = replay(events, new, spamming, evict=new.evict, messages=messages)
+    finally:
+        mod.monotonic = real_monotonic
+
+    for name, (elapsed, flagged, peak, left, memory) in (('cooldown mappings', old_run), ('sliding windows', new_run)):
+        line = f'{name:>17}: '
+        if memory is None:
+            line += f'{messages / elapsed:>10,.0f} msgs/s, '
+        else:
+            line += f'{memory / 1024:>8,.0f}KiB peak, '
+        print(f'{line}{sum(flagged):>6} flagged, {peak:>6} buckets at peak, {left:>6} at the end')
+
+    agree = sum(a == b for a, b in zip(old_run[1], new_run[1]))
+    print(f'verdicts agree on {agree / messages:.2%} of messages')
+
+if __name__ == '__main__':
+    main()
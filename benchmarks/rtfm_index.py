@@ -0,0 +1,85 @@
+"""Times rtfm lookups through SubsequenceIndex against fuzzy.finder.
+
+The Python and discord.py inventories are built from the installed modules
+(see benchmarks.inventories), run through parse_inventory and the RTFX cog's
+parse_object_inv like the real ones, and combined into one lookup table of
+about 20k keys. Every query is answered both ways and the results must match.
+
+Run from the repository root:
+
+    python -m benchmarks.rtfm_index
+"""
+
+import random
+import statistics
+import time
+
+from benchmarks.inventories import discord_symbols, make_inventory, python_symbols
+from cogs.rtfx import RTFX
+from cogs.utils import fuzzy
+from cogs.utils.inventory import parse_inventory
+
+QUERIES = 200
+
+def make_table():
+    table = {}
+    for project, url, symbols in (('Python', 'https://docs.python.org/3', python_symbols()),
+                                  ('discord.py', 'https://discordpy.readthedocs.io/en/latest', discord_symbols())):
+        inventory = parse_inventory(make_inventory(project, '1.0', symbols))
+        table.update(RTFX.parse_object_inv(None, inventory, url))
+    return list(table.items())
+
+def make_queries(items):
+    # what people type: the last part or two of a name, often cut short or lowercased
+    queries = []
+    for key, _ in random.sample(items, QUERIES):
+        parts = key.rpartition(':')[2].split('.')
+        query = '.'.join(parts[-random.randint(1, 2):])
+        if random.random() < 0.3 and len(query) > 6:
+            query = query[:random.randint(4, len(query) - 1)]
+        if random.random() < 0.5:
+            query = query.lower()
+        queries.append(query)
+    return queries
+
+def time_queries(search, queries):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        latencies.append(time.perf_counter() - start)
+    return latencies, results
+
+def main():
+    random.seed(0)
+    items = make_table()
+    queries = make_queries(items)
+
+    start = time.perf_counter()
+    index = fuzzy.SubsequenceIndex(items, key=lambda t: t[0])
+    print(f'{len(items)} keys, index built in {time.perf_counter() - start:.2f}s')
+
+    def linear(query):
+        matches = fuzzy.finder(query, items, key=lambda t: t[0], lazy=False)
+        return len(matches), matches[:8]
+
+    def indexed(query):
+        return index.search(query, limit=8)
+
+    linear_latencies, expected = time_queries(linear, queries)
+    indexed_latencies, results = time_queries(indexed, queries)
+
+    for name, latencies in (('finder', linear_latencies), ('SubsequenceIndex', indexed_latencies)):
+        latencies.sort()
+        print(f'{name:>16}: median {statistics.median(latencies) * 1000:>7.3f}ms, '
+              f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:>7.3f}ms, '
+              f'max {latencies[-1] * 1000:>7.3f}ms')
+
+    mismatched = [query for query, a, b in zip(queries, expected, results) if a != b]
+    print(f'{len(mismatched)} of {len(queries)} queries differ from finder')
+    if mismatched:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@ __version__ = "10.4.0"
 __author__ = "Varun J"
 
 import aiohttp
+import asyncio
 import datetime
 import os
 import random
@@ -10,17 +11,16 @@ import asyncpg
 import config
 import discord
 from discord.ext import commands, tasks
+from discord.ext.commands.view import StringView
 import sys
 from collections import Counter, deque, defaultdict
-from cogs.utils.config import Config
+from cogs.utils.config import JournalledConfig
 from cogs.utils import context, time, db
-from cogs.utils.api import pokeapi
+from cogs.utils.prefixes import PrefixMatcher
 import logging
 import traceback
-import pyowm
-import tweepy
+from time import perf_counter
 from mystbin import Client as MystbinClient
-import spotify
 
 log = logging.getLogger(__name__)
 os.environ['JISHAKU_HIDE'] = 'true'
@@ -83,6 +83,10 @@ initial_extensions = {
     'jishaku',
 }
 
+# These are loaded before connecting, the rest of initial_extensions
+# are loaded in the background once the event loop is running.
+critical_extensions = ('cogs.config', 'cogs.mod', 'cogs.stats', 'cogs.meta')
+
 
 class GuildPrefixes(db.Table, table_name='guild_prefixes'):
     id = db.Column(db.Integer(big=True), primary_key=True)
@@ -106,7 +110,7 @@ def _prefix_callable(bot, msg):
 
 
 class RoboVJ(commands.AutoShardedBot):
-    def __init__(self):
+    def __init__(self, *, lazy_extensions=True):
         allowed_mentions = discord.AllowedMentions.all()
         allowed_mentions.replied_user = False
         super().__init__(command_prefix=_prefix_callable, status=discord.Status.online, activity=discord.Activity(
@@ -118,38 +122,28 @@ class RoboVJ(commands.AutoShardedBot):
         self.client_id = config.client_id
         self.bots_key = config.bots_key
         self.prefixes = {}
-        self.blocklist = Config('blocklist.json')
+        # guild_id: PrefixMatcher, rebuilt whenever the guild's prefixes change
+        self._prefix_matchers = {}
+        self.blocklist = JournalledConfig('blocklist.json')
         self.spam_control = commands.CooldownMapping.from_cooldown(10, 12.0, commands.BucketType.user)
         self._auto_spam_count = Counter()
-        self.guild_allowlist = Config('guild_allowlist.json')
+        # (messages parsed, total seconds spent in get_context)
+        self.message_parse_stats = [0, 0.0]
+        self.guild_allowlist = JournalledConfig('guild_allowlist.json')
 
         self.session = aiohttp.ClientSession(loop=self.loop)
 
-        # external clients
-        ## OpenWeatherMap
-        try:
-            self.owm_client = pyowm.OWM(config.owm_api_key)
-            self.weather_manager = self.owm_client.weather_manager()
-        except AssertionError as e:
-            print(f"Failed to initialise OpenWeatherMap client: {e}")
-
-        ## Twitter
-        self.twitter_auth = tweepy.OAuthHandler(config.twitter_api_key, config.twitter_api_key_secret)
-        self.twitter_auth.set_access_token(config.twitter_access_token, config.twitter_access_token_secret)
-        self.twitter_api = tweepy.API(self.twitter_auth)
-
-        ## Spotify
-        self.spotify_client = spotify.Client(config.spotify_client_id, config.spotify_client_secret, loop=self.loop)
-
-        ## Pokeapi
-        self.pokeapi = pokeapi.PokeAPI(self)
+        # extension: (seconds taken to load, exception or None)
+        self.extension_timings = {}
+        if lazy_extensions:
+            self._deferred_extensions = sorted(initial_extensions.difference(critical_extensions))
+            to_load = [e for e in critical_extensions if e in initial_extensions]
+        else:
+            self._deferred_extensions = []
+            to_load = initial_extensions
 
-        for extension in initial_extensions:
-            try:
-                self.load_extension(extension)
-            except Exception as e:
-                print(f'Failed to load extension {extension}.', file=sys.stderr)
-                traceback.print_exc()
+        for extension in to_load:
+            self._timed_load_extension(extension)
 
         try:
             self.load_extension('assets.kannan')  # random inside joke stuff
@@ -165,6 +159,89 @@ class RoboVJ(commands.AutoShardedBot):
         self.resumes = defaultdict(list)
         self.identifies = defaultdict(list)
 
+    def _timed_load_extension(self, extension):
+        start = perf_counter()
+        try:
+            self.load_extension(extension)
+        except Exception as e:
+            self.extension_timings[extension] = (perf_counter() - start, e)
+            print(f'Failed to load extension {extension}.', file=sys.stderr)
+            traceback.print_exc()
+        else:
+            self.extension_timings[extension] = (perf_counter() - start, None)
+
+    @tasks.loop(count=1)
+    async def load_deferred_extensions(self):
+        failed = []
+        while self._deferred_extensions:
+            extension = self._deferred_extensions.pop(0)
+            self._timed_load_extension(extension)
+            if self.extension_timings[extension][1] is not None:
+                failed.append(extension)
+            # load_extension imports and runs setup synchronously on the loop, so these
+            # can't overlap; load them one at a time and give the gateway a turn in between
+            await asyncio.sleep(0)
+
+        if failed:
+            await self.report_failed_extensions(failed)
+
+    async def report_failed_extensions(self, extensions):
+        # these fail long after startup, where nobody is watching stderr
+        await self.wait_until_ready()
+        owner = self.get_user(self.owner_id)
+        if owner is None:
+            return
+
+        lines = [f'Failed to load {len(extensions)} deferred extension(s), their commands are missing:']
+        for extension in extensions:
+            error = self.extension_timings[extension][1]
+            lines.append(f'`{extension}`: {type(error).__name__}: {error}')
+
+        try:
+            await owner.send('\n'.join(lines)[:2000])
+        except discord.HTTPException:
+            log.warning('Could not DM the owner about %d failed extension(s).', len(extensions))
+
+    # external clients, these are created on first use so that
+    # their imports and setup don't add to the cold start
+
+    @discord.utils.cached_property
+    def owm_client(self):
+        import pyowm
+        try:
+            return pyowm.OWM(config.owm_api_key)
+        except AssertionError as e:
+            print(f"Failed to initialise OpenWeatherMap client: {e}")
+            return None
+
+    @discord.utils.cached_property
+    def weather_manager(self):
+        if self.owm_client is None:
+            return None
+        return self.owm_client.weather_manager()
+
+    @discord.utils.cached_property
+    def twitter_auth(self):
+        import tweepy
+        auth = tweepy.OAuthHandler(config.twitter_api_key, config.twitter_api_key_secret)
+        auth.set_access_token(config.twitter_access_token, config.twitter_access_token_secret)
+        return auth
+
+    @discord.utils.cached_property
+    def twitter_api(self):
+        import tweepy
+        return tweepy.API(self.twitter_auth)
+
+    @discord.utils.cached_property
+    def spotify_client(self):
+        import spotify
+        return spotify.Client(config.spotify_client_id, config.spotify_client_secret, loop=self.loop)
+
+    @discord.utils.cached_property
+    def pokeapi(self):
+        from cogs.utils.api import pokeapi
+        return pokeapi.PokeAPI(self)
+
     def _clear_gateway_data(self):
         one_week_ago = datetime.datetime.utcnow() - datetime.timedelta(days=7)
         for shard_id, dates in self.identifies.items():
@@ -362,7 +439,51 @@ class RoboVJ(commands.AutoShardedBot):
     def get_raw_guild_prefixes(self, guild_id):
         return self.prefixes.get(guild_id, ['?', '!'])
 
+    def get_prefix_matcher(self, guild_id):
+        """Returns the compiled :class:`PrefixMatcher` for a guild, building it if needed.
+
+        ``None`` gets the matcher used for private messages.
+        """
+        try:
+            return self._prefix_matchers[guild_id]
+        except KeyError:
+            pass
+
+        user_id = self.user.id
+        base = [f'<@!{user_id}> ', f'<@{user_id}> ']
+        if guild_id is None:
+            base.extend(('!', '?'))
+        else:
+            base.extend(self.get_raw_guild_prefixes(guild_id))
+
+        matcher = self._prefix_matchers[guild_id] = PrefixMatcher(base, owner_prefixes=('hey babe ',))
+        return matcher
+
+    async def get_context(self, message, *, cls=commands.Context):
+        # This mirrors commands.Bot.get_context but resolves the prefix
+        # through the precompiled per-guild matcher instead of building
+        # and scanning a fresh prefix list for every message.
+        view = StringView(message.content)
+        ctx = cls(prefix=None, view=view, bot=self, message=message)
+
+        if self._skip_check(message.author.id, self.user.id):
+            return ctx
+
+        guild_id = message.guild.id if message.guild is not None else None
+        matcher = self.get_prefix_matcher(guild_id)
+        prefix = matcher.match(message.content, owner=message.author.id == self.owner_id)
+        if prefix is None:
+            return ctx
+
+        view.skip_string(prefix)
+        invoker = view.get_word()
+        ctx.invoked_with = invoker
+        ctx.prefix = prefix
+        ctx.command = self.all_commands.get(invoker)
+        return ctx
+
     async def set_guild_prefixes(self, guild, prefixes):
+        self._prefix_matchers.pop(guild.id, None)
         if len(prefixes) == 0:
             self.prefixes[guild.id] = []
             await self.pool.execute("UPDATE guild_prefixes SET prefixes = $1 WHERE id = $2", [], guild.id)
@@ -417,8 +538,22 @@ class RoboVJ(commands.AutoShardedBot):
         if before.name != after.name:
             await self.pool.execute("UPDATE guild_prefixes SET name = $1 WHERE id = $2", after.name, after.id)
 
-    async def process_commands(self, message):
+    async def get_parsed_context(self, message):
+        """Parses a message into a :class:`context.Context`, recording how long it took.
+
+        This is the only place a message should be parsed during dispatch,
+        the resulting context is shared between ``on_message`` and ``process_commands``.
+        """
+        start = perf_counter()
         ctx = await self.get_context(message, cls=context.Context)
+        stats = self.message_parse_stats
+        stats[0] += 1
+        stats[1] += perf_counter() - start
+        return ctx
+
+    async def process_commands(self, message, *, ctx=None):
+        if ctx is None:
+            ctx = await self.get_parsed_context(message)
 
         if ctx.command is None:
             return
@@ -451,12 +586,12 @@ class RoboVJ(commands.AutoShardedBot):
             await ctx.release()
 
     async def on_message(self, message):
-        ctx = await self.get_context(message, cls=context.Context)
+        ctx = await self.get_parsed_context(message)
         if not ctx.valid:
             self.dispatch('regular_message', message)
         if message.author.bot:
             return
-        if message.content.strip() in [f'<@!{self.user.id}>', f'<@{self.user.id}>']:
+        if ctx.prefix is None and message.content.strip() in (f'<@!{self.user.id}>', f'<@{self.user.id}>'):
             prefixes = _prefix_callable(self, message)
             # we want to remove prefix #2, because it's the 2nd form of the mention
             # and to the end user, this would end up making them confused why the
@@ -467,7 +602,8 @@ class RoboVJ(commands.AutoShardedBot):
             e.set_footer(text=f'{len(prefixes)} prefixes  |  use <any-prefix>help for a list of commands.')
             e.description = '\n'.join(f'{index}. {elem}' for index, elem in enumerate(prefixes, 1))
             await message.channel.send(embed=e)
-        await self.process_commands(message)
+            return
+        await self.process_commands(message, ctx=ctx)
 
     async def close(self):
         await super().close()
@@ -481,6 +617,7 @@ class RoboVJ(commands.AutoShardedBot):
         records = await self.pool.fetch("SELECT id, prefixes FROM guild_prefixes;")
         for record in records:
             self.prefixes[record['id']] = record['prefixes']
+        self._prefix_matchers.clear()
 
     @startup.before_loop
     async def before_startup(self):
@@ -488,6 +625,7 @@ class RoboVJ(commands.AutoShardedBot):
 
     def run(self):
         self.startup.start()
+        self.load_deferred_extensions.start()
         try:
             super().run(config.token, reconnect=True)
         finally:
@@ -2,9 +2,14 @@ from discord.ext import commands, menus
 from .utils import checks, cache, db
 from .utils.paginator import RoboPages
 
-from collections import defaultdict
+from collections import OrderedDict
+from itertools import accumulate
 from typing import Optional
 import discord
+import sys
+
+# guilds whose plonks are kept in memory at once
+PLONK_CACHE_SIZE = 5000
 
 async def plonk_iterator(bot, guild, records):
     for record in records:
@@ -79,15 +84,26 @@ class ResolvedCommandPermissions:
             self.allow = set()
             self.deny = set()
 
+    # shared by every channel without rules of its own, never mutated
+    _EMPTY = _Entry()
+
     def __init__(self, guild_id, records):
         self.guild_id = guild_id
 
-        self._lookup = defaultdict(self._Entry)
-
         # channel_id: { allow: [commands], deny: [commands] }
+        self._lookup = {}
+
+        # (channel_id, command_name): verdict
+        # channels without any rules share the None channel_id, since
+        # only the guild-level rules apply to them.
+        self._verdicts = {}
 
         for name, channel_id, whitelist in records:
-            entry = self._lookup[channel_id]
+            try:
+                entry = self._lookup[channel_id]
+            except KeyError:
+                entry = self._lookup[channel_id] = self._Entry()
+
             if whitelist:
                 entry.allow.add(name)
             else:
@@ -95,15 +111,14 @@ class ResolvedCommandPermissions:
 
     def _split(self, obj):
         # "hello there world" -> ["hello", "hello there", "hello there world"]
-        from itertools import accumulate
         return list(accumulate(obj.split(), lambda x, y: f'{x} {y}'))
 
     def get_blocked_commands(self, channel_id):
         if len(self._lookup) == 0:
             return set()
 
-        guild = self._lookup[None]
-        channel = self._lookup[channel_id]
+        guild = self._lookup.get(None, self._EMPTY)
+        channel = self._lookup.get(channel_id, self._EMPTY)
 
         # first, apply the guild-level denies
         ret = guild.deny - guild.allow
@@ -112,10 +127,21 @@ class ResolvedCommandPermissions:
         return ret | (channel.deny - channel.allow)
 
     def _is_command_blocked(self, name, channel_id):
+        if channel_id not in self._lookup:
+            channel_id = None
+
+        key = (channel_id, name)
+        try:
+            return self._verdicts[key]
+        except KeyError:
+            verdict = self._verdicts[key] = self._resolve(name, channel_id)
+            return verdict
+
+    def _resolve(self, name, channel_id):
         command_names = self._split(name)
 
-        guild = self._lookup[None] # no special channel_id
-        channel = self._lookup[channel_id]
+        guild = self._lookup.get(None, self._EMPTY) # no special channel_id
+        channel = self._lookup.get(channel_id, self._EMPTY)
 
         blocked = None
 
@@ -171,11 +197,91 @@ class Config(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
-    @cache.cache(strategy=cache.Strategy.lru, maxsize=1024, ignore_kwargs=True)
+        # guild_id: set of plonked channel and member IDs
+        # loaded in full the first time a guild is checked, least recently used first
+        self._plonks = OrderedDict()
+        # guild_id: [loads in flight, changes made while they were running]
+        self._plonk_loading = {}
+        self._plonk_hits = 0
+        self._plonk_loads = 0
+
+    async def get_plonks(self, guild_id, *, connection=None):
+        try:
+            plonks = self._plonks[guild_id]
+        except KeyError:
+            pass
+        else:
+            self._plonks.move_to_end(guild_id)
+            self._plonk_hits += 1
+            return plonks
+
+        loading = self._plonk_loading.get(guild_id)
+        if loading is None:
+            self._plonk_loading[guild_id] = loading = [0, []]
+
+        connection = connection or self.bot.pool
+        query = "SELECT entity_id FROM plonks WHERE guild_id=$1;"
+        loading[0] += 1
+        try:
+            records = await connection.fetch(query, guild_id)
+        finally:
+            loading[0] -= 1
+            if loading[0] == 0:
+                del self._plonk_loading[guild_id]
+
+        self._plonk_loads += 1
+
+        # another load might have finished while we were waiting
+        try:
+            return self._plonks[guild_id]
+        except KeyError:
+            pass
+
+        # the fetch may have missed changes made while it was running, replaying
+        # ones it did see is harmless since they are applied in the same order
+        plonks = {r[0] for r in records}
+        for clear, add, remove in loading[1]:
+            if clear:
+                plonks.clear()
+            plonks.update(add)
+            plonks.difference_update(remove)
+
+        self._plonks[guild_id] = plonks
+        if len(self._plonks) > PLONK_CACHE_SIZE:
+            self._plonks.popitem(last=False)
+        return plonks
+
+    def _update_plonks(self, guild_id, *, add=(), remove=(), clear=False):
+        plonks = self._plonks.get(guild_id)
+        if plonks is None:
+            loading = self._plonk_loading.get(guild_id)
+            if loading is not None:
+                # a load is in flight and has to see this once it's done
+                loading[1].append((clear, tuple(add), tuple(remove)))
+            # otherwise the next check reads it from the database
+            return
+
+        if clear:
+            plonks.clear()
+        plonks.update(add)
+        plonks.difference_update(remove)
+
+    def plonk_stats(self):
+        """Returns ``(guilds, entries, bytes, hit_rate)`` for the plonk index."""
+        entries = sum(len(p) for p in self._plonks.values())
+        size = sys.getsizeof(self._plonks) + sum(sys.getsizeof(p) for p in self._plonks.values())
+        total = self._plonk_hits + self._plonk_loads
+        hit_rate = self._plonk_hits / total if total else 0.0
+        return len(self._plonks), entries, size, hit_rate
+
     async def is_plonked(self, guild_id, member_id, channel_id=None, *, connection=None, check_bypass=True):
         if member_id in self.bot.blocklist or guild_id in self.bot.blocklist:
             return True
 
+        plonks = await self.get_plonks(guild_id, connection=connection)
+        if member_id not in plonks and channel_id not in plonks:
+            return False
+
         if check_bypass:
             guild = self.bot.get_guild(guild_id)
             if guild is not None:
@@ -183,16 +289,7 @@ class Config(commands.Cog):
                 if member is not None and member.guild_permissions.manage_guild:
                     return False
 
-        connection = connection or self.bot.db
-
-        if channel_id is None:
-            query = "SELECT 1 FROM plonks WHERE guild_id=$1 AND entity_id=$2;"
-            row = await connection.fetchrow(query, guild_id, member_id)
-        else:
-            query = "SELECT 1 FROM plonks WHERE guild_id=$1 AND entity_id IN ($2, $3);"
-            row = await connection.fetchrow(query, guild_id, member_id, channel_id)
-
-        return row is not None
+        return True
 
     async def bot_check_once(self, ctx):
         if ctx.guild is None:
@@ -247,8 +344,7 @@ class Config(commands.Cog):
                 # do a bulk COPY
                 await ctx.db.copy_records_to_table('plonks', columns=('guild_id', 'entity_id'), records=to_insert)
 
-                # invalidate the cache for this guild
-                self.is_plonked.invalidate_containing(f'{ctx.guild.id!r}:')
+            self._update_plonks(guild_id, add=(entity_id for _, entity_id in to_insert))
 
     async def cog_command_error(self, ctx, error):
         if isinstance(error, commands.BadArgument):
@@ -274,9 +370,7 @@ class Config(commands.Cog):
             # shortcut for a single insert
             query = "INSERT INTO plonks (guild_id, entity_id) VALUES ($1, $2) ON CONFLICT DO NOTHING;"
             await ctx.db.execute(query, ctx.guild.id, ctx.channel.id)
-
-            # invalidate the cache for this guild
-            self.is_plonked.invalidate_containing(f'{ctx.guild.id!r}:')
+            self._update_plonks(ctx.guild.id, add=(ctx.channel.id,))
         else:
             await self._bulk_ignore_entries(ctx, entities)
 
@@ -327,7 +421,7 @@ class Config(commands.Cog):
 
         query = "DELETE FROM plonks WHERE guild_id=$1;"
         await ctx.db.execute(query, ctx.guild.id)
-        self.is_plonked.invalidate_containing(f'{ctx.guild.id!r}:')
+        self._update_plonks(ctx.guild.id, clear=True)
         await ctx.send('Successfully cleared all ignores.')
 
     @config.group(pass_context=True, invoke_without_command=True, aliases=['unplonk'])
@@ -341,12 +435,13 @@ class Config(commands.Cog):
         if len(entities) == 0:
             query = "DELETE FROM plonks WHERE guild_id=$1 AND entity_id=$2;"
             await ctx.db.execute(query, ctx.guild.id, ctx.channel.id)
+            entities = [ctx.channel.id]
         else:
             query = "DELETE FROM plonks WHERE guild_id=$1 AND entity_id = ANY($2::bigint[]);"
             entities = [c.id for c in entities]
             await ctx.db.execute(query, ctx.guild.id, entities)
 
-        self.is_plonked.invalidate_containing(f'{ctx.guild.id!r}:')
+        self._update_plonks(ctx.guild.id, remove=entities)
         await ctx.send(ctx.tick(True))
 
     @unignore.command(name='all')
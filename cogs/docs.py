@@ -1,29 +1,27 @@
 import asyncio
-import functools
 import logging
 import re
 import textwrap
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import suppress
-from types import SimpleNamespace
 from typing import Optional, Tuple
 
+import aiohttp
 import discord
 from bs4 import BeautifulSoup
 from bs4.element import PageElement, Tag
 from discord.errors import NotFound
 from discord.ext import commands
 from markdownify import MarkdownConverter
-from requests import ConnectTimeout, ConnectionError, HTTPError
-from sphinx.ext import intersphinx
-from urllib3.exceptions import ProtocolError
 
 from .utils.docs import RedirectOutput, ValidPythonIdentifier, ValidURL, wait_for_deletion
 from .utils.cache import AsyncCache
 from .utils.doc_paginator import LinePaginator
+from .utils.inventory import InvalidInventory, parse_inventory
 from .utils import checks, db
 
 log = logging.getLogger(__name__)
-logging.getLogger('urllib3').setLevel(logging.WARNING)
 
 
 class DocTable(db.Table, table_name='docs'):
@@ -32,15 +30,8 @@ class DocTable(db.Table, table_name='docs'):
     inventory_url = db.Column(db.String)
 
 
-# Since intershpinx is intended to be used with Shpinx,
-# we need to mock its configuration
-SPHINX_MOCK_APP = SimpleNamespace(
-    config=SimpleNamespace(
-        intersphinx_timeout=3,
-        tls_verify=True,
-        user_agent='python3:Robo-VJ/cogs/docs:5.8.0'
-    )
-)
+INVENTORY_TIMEOUT = aiohttp.ClientTimeout(sock_connect=3, sock_read=3)
+INVENTORY_HEADERS = {'User-Agent': 'python3:Robo-VJ/cogs/docs:5.8.0'}
 
 NO_OVERRIDE_GROUPS = (
     "2to3fixer",
@@ -70,9 +61,22 @@ WHITESPACE_AFTER_NEWLINES_RE = re.compile(r"(?<=\n\n)(\s+)")
 FAILED_REQUEST_RETRY_AMOUNT = 3
 NOT_FOUND_DELETE_DELAY = RedirectOutput.delete_delay
 
+# roughly how many characters of parsed pages are kept around
+PAGE_CACHE_SIZE = 16 * 1024 * 1024
+PAGE_PARSER_WORKERS = 2
+
 symbol_cache = AsyncCache()
 
 
+class PageFetchError(Exception):
+    """Raised when a documentation page can't be downloaded."""
+
+    def __init__(self, url: str, status: int):
+        self.url = url
+        self.status = status
+        super().__init__(f'Fetching {url} failed with status {status}')
+
+
 class DocMarkdownConverter(MarkdownConverter):
     """Subclass markdownify's MarkdownCoverter to provide custom conversion methods."""
 
@@ -91,11 +95,144 @@ def markdownify(html: str) -> DocMarkdownConverter:
     return DocMarkdownConverter(bullets='•').convert(html)
 
 
+def _match_end_tag(tag: Tag) -> bool:
+    """Matches `tag` if its class value is in `SEARCH_END_TAG_ATTRS` or the tag is table."""
+    for attr in SEARCH_END_TAG_ATTRS:
+        if attr in tag.get('class', ()):
+            return True
+    return tag.name == 'table'
+
+
+def _module_symbol(symbol_heading: Tag, search_html: str) -> Tuple[Optional[list], str]:
+    """Get page content from the module headerlink to the first tag matching `_match_end_tag`."""
+    start_tag = symbol_heading.find('a', attrs={'class': 'headerlink'})
+    if start_tag is None:
+        return [], ''
+
+    end_tag = start_tag.find_next(_match_end_tag)
+    if end_tag is None:
+        return [], ''
+
+    description_start_index = search_html.find(str(start_tag.parent)) + len(str(start_tag.parent))
+    description_end_index = search_html.find(str(end_tag))
+    return None, search_html[description_start_index:description_end_index].replace('¶', '')
+
+
+def _dt_symbol(symbol_heading: Tag) -> Tuple[list, str]:
+    """Get the text of up to 3 signatures that precede the symbol's description, and the description."""
+    elements = [symbol_heading]
+    description = None
+    for sibling in symbol_heading.find_next_siblings(('dt', 'dd')):
+        if sibling.name == 'dd':
+            description = sibling
+            break
+        if len(elements) < 3:
+            elements.append(sibling)
+
+    signatures = []
+    for element in elements:
+        signature = UNWANTED_SIGNATURE_SYMBOLS_RE.sub('', element.text)
+        if signature:
+            signatures.append(signature)
+
+    description = str(description) if description is not None else ''
+    return signatures, description.replace('¶', '')
+
+
+def parse_symbols(html: str) -> dict:
+    """
+    Parse a documentation page and extract every symbol on it.
+
+    Returns a dict of element IDs to `(signatures, description)` tuples, in the format
+    returned by `Doc.get_symbol_html`. This runs in a worker process, so it has to stay
+    a picklable module level function.
+    """
+    soup = BeautifulSoup(html, 'lxml')
+    search_html = None
+    symbols = {}
+    for symbol_heading in soup.find_all(id=True):
+        symbol_id = symbol_heading['id']
+        if symbol_id.startswith('module-'):
+            if search_html is None:
+                search_html = str(soup)
+            symbols[symbol_id] = _module_symbol(symbol_heading, search_html)
+        elif symbol_heading.name == 'dt':
+            symbols[symbol_id] = _dt_symbol(symbol_heading)
+    return symbols
+
+
+class PageCache:
+    """
+    A least recently used cache of parsed documentation pages.
+
+    Pages are evicted once the text they hold adds up to more than `max_size` characters.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self._pages = OrderedDict()
+
+    @staticmethod
+    def _page_size(symbols: dict) -> int:
+        size = 0
+        for signatures, description in symbols.values():
+            size += len(description) + sum(map(len, signatures or ()))
+        return size
+
+    def get(self, url: str) -> Optional[dict]:
+        try:
+            symbols, _ = self._pages[url]
+        except KeyError:
+            return None
+        self._pages.move_to_end(url)
+        return symbols
+
+    def set(self, url: str, symbols: dict) -> None:
+        self.discard(url)
+        size = self._page_size(symbols)
+        self._pages[url] = (symbols, size)
+        self.size += size
+        while self.size > self.max_size and len(self._pages) > 1:
+            _, (_, evicted) = self._pages.popitem(last=False)
+            self.size -= evicted
+
+    def discard(self, url: str) -> None:
+        try:
+            _, size = self._pages.pop(url)
+        except KeyError:
+            return
+        self.size -= size
+
+    def clear(self) -> None:
+        self._pages.clear()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+
+def group_inventory(inventory) -> dict:
+    """
+    Group the entries of a parsed inventory the same way `intersphinx.fetch_inventory` does.
+
+    The result maps `domain:role` groups to `{symbol: (project, version, relative_url, display_name)}`.
+    """
+    groups = {}
+    for name, directive, _, location, dispname in inventory.entries:
+        group = groups.setdefault(directive, {})
+        if directive == 'py:module' and name in group:
+            # Sphinx 1.1 and below wrote two entries for modules, the first is correct
+            continue
+        group[name] = (inventory.project, inventory.version, location, dispname)
+    return groups
+
+
 class InventoryURL(commands.Converter):
     """
     Represents an Intersphinx inventory URL.
 
-    This converter checks whether intersphinx accepts the given inventory URL, and raises
+    This converter checks whether the given URL serves a valid inventory, and raises
     `BadArgument` if that is not the case.
     
     Otherwise, it simply passes through the given URL.
@@ -105,16 +242,21 @@ class InventoryURL(commands.Converter):
     async def convert(ctx: commands.Context, url: str) -> str:
         """Convert url to Intersphinx inventory URL."""
         try:
-            intersphinx.fetch_inventory(SPHINX_MOCK_APP, '', url)
-        except AttributeError:
-            raise commands.BadArgument(f"Failed to fetch Intersphinx inventory from URL `{url}`.")
-        except ConnectionError:
+            async with ctx.bot.session.get(url, timeout=INVENTORY_TIMEOUT, headers=INVENTORY_HEADERS) as resp:
+                resp.raise_for_status()
+                data = await resp.read()
+        except aiohttp.ClientConnectorError:
             if url.startswith('https'):
                 raise commands.BadArgument(
                     f"Cannot establish a connection to `{url}`. Does it support HTTPS?"
                 )
             raise commands.BadArgument(f"Cannot connect to host with URL `{url}`.")
-        except ValueError:
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            raise commands.BadArgument(f"Failed to fetch Intersphinx inventory from URL `{url}`.")
+
+        try:
+            await ctx.bot.loop.run_in_executor(None, parse_inventory, data)
+        except InvalidInventory:
             raise commands.BadArgument(
                 f"Failed to read Intersphinx inventory from URL `{url}`. "
                 "Are you sure that it's a valid inventory file?"
@@ -130,9 +272,15 @@ class Doc(commands.Cog):
         self.bot = bot
         self.inventories = {}
         self.renamed_symbols = set()
+        self.page_cache = PageCache(PAGE_CACHE_SIZE)
+        self._page_tasks = {}
+        self._parser = ProcessPoolExecutor(max_workers=PAGE_PARSER_WORKERS)
 
         self.bot.loop.create_task(self.init_refresh_inventory())
 
+    def cog_unload(self) -> None:
+        self._parser.shutdown(wait=False)
+
     async def init_refresh_inventory(self) -> None:
         """Refresh documentation inventory on cog initialization."""
         await self.bot.wait_until_ready()
@@ -148,8 +296,8 @@ class Doc(commands.Cog):
             * `package_name` is the package name to use, appears in the log
             * `base_url` is the root documentation URL for the specified package, used to build
                 absolute paths that link to specific symbols
-            * `inventory_url` is the absolute URL to the intersphinx inventory, fetched by running
-                `intersphinx.fetch_inventory` in an executor on the bot's event loop
+            * `inventory_url` is the absolute URL to the intersphinx inventory, which is fetched
+                with the bot's session and parsed in an executor
         """
         self.base_urls[package_name] = base_url
 
@@ -192,6 +340,7 @@ class Doc(commands.Cog):
         self.inventories.clear()
         self.renamed_symbols.clear()
         symbol_cache.clear()
+        self.page_cache.clear()
 
         # Run all coroutines concurrently - since each of them performs a HTTP
         # request, this speeds up fetching the inventory data heavily.
@@ -203,6 +352,33 @@ class Doc(commands.Cog):
         ]
         await asyncio.gather(*coros)
 
+    async def _parse_page(self, page_url: str) -> dict:
+        async with self.bot.session.get(page_url) as resp:
+            # error pages would otherwise be cached as pages without any symbols
+            if resp.status != 200:
+                raise PageFetchError(page_url, resp.status)
+            html = await resp.text(encoding='utf-8')
+
+        symbols = await self.bot.loop.run_in_executor(self._parser, parse_symbols, html)
+        self.page_cache.set(page_url, symbols)
+        return symbols
+
+    async def get_page_symbols(self, page_url: str) -> dict:
+        """
+        Return every symbol on a documentation page, see `parse_symbols`.
+
+        Pages are downloaded and parsed once, concurrent lookups for the same page wait on the same task.
+        """
+        symbols = self.page_cache.get(page_url)
+        if symbols is not None:
+            return symbols
+
+        task = self._page_tasks.get(page_url)
+        if task is None:
+            task = self._page_tasks[page_url] = self.bot.loop.create_task(self._parse_page(page_url))
+            task.add_done_callback(lambda _: self._page_tasks.pop(page_url, None))
+        return await asyncio.shield(task)
+
     async def get_symbol_html(self, symbol: str):
         """
         Given a Python symbol, return its signature and description.
@@ -216,45 +392,10 @@ class Doc(commands.Cog):
         url = self.inventories.get(symbol)
         if url is None:
             return None
-        
-        async with self.bot.session.get(url) as resp:
-            html = await resp.text(encoding='utf-8')
-        
-        # Find the signature header and parse the relevant parts.
-        symbol_id = url.split('#')[-1]
-        soup = BeautifulSoup(html, 'lxml')
-        symbol_heading = soup.find(id=symbol_id)
-        search_html = str(soup)
 
-        if symbol_heading is None:
-            return None
-
-        if symbol_id == f'module-{symbol}':
-            # Get page content from the module headerlink to the
-            # first tag that has its class in `SEARCH_END_TAG_ATTRS`
-            start_tag = symbol_heading.find('a', attrs={'class': 'headerlink'})
-            if start_tag is None:
-                return [], ''
-
-            end_tag = start_tag.find_next(self._match_end_tag)
-            if end_tag is None:
-                return [], ''
-            
-            description_start_index = search_html.find(str(start_tag.parent)) + len(str(start_tag.parent))
-            description_end_index = search_html.find(str(end_tag))
-            description = search_html[description_start_index:description_end_index]
-            signatures = None
-        else:
-            signatures = []
-            description = str(symbol_heading.find_next_sibling("dd"))
-            description_pos = search_html.find(description)
-            # Get text of up to 3 signatures, remove unwanted symbols
-            for element in [symbol_heading] + symbol_heading.find_next_siblings("dt", limit=2):
-                signature = UNWANTED_SIGNATURE_SYMBOLS_RE.sub('', element.text)
-                if signature and search_html.find(str(element)) < description_pos:
-                    signatures.append(signature)
-
-        return signatures, description.replace('¶', '')
+        page_url, _, symbol_id = url.partition('#')
+        symbols = await self.get_page_symbols(page_url)
+        return symbols.get(symbol_id)
 
     @symbol_cache(arg_offset=1)
     async def get_symbol_embed(self, symbol: str) -> Optional[discord.Embed]:
@@ -269,7 +410,7 @@ class Doc(commands.Cog):
 
         signatures = scraped_html[0]
         permalink = self.inventories[symbol]
-        description = markdownify(scraped_html[1])
+        description = await self.bot.loop.run_in_executor(self._parser, markdownify, scraped_html[1])
 
         # Truncate the description of the embed to the last occurrence
         # of a double newline (interpreted as a paragraph) before index 1000.
@@ -349,8 +490,14 @@ class Doc(commands.Cog):
             # Fetching documentation for a symbol (at least for the first time, since
             # caching is used) takes quite some time, so let's send typing to indicate
             # that we got the command, but are still working on it.
-            async with ctx.typing():
-                doc_embed = await self.get_symbol_embed(symbol)
+            try:
+                async with ctx.typing():
+                    doc_embed = await self.get_symbol_embed(symbol)
+            except PageFetchError as e:
+                log.warning('Could not fetch documentation page: %s', e)
+                return await ctx.send(
+                    f"Could not fetch the documentation page for `{symbol}` (status {e.status}), try again later."
+                )
 
             if doc_embed is None:
                 error_embed = discord.Embed(
@@ -430,39 +577,39 @@ class Doc(commands.Cog):
 
     async def _fetch_inventory(self, inventory_url: str) -> Optional[dict]:
         """Get and return inventory from `inventory_url`. If fetching fails, return None."""
-        fetch_func = functools.partial(intersphinx.fetch_inventory, SPHINX_MOCK_APP, '', inventory_url)
         for retry in range(1, FAILED_REQUEST_RETRY_AMOUNT+1):
             try:
-                package = await self.bot.loop.run_in_executor(None, fetch_func)
-            except ConnectTimeout:
+                async with self.bot.session.get(
+                    inventory_url, timeout=INVENTORY_TIMEOUT, headers=INVENTORY_HEADERS
+                ) as resp:
+                    resp.raise_for_status()
+                    data = await resp.read()
+            except asyncio.TimeoutError:
                 log.error(
                     f"Fetching of inventory {inventory_url} timed out,"
                     f" trying again. ({retry}/{FAILED_REQUEST_RETRY_AMOUNT})"
                 )
-            except ProtocolError:
+            except aiohttp.ClientPayloadError:
                 log.error(
                     f"Connection lost while fetching inventory {inventory_url},"
                     f" trying again. ({retry}/{FAILED_REQUEST_RETRY_AMOUNT})"
                 )
-            except HTTPError as e:
-                log.error(f"Fetching of inventory {inventory_url} failed with status code {e.response.status_code}.")
+            except aiohttp.ClientResponseError as e:
+                log.error(f"Fetching of inventory {inventory_url} failed with status code {e.status}.")
                 return None
-            except ConnectionError:
+            except aiohttp.ClientError:
                 log.error(f"Couldn't establish connection to inventory {inventory_url}.")
                 return None
             else:
-                return package
+                try:
+                    inventory = await self.bot.loop.run_in_executor(None, parse_inventory, data)
+                except InvalidInventory as e:
+                    log.error(f"Inventory {inventory_url} could not be read: {e}")
+                    return None
+                return group_inventory(inventory)
         log.error(f'Fetching of inventory {inventory_url} failed.')
         return None
 
-    @staticmethod
-    def _match_end_tag(tag: Tag) -> bool:
-        """Matches `tag` if its class value is in `SEARCH_END_TAG_ATTRS` or the tag is table."""
-        for attr in SEARCH_END_TAG_ATTRS:
-            if attr in tag.get('class', ()):
-                return True
-        return tag.name == 'table'
-
 
 def setup(bot):
     bot.add_cog(Doc(bot))
@@ -122,8 +122,11 @@ class Location(commands.Cog):
     @commands.command()
     async def weather(self, ctx, *, location: str):
         """Weather."""
+        weather_manager = self.bot.weather_manager
+        if weather_manager is None:
+            return await ctx.reply(':no_entry: Error: The weather service is not available.')
         try:
-            observation = self.bot.weather_manager.weather_at_place(location)
+            observation = weather_manager.weather_at_place(location)
         except (pyowm.commons.exceptions.NotFoundError,
                 pyowm.commons.exceptions.BadGatewayError) as e:
             return await ctx.reply(f':no_entry: Error: {e}')
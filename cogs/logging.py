@@ -1,9 +1,14 @@
 import asyncio
 import datetime
 from contextlib import suppress
+import asyncpg
 import discord
 from discord.ext import commands, tasks
-from .utils import db
+from .utils import db, spill
+
+MESSAGE_LOG_COLUMNS = ('channel_id', 'message_id', 'guild_id', 'user_id', 'content', 'nsfw', 'logged_at')
+# the buffer is flushed early once this many messages are waiting
+FLUSH_AT = 1000
 
 
 class MessageLog(db.Table, table_name='message_log'):
@@ -13,6 +18,7 @@ class MessageLog(db.Table, table_name='message_log'):
     user_id = db.Column(db.Integer(big=True), index=True)
     content = db.Column(db.String)
     nsfw = db.Column(db.Boolean, default=False)
+    logged_at = db.Column(db.Datetime, default="now() at time zone 'utc'")
 
 
 class OptInStatus(db.Table, table_name='opt_in_status'):
@@ -29,21 +35,57 @@ class Logging(commands.Cog):
         self._opted_in = set()
         self._log_nsfw = set()
         self._batch_lock = asyncio.Lock()
+        self._pending_flush = None
+        self.spill = spill.SpillFile('message_log.spill')
 
         self._logging_task.start()
 
     def cog_unload(self):
         self._logging_task.stop()
 
+    async def _copy_rows(self, records):
+        async with self.bot.pool.acquire(timeout=300.0) as con:
+            try:
+                await con.copy_records_to_table('message_log', columns=MESSAGE_LOG_COLUMNS, records=records)
+            except asyncpg.UniqueViolationError:
+                # part of a replayed batch made it in before the connection dropped,
+                # so go through a staging table and skip what is already there
+                async with con.transaction():
+                    await con.execute("CREATE TEMPORARY TABLE message_log_staging (LIKE message_log) ON COMMIT DROP;")
+                    await con.copy_records_to_table('message_log_staging', columns=MESSAGE_LOG_COLUMNS, records=records)
+                    await con.execute("INSERT INTO message_log SELECT * FROM message_log_staging ON CONFLICT DO NOTHING;")
+
+    async def flush(self):
+        """Writes the buffered messages, and any spilled by earlier failed flushes, to message_log."""
+        async with self._batch_lock:
+            self._pending_flush = None
+            batch, self.bot._message_log = self.bot._message_log, []
+            spilled, offset = await self.spill.read()
+            if not spilled and not batch:
+                return
+
+            # every row of a batch shares one timestamp so that listeners
+            # can tell which batches they have already seen, spilled rows
+            # are stamped again since they were never written
+            logged_at = datetime.datetime.utcnow()
+            records = [row[:6] + (logged_at,) for row in spilled]
+            records.extend(row + (logged_at,) for row in batch)
+
+            written = await spill.write_records(self._copy_rows, records, spill=self.spill, name='message_log')
+            # whatever couldn't be written has been spilled again behind the offset
+            await self.spill.consume(offset)
+
+        if written:
+            self.bot.dispatch('message_log_flush', [row[:6] for row in written], logged_at)
+
     @tasks.loop(seconds=60.0)
     async def _logging_task(self):
-        async with self._batch_lock:
-            async with self.bot.pool.acquire(timeout=300.0) as con:
-                if self.bot._message_log:
-                    query = "INSERT INTO message_log VALUES ($1, $2, $3, $4, $5, $6);"
-                    await con.executemany(query, self.bot._message_log)
+        await self.flush()
 
-            self.bot._message_log.clear()
+    @_logging_task.after_loop
+    async def _after_logging_task(self):
+        # whatever is left over on unload
+        await self.flush()
 
     @_logging_task.before_loop
     async def _before_logging_task(self):
@@ -118,6 +160,8 @@ class Logging(commands.Cog):
 
         self.bot._message_log.append((message.channel.id, message.id, message.guild.id,
                                       message.author.id, message.content, message.channel.is_nsfw()))
+        if len(self.bot._message_log) >= FLUSH_AT and self._pending_flush is None:
+            self._pending_flush = self.bot.loop.create_task(self.flush())
 
 
 def setup(bot):
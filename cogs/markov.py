@@ -1,16 +1,56 @@
+import asyncio
+import logging
+import random
+from collections import OrderedDict
+from contextlib import AsyncExitStack
 from functools import partial
-import asyncpg
-from typing import Awaitable, Dict, List, Optional, Tuple
-
-import rusty_markov as markov
+from typing import Dict, Iterable, List, Optional, Tuple
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
+
+from .utils import db
+from .utils.chain import InvalidModel, MarkovChain
+
+log = logging.getLogger(__name__)
 
 MAX_TRIES = 32
+MODEL_CACHE_SIZE = 12  # idk about a good size
+# messages read from the log per cursor fetch while training
+TRAINING_CHUNK_SIZE = 5000
+# scopes with more logged messages than this are trained on a random sample of them
+TRAINING_SAMPLE_SIZE = 250000
+# models trained from the log at once, each holds a pool connection until it's done
+TRAINING_CONCURRENCY = 2
+
+# message_log column each kind of model is scoped by
+SCOPE_COLUMNS = {'user': 'user_id', 'guild': 'guild_id'}
+
+ModelKey = Tuple[str, int, int, bool]
+
+
+class MarkovModels(db.Table, table_name='markov_models'):
+    kind = db.Column(db.String, primary_key=True)
+    scope_id = db.Column(db.Integer(big=True), primary_key=True)
+    chain_order = db.Column(db.Integer(small=True), primary_key=True)
+    nsfw = db.Column(db.Boolean, primary_key=True)
+    # logged_at of the newest message_log batch the model has been trained on
+    watermark = db.Column(db.Datetime)
+    data = db.Column(db.Binary, nullable=False)
 
 
-def make_sentence(model: markov.Markov, order: int, *, seed: str = None, tries=MAX_TRIES) -> Optional[str]:
+class CachedModel:
+    __slots__ = ('chain', 'watermark', 'dirty', 'lock')
+
+    def __init__(self, chain: MarkovChain, watermark):
+        self.chain = chain
+        self.watermark = watermark
+        self.dirty = False
+        # held while the chain is trained, walked or serialised in an executor
+        self.lock = asyncio.Lock()
+
+
+def make_sentence(model: MarkovChain, order: int, *, seed: str = None, tries=MAX_TRIES) -> Optional[str]:
     while tries >= 0:
         try:
             if seed is None:
@@ -27,7 +67,7 @@ def make_sentence(model: markov.Markov, order: int, *, seed: str = None, tries=M
     return None
 
 
-def make_code(model: markov.Markov, order: int, *, seed: str = None, tries=MAX_TRIES * 8) -> Optional[str]:
+def make_code(model: MarkovChain, order: int, *, seed: str = None, tries=MAX_TRIES * 8) -> Optional[str]:
     while tries >= 0:
         try:
             sentence = model.generate()
@@ -48,32 +88,236 @@ def make_code(model: markov.Markov, order: int, *, seed: str = None, tries=MAX_T
 class Markov(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.model_cache: Dict[Tuple[int, ...], markov.Markov] = markov.LRUDict(max_size=12)  # idk about a good size
-
-    async def get_model(self, query: Tuple[int, ...], *coros: Awaitable[List[asyncpg.Record]], order: int = 2) -> markov.Markov:
-        # Return cached model if one exists
-        if query in self.model_cache:
-            return self.model_cache[query]
-
-        # Generate the model
-        data: List[str] = list()
-        for coro in coros:
-            records: List[asyncpg.Record] = await coro
-            data.extend([record['content'] for record in records])
-        if not data:
-            raise commands.BadArgument('There was not enough message log data, please try again later.')
+        self.model_cache: Dict[ModelKey, CachedModel] = OrderedDict()
+        self._loading: Dict[ModelKey, asyncio.Task] = {}
+        # message_log batches that arrive while a model is being loaded
+        self._pending: Dict[ModelKey, list] = {}
+        self._training = asyncio.Semaphore(TRAINING_CONCURRENCY)
+        self.save_models.start()
+
+    def cog_unload(self):
+        self.save_models.stop()
+
+    @staticmethod
+    def _matches(key: ModelKey, row) -> bool:
+        kind, scope_id, _, nsfw = key
+        _, _, guild_id, user_id, content, is_nsfw = row
+        if is_nsfw and not nsfw:
+            return False
+        if ' ' not in content:
+            return False
+        return (user_id if kind == 'user' else guild_id) == scope_id
+
+    async def _apply_batch(self, key: ModelKey, cached: CachedModel, rows, logged_at):
+        # the batch might already have been read back from message_log
+        if cached.watermark is not None and logged_at <= cached.watermark:
+            return
+
+        contents = [row[4] for row in rows if self._matches(key, row)]
+        async with cached.lock:
+            if contents:
+                await self.bot.loop.run_in_executor(None, cached.chain.train, contents)
+                cached.dirty = True
+            cached.watermark = logged_at
+
+    @commands.Cog.listener()
+    async def on_message_log_flush(self, rows, logged_at):
+        for pending in self._pending.values():
+            pending.append((rows, logged_at))
+
+        for key, cached in list(self.model_cache.items()):
+            await self._apply_batch(key, cached, rows, logged_at)
+
+    async def _train_from_log(self, key: ModelKey, chain: MarkovChain, watermark):
+        """Trains ``chain`` on the logged messages newer than ``watermark``.
+
+        Rows are streamed from a server-side cursor and trained on a chunk at a time, so at most
+        ``TRAINING_CHUNK_SIZE`` messages are held at once. When a model is built from scratch and
+        the scope has more than ``TRAINING_SAMPLE_SIZE`` messages, a uniform sample of that many
+        is trained on instead.
+
+        At most ``TRAINING_CONCURRENCY`` models are trained at once so that builds can't use up
+        the pool, the rest wait their turn.
+
+        Returns the number of messages trained on and the new watermark.
+        """
+        kind, scope_id, _, nsfw = key
+        loop = self.bot.loop
+        column = SCOPE_COLUMNS[kind]
+        conditions = f"{column} = $1 AND nsfw <= $2 AND content LIKE '% %'"
+        args = [scope_id, nsfw]
+        if watermark is not None:
+            conditions += ' AND logged_at > $3'
+            args.append(watermark)
+
+        async with self._training, self.bot.pool.acquire(timeout=300.0) as con:
+            sample_size = None
+            if watermark is None:
+                total = await con.fetchval(f'SELECT COUNT(*) FROM message_log WHERE {conditions};', *args)
+                if total > TRAINING_SAMPLE_SIZE:
+                    sample_size = TRAINING_SAMPLE_SIZE
+
+            trained = 0
+            reservoir = []
+            async with con.transaction():
+                # Postgres requires non-scrollable cursors to be created and used within a transaction
+                cursor = await con.cursor(f'SELECT content, logged_at FROM message_log WHERE {conditions};', *args)
+                while True:
+                    records = await cursor.fetch(TRAINING_CHUNK_SIZE)
+                    if not records:
+                        break
+
+                    for record in records:
+                        logged_at = record['logged_at']
+                        if logged_at is not None and (watermark is None or logged_at > watermark):
+                            watermark = logged_at
+
+                    if sample_size is None:
+                        data = [record['content'] for record in records]
+                        await loop.run_in_executor(None, chain.train, data)
+                        trained += len(data)
+                        continue
+
+                    # Algorithm R, every row seen so far has the same chance of being kept
+                    for record in records:
+                        trained += 1
+                        if len(reservoir) < sample_size:
+                            reservoir.append(record['content'])
+                        else:
+                            index = random.randrange(trained)
+                            if index < sample_size:
+                                reservoir[index] = record['content']
+
+        if reservoir:
+            await loop.run_in_executor(None, chain.train, reservoir)
+            trained = len(reservoir)
+        return trained, watermark
+
+    async def _load_model(self, key: ModelKey) -> CachedModel:
+        kind, scope_id, order, nsfw = key
+        query = """SELECT data, watermark FROM markov_models
+                   WHERE kind = $1 AND scope_id = $2 AND chain_order = $3 AND nsfw = $4;
+                """
+        record = await self.bot.pool.fetchrow(query, *key)
+
+        chain = None
+        watermark = None
+        if record is not None:
+            try:
+                chain = await self.bot.loop.run_in_executor(None, MarkovChain.from_bytes, record['data'])
+            except InvalidModel:
+                pass
+            else:
+                watermark = record['watermark']
+
+        if chain is None:
+            chain = MarkovChain(order)
 
-        def generate_model():
-            model = markov.Markov(order)
-            model.train(data)
-            return model
+        # only what was logged after the model was last saved has to be read
+        trained, watermark = await self._train_from_log(key, chain, watermark)
 
-        self.model_cache[query] = m = await self.bot.loop.run_in_executor(None, generate_model)
-        return m
+        cached = CachedModel(chain, watermark)
+        cached.dirty = trained > 0
+        return cached
 
-    async def send_markov(self, ctx, model: markov.Markov, order: int, *, seed: str = None, callable=make_sentence):
-        markov_call = partial(callable, model, order, seed=seed)
-        markov = await self.bot.loop.run_in_executor(None, markov_call)
+    async def _save_model(self, key: ModelKey, cached: CachedModel):
+        async with cached.lock:
+            cached.dirty = False
+            data = await self.bot.loop.run_in_executor(None, cached.chain.to_bytes)
+            watermark = cached.watermark
+
+        query = """INSERT INTO markov_models (kind, scope_id, chain_order, nsfw, watermark, data)
+                   VALUES ($1, $2, $3, $4, $5, $6)
+                   ON CONFLICT (kind, scope_id, chain_order, nsfw)
+                   DO UPDATE SET watermark = EXCLUDED.watermark, data = EXCLUDED.data;
+                """
+        await self.bot.pool.execute(query, *key, watermark, data)
+
+    async def _build_model(self, key: ModelKey) -> CachedModel:
+        self._pending[key] = pending = []
+        try:
+            cached = await self._load_model(key)
+        finally:
+            del self._pending[key]
+
+        # catch up on the batches that were flushed while loading
+        for rows, logged_at in pending:
+            await self._apply_batch(key, cached, rows, logged_at)
+
+        self.model_cache[key] = cached
+        while len(self.model_cache) > MODEL_CACHE_SIZE:
+            old_key, old = self.model_cache.popitem(last=False)
+            if old.dirty:
+                self.bot.loop.create_task(self._save_model(old_key, old))
+
+        if cached.dirty:
+            await self._save_model(key, cached)
+        return cached
+
+    async def _get_cached_model(self, key: ModelKey) -> CachedModel:
+        try:
+            cached = self.model_cache[key]
+        except KeyError:
+            pass
+        else:
+            self.model_cache.move_to_end(key)
+            return cached
+
+        # concurrent requests for the same model wait on the same training job
+        task = self._loading.get(key)
+        if task is None:
+            task = self._loading[key] = self.bot.loop.create_task(self._build_model(key))
+            task.add_done_callback(lambda _: self._loading.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def get_model(self, kind: str, scope_id: int, *, order: int, nsfw: bool) -> CachedModel:
+        cached = await self._get_cached_model((kind, scope_id, order, nsfw))
+        if not cached.chain:
+            raise commands.BadArgument('There was not enough message log data, please try again later.')
+        return cached
+
+    async def get_merged_model(self, kind: str, scope_ids: Iterable[int], *, order: int, nsfw: bool) -> CachedModel:
+        models = [await self._get_cached_model((kind, scope_id, order, nsfw)) for scope_id in scope_ids]
+        if not any(cached.chain for cached in models):
+            raise commands.BadArgument('There was not enough message log data, please try again later.')
+
+        # merging walks the chains from another thread, so keep them from being topped up meanwhile
+        async with AsyncExitStack() as stack:
+            for cached in models:
+                await stack.enter_async_context(cached.lock)
+            merged = await self.bot.loop.run_in_executor(None, MarkovChain.merged, [cached.chain for cached in models])
+        return CachedModel(merged, None)
+
+    async def _save_dirty_models(self):
+        for key, cached in list(self.model_cache.items()):
+            if not cached.dirty:
+                continue
+            # one bad model shouldn't keep the rest from being saved or stop the loop
+            try:
+                await self._save_model(key, cached)
+            except Exception:
+                cached.dirty = True
+                log.exception('Failed to save markov model %s', key)
+
+    @tasks.loop(minutes=10)
+    async def save_models(self):
+        """Persists the models that have been topped up since they were last saved."""
+        await self._save_dirty_models()
+
+    @save_models.before_loop
+    async def before_save_models(self):
+        await self.bot.wait_until_ready()
+
+    @save_models.after_loop
+    async def after_save_models(self):
+        # whatever is left over on unload
+        await self._save_dirty_models()
+
+    async def send_markov(self, ctx, model: CachedModel, order: int, *, seed: str = None, callable=make_sentence):
+        markov_call = partial(callable, model.chain, order, seed=seed)
+        # the chain can't be topped up while it's being walked from another thread
+        async with model.lock:
+            markov = await self.bot.loop.run_in_executor(None, markov_call)
 
         if not markov:
             raise commands.BadArgument('Markov could not be generated.')
@@ -99,11 +343,8 @@ class Markov(commands.Cog):
             if user != ctx.author and not data['public']:
                 return await ctx.send(f'User "{user}" has not made their logs public.')
 
-            query = "SELECT content FROM message_log WHERE user_id = $1 and nsfw <= $2 AND content LIKE '% %';"
             nsfw = ctx.channel.is_nsfw() if ctx.guild is not None else False
-            coro = ctx.db.fetch(query, user.id, nsfw)
-            args = (nsfw, 2, user.id)
-            model = await self.get_model(args, coro, order=2)
+            model = await self.get_model('user', user.id, order=2, nsfw=nsfw)
 
         await self.send_markov(ctx, model, 2)
 
@@ -125,11 +366,8 @@ class Markov(commands.Cog):
             if user != ctx.author and not data['public']:
                 return await ctx.send(f'User "{user}" has not made their logs public.')
 
-            query = "SELECT content FROM message_log WHERE user_id = $1 and nsfw <= $2 AND content LIKE '% %';"
             nsfw = ctx.channel.is_nsfw() if ctx.guild is not None else False
-            coro = ctx.db.fetch(query, user.id, nsfw)
-            args = (nsfw, 2, user.id)
-            model = await self.get_model(args, coro, order=2)
+            model = await self.get_model('user', user.id, order=2, nsfw=nsfw)
 
         await self.send_markov(ctx, model, 2, seed=seed.lower())
 
@@ -141,7 +379,6 @@ class Markov(commands.Cog):
             return await ctx.send('You need to specify at least two users.')
 
         is_nsfw = ctx.channel.is_nsfw() if ctx.guild is not None else False
-        coros = list()
 
         async with ctx.typing():
             for user in users:
@@ -156,11 +393,8 @@ class Markov(commands.Cog):
                 if user != ctx.author and not data['public']:
                     return await ctx.send(f'User "{user}" has not made their logs public.')
 
-                query = "SELECT content FROM message_log WHERE user_id = $1 and nsfw <= $2 AND content LIKE '% %';"
-                nsfw = ctx.channel.is_nsfw() if ctx.guild is not None else False
-                coros.append(ctx.db.fetch(query, user.id, nsfw))
-            args = (nsfw, 3) + tuple(user.id for user in users)
-            model = await self.get_model(args, *coros, order=3)
+            # each user's model is kept up to date on its own and merged on demand
+            model = await self.get_merged_model('user', (user.id for user in users), order=3, nsfw=is_nsfw)
 
         await self.send_markov(ctx, model, 3)
 
@@ -178,10 +412,7 @@ class Markov(commands.Cog):
         """Generates a markov chain based off messages in the server."""
         async with ctx.typing():
             is_nsfw = ctx.channel.is_nsfw() if ctx.guild is not None else False
-            args = (is_nsfw, 3, ctx.guild.id)
-            query = "SELECT content FROM message_log WHERE guild_id = $1 AND nsfw <= $2 AND content LIKE '% %'"
-            coro = ctx.db.fetch(query, ctx.guild.id, is_nsfw)
-            model = await self.get_model(args, coro, order=3)
+            model = await self.get_model('guild', ctx.guild.id, order=3, nsfw=is_nsfw)
         await self.send_markov(ctx, model, 3)
 
     @commands.command(aliases=['cgm'])
@@ -190,10 +421,7 @@ class Markov(commands.Cog):
         """Generate a markov chain code block."""
         async with ctx.typing():
             is_nsfw = ctx.channel.is_nsfw() if ctx.guild is not None else False
-            args = (is_nsfw, 2, ctx.guild.id)
-            query = "SELECT content FROM message_log WHERE guild_id = $1 AND nsfw <= $2 AND content LIKE '% %'"
-            coro = ctx.db.fetch(query, ctx.guild.id, is_nsfw)
-            model = await self.get_model(args, coro, order=2)
+            model = await self.get_model('guild', ctx.guild.id, order=2, nsfw=is_nsfw)
         await self.send_markov(ctx, model, 2, callable=make_code)
 
     @commands.command(aliases=['cum'])
@@ -214,11 +442,7 @@ class Markov(commands.Cog):
             if user != ctx.author and not data['public']:
                 return await ctx.send(f'User "{user}" has not made their logs public.')
             is_nsfw = ctx.channel.is_nsfw() if ctx.guild is not None else False
-            args = (is_nsfw, 2, user.id)
-
-            query = "SELECT content FROM message_log WHERE user_id = $1 and nsfw <= $2 AND content LIKE '% %';"
-            coro = ctx.db.fetch(query, user.id, is_nsfw)
-            model = await self.get_model(args, coro, order=2)
+            model = await self.get_model('user', user.id, order=2, nsfw=is_nsfw)
         await self.send_markov(ctx, model, 2, callable=make_code)
 
     @commands.command(aliases=['sgm'])
@@ -226,10 +450,7 @@ class Markov(commands.Cog):
         """Generate a markov chain based off messages in the server which starts with a given seed."""
         async with ctx.typing():
             is_nsfw = ctx.channel.is_nsfw() if ctx.guild is not None else False
-            args = (is_nsfw, 3, ctx.guild.id)
-            query = "SELECT content FROM message_log WHERE guild_id = $1 AND nsfw <= $2 AND content LIKE '% %'"
-            coro = ctx.db.fetch(query, ctx.guild.id, is_nsfw)
-            model = await self.get_model(args, coro, order=3)
+            model = await self.get_model('guild', ctx.guild.id, order=3, nsfw=is_nsfw)
         await self.send_markov(ctx, model, 3, seed=seed.lower())
 
     async def cog_command_error(self, ctx, error):
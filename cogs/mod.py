@@ -12,11 +12,14 @@ from discord.ext import commands, tasks
 import datetime
 import asyncio
 import argparse, shlex
+import itertools
 import logging
 import asyncpg
 import io
 from datetime import timezone
+from time import monotonic, perf_counter
 from .utils import checks, db, time, cache
+from .utils.formats import plural
 from collections import Counter, defaultdict
 from inspect import cleandoc
 
@@ -48,6 +51,16 @@ class GuildConfig(db.Table, table_name='guild_mod_config'):
     muted_members = db.Column(db.Array(db.Integer(big=True)))
     modlog = db.Column(db.Integer(big=True))
 
+class MassBanJobs(db.Table, table_name='mass_ban_jobs'):
+    id = db.PrimaryKeyColumn()
+    guild_id = db.Column(db.Integer(big=True), index=True)
+    channel_id = db.Column(db.Integer(big=True))
+    message_id = db.Column(db.Integer(big=True))
+    reason = db.Column(db.String)
+    total = db.Column(db.Integer)
+    failed = db.Column(db.Integer, default=0)
+    pending = db.Column(db.Array(db.Integer(big=True)))
+
 ## Configuration
 
 class ModConfig:
@@ -146,9 +159,49 @@ def safe_reason_append(base, to_append):
 
 ## Spam detector
 
-class CooldownByContent(commands.CooldownMapping):
-    def _bucket_key(self, message):
-        return (message.channel.id, message.content)
+class SlidingWindow:
+    """A compact sliding window rate counter.
+
+    Each key only stores the start of its current window and the hit counts
+    of the current and previous windows. The previous window's count is
+    weighted by how much of it still overlaps the sliding window, which is
+    a close enough approximation without storing every timestamp.
+    """
+
+    __slots__ = ('rate', 'per', '_buckets')
+
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        # key: [window_start, current_count, previous_count]
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def hit(self, key, now):
+        """Records a hit for ``key`` and returns whether it went over the rate."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._buckets[key] = [now, 1, 0]
+            return self.rate < 1
+
+        elapsed = now - bucket[0]
+        if elapsed >= self.per:
+            windows = int(elapsed // self.per)
+            bucket[2] = bucket[1] if windows == 1 else 0
+            bucket[1] = 0
+            bucket[0] += windows * self.per
+            elapsed -= windows * self.per
+
+        bucket[1] += 1
+        return bucket[2] * (1.0 - elapsed / self.per) + bucket[1] > self.rate
+
+    def evict(self, now):
+        """Drops the keys that haven't been hit for two full windows."""
+        cutoff = now - 2 * self.per
+        for key in [k for k, b in self._buckets.items() if b[0] < cutoff]:
+            del self._buckets[key]
 
 class SpamChecker:
     """This spam checker does a few things.
@@ -159,59 +212,184 @@ class SpamChecker:
     The second case is meant to catch alternating spam bots while the first one
     just catches regular singular spam bots.
     From experience these values aren't reached unless someone is actively spamming.
+
+    Every check reads the clock once per message and the buckets are keyed on
+    integers (content is hashed), so a bucket never holds on to a message.
+    A bucket is kept for two of its windows since the previous window still
+    counts towards the rate, after that :meth:`evict` drops it.
     """
     def __init__(self):
-        self.by_content = CooldownByContent.from_cooldown(15, 17.0, commands.BucketType.member)
-        self.by_user = commands.CooldownMapping.from_cooldown(10, 12.0, commands.BucketType.user)
+        # hash((channel_id, content))
+        self.by_content = SlidingWindow(15, 17.0)
+        # author_id
+        self.by_user = SlidingWindow(10, 12.0)
+        # channel_id
+        self.new_user = SlidingWindow(30, 35.0)
+        self.hit_and_run = SlidingWindow(10, 12.0)
         self.last_join = None
-        self.new_user = commands.CooldownMapping.from_cooldown(30, 35.0, commands.BucketType.channel)
 
-        # user_id flag mapping (for about 30 minutes)
-        self.fast_joiners = cache.ExpiringCache(seconds=1800.0)
-        self.hit_and_run = commands.CooldownMapping.from_cooldown(10, 12.0, commands.BucketType.channel)
+        # user_id: monotonic time the fast joiner flag expires (about 30 minutes)
+        self.fast_joiners = {}
 
-    def is_new(self, member):
-        now = datetime.datetime.utcnow()
-        seven_days_ago = now - datetime.timedelta(days=7)
-        ninety_days_ago = now - datetime.timedelta(days=90)
-        return member.created_at > ninety_days_ago and member.joined_at > seven_days_ago
+        # the "new member" cut-offs are refreshed once a minute instead
+        # of building datetimes for every message
+        self._cutoffs_refreshed = None
+        self._created_cutoff = None
+        self._joined_cutoff = None
+
+    def __len__(self):
+        return (len(self.by_content) + len(self.by_user) + len(self.new_user)
+                + len(self.hit_and_run) + len(self.fast_joiners))
+
+    def _refresh_cutoffs(self, now):
+        if self._cutoffs_refreshed is not None and now - self._cutoffs_refreshed < 60.0:
+            return
+
+        utcnow = datetime.datetime.utcnow()
+        self._cutoffs_refreshed = now
+        self._created_cutoff = utcnow - datetime.timedelta(days=90)
+        self._joined_cutoff = utcnow - datetime.timedelta(days=7)
+
+    def is_new(self, member, now=None):
+        self._refresh_cutoffs(monotonic() if now is None else now)
+        return member.created_at > self._created_cutoff and member.joined_at > self._joined_cutoff
 
     def is_spamming(self, message):
         if message.guild is None:
             return False
 
-        current = message.created_at.replace(tzinfo=timezone.utc).timestamp()
+        now = monotonic()
+        author_id = message.author.id
+        channel_id = message.channel.id
 
-        if message.author.id in self.fast_joiners:
-            bucket = self.hit_and_run.get_bucket(message)
-            if bucket.update_rate_limit(current):
+        expires = self.fast_joiners.get(author_id)
+        if expires is not None and expires > now:
+            if self.hit_and_run.hit(channel_id, now):
                 return True
 
-        if self.is_new(message.author):
-            new_bucket = self.new_user.get_bucket(message)
-            if new_bucket.update_rate_limit(current):
+        if self.is_new(message.author, now):
+            if self.new_user.hit(channel_id, now):
                 return True
 
-        user_bucket = self.by_user.get_bucket(message)
-        if user_bucket.update_rate_limit(current):
+        if self.by_user.hit(author_id, now):
             return True
 
-        content_bucket = self.by_content.get_bucket(message)
-        if content_bucket.update_rate_limit(current):
+        if self.by_content.hit(hash((channel_id, message.content)), now):
             return True
 
         return False
 
-def is_fast_join(self, member):
-    joined = member.joined_at or datetime.datetime.utcnow()
-    if self.last_join is None:
+    def is_fast_join(self, member):
+        joined = member.joined_at or datetime.datetime.utcnow()
+        if self.last_join is None:
+            self.last_join = joined
+            return False
+        is_fast = (joined - self.last_join).total_seconds() <= 2.0
         self.last_join = joined
-        return False
-    is_fast = (joined - self.last_join).total_seconds() <= 2.0
-    self.last_join = joined
-    if is_fast:
-        self.fast_joiners[member.id] = True
-    return is_fast
+        if is_fast:
+            self.fast_joiners[member.id] = monotonic() + 1800.0
+        return is_fast
+
+    def evict(self, now=None):
+        now = monotonic() if now is None else now
+        self.by_content.evict(now)
+        self.by_user.evict(now)
+        self.new_user.evict(now)
+        self.hit_and_run.evict(now)
+        for member_id in [k for k, expires in self.fast_joiners.items() if expires <= now]:
+            del self.fast_joiners[member_id]
+
+def compile_content_matcher(*, contains=(), starts=(), ends=(), pattern=None, any_=False):
+    """Folds the content filters into a single compiled regex.
+
+    Every option may have several values, any of which satisfy it. The
+    options themselves are combined with AND, or OR when ``any_`` is set,
+    using lookaheads so a message's content is matched in one call.
+
+    ``pattern`` is a regex that must match at the start of the content.
+    It's folded in too unless it carries its own inline flags, in which
+    case it's checked separately. Raises :exc:`re.error` if it's invalid.
+
+    Returns a predicate taking a message, or ``None`` if nothing was given.
+    """
+    def alternation(values):
+        return '|'.join(map(re.escape, values))
+
+    parts = []
+    if contains:
+        parts.append(fr'(?=[\s\S]*?(?:{alternation(contains)}))')
+    if starts:
+        parts.append(f'(?=(?:{alternation(starts)}))')
+    if ends:
+        parts.append(fr'(?=[\s\S]*(?:{alternation(ends)})\Z)')
+
+    separate = None
+    if pattern is not None:
+        separate = re.compile(pattern)
+        if separate.flags == re.compile('').flags:
+            parts.append(f'(?=(?:{pattern}))')
+            separate = None
+
+    if separate is None and not parts:
+        return None
+
+    combined = parts and re.compile(('|' if any_ else '').join(parts))
+    if separate is None:
+        return lambda m: combined.match(m.content) is not None
+    if not combined:
+        return lambda m: separate.match(m.content) is not None
+
+    op = any if any_ else all
+    return lambda m: op(r.match(m.content) is not None for r in (combined, separate))
+
+class HistoryScanner:
+    """Streams a channel's history through a single predicate.
+
+    History is fetched a page at a time, so the scan stops as soon as
+    ``target`` matches have been yielded rather than always walking
+    ``limit`` messages. With ``unique_authors`` only the first matching
+    message of every author is yielded.
+    """
+
+    def __init__(self, channel, *, limit, check=None, before=None, after=None, target=None, unique_authors=False):
+        self.channel = channel
+        self.limit = limit
+        self.check = check
+        self.before = before
+        self.after = after
+        self.target = target
+        self.unique_authors = unique_authors
+        self.scanned = 0
+        self.matched = 0
+        self.elapsed = 0.0
+
+    @property
+    def rate(self):
+        return self.scanned / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return f'Scanned {plural(self.scanned):message} in {self.elapsed:.2f}s ({self.rate:.0f} messages/s).'
+
+    async def __aiter__(self):
+        check = self.check
+        seen = set()
+        start = perf_counter()
+        try:
+            async for message in self.channel.history(limit=self.limit, before=self.before, after=self.after):
+                self.scanned += 1
+                if check is not None and not check(message):
+                    continue
+                if self.unique_authors:
+                    if message.author.id in seen:
+                        continue
+                    seen.add(message.author.id)
+
+                self.matched += 1
+                yield message
+                if self.target is not None and self.matched >= self.target:
+                    break
+        finally:
+            self.elapsed = perf_counter() - start
 
 ## Checks
 
@@ -263,6 +441,11 @@ class Moderation(commands.Cog):
         self.message_batches = defaultdict(list)
         self._batch_message_lock = asyncio.Lock(loop=bot.loop)
         self.bulk_send_messages.start()
+        self.evict_spam_buckets.start()
+
+        # job_id: asyncio.Task for mass bans currently running
+        self._ban_jobs = {}
+        self._resume_task = self.bot.loop.create_task(self.resume_ban_jobs())
 
     def __repr__(self):
         return '<cogs.Moderation>'
@@ -270,7 +453,11 @@ class Moderation(commands.Cog):
     def cog_unload(self):
         self.batch_updates.stop()
         self.bulk_send_messages.stop()
+        self.evict_spam_buckets.cancel()
         self.task.cancel()
+        self._resume_task.cancel()
+        for task in self._ban_jobs.values():
+            task.cancel()
 
     async def _prepare_modlogs(self):
         async with self.bot.pool.acquire() as con:
@@ -327,6 +514,16 @@ class Moderation(commands.Cog):
         async with self._batch_lock:
             await self.bulk_insert()
 
+    # a bucket lives for two of its windows, sweeping often keeps
+    # the ones that outlived that from piling up during a raid
+    @tasks.loop(seconds=15.0)
+    async def evict_spam_buckets(self):
+        now = monotonic()
+        for guild_id, checker in list(self._spam_check.items()):
+            checker.evict(now)
+            if len(checker) == 0 and checker.last_join is None:
+                del self._spam_check[guild_id]
+
     @tasks.loop(seconds=10.0)
     async def bulk_send_messages(self):
         async with self._batch_message_lock:
@@ -361,7 +558,7 @@ class Moderation(commands.Cog):
         if config.raid_mode != RaidMode.strict.value:
             return
 
-        checker = self._spam_check[guild.id]
+        checker = self._spam_check[guild_id]
         if not checker.is_spamming(message):
             return
 
@@ -778,6 +975,98 @@ class Moderation(commands.Cog):
         await ctx.guild.ban(member, reason=reason)
         await ctx.send('\N{OK HAND SIGN}')
 
+    # how many bans are in flight at once, discord.py still
+    # queues them behind the ban route's rate limit bucket
+    BAN_CONCURRENCY = 5
+    BAN_PROGRESS_INTERVAL = 5.0
+
+    async def resume_ban_jobs(self):
+        await self.bot.wait_until_ready()
+        query = "SELECT * FROM mass_ban_jobs;"
+        records = await self.bot.pool.fetch(query)
+        for record in records:
+            guild = self.bot.get_guild(record['guild_id'])
+            channel = guild and guild.get_channel(record['channel_id'])
+            if channel is None:
+                await self.bot.pool.execute("DELETE FROM mass_ban_jobs WHERE id=$1;", record['id'])
+                continue
+
+            log.info('Resuming mass ban job %s in guild ID %s (%s pending)',
+                     record['id'], guild.id, len(record['pending']))
+            self.start_ban_job(record['id'], channel, record['pending'], reason=record['reason'],
+                               total=record['total'], failed=record['failed'], message_id=record['message_id'])
+
+    async def create_ban_job(self, ctx, member_ids, *, reason):
+        """Persists and starts a mass ban, returning its task.
+
+        The job is stored in ``mass_ban_jobs`` so that it can be picked up
+        again by :meth:`resume_ban_jobs` if the bot restarts part way through.
+        """
+        member_ids = list(dict.fromkeys(member_ids))
+        progress = await ctx.send(f'Banning {plural(len(member_ids)):member}...')
+        query = """INSERT INTO mass_ban_jobs (guild_id, channel_id, message_id, reason, total, failed, pending)
+                   VALUES ($1, $2, $3, $4, $5, 0, $6)
+                   RETURNING id;
+                """
+        job_id = await self.bot.pool.fetchval(query, ctx.guild.id, ctx.channel.id, progress.id, reason,
+                                              len(member_ids), member_ids)
+        return self.start_ban_job(job_id, ctx.channel, member_ids, reason=reason, total=len(member_ids),
+                                  failed=0, message_id=progress.id)
+
+    def start_ban_job(self, job_id, channel, member_ids, *, reason, total, failed, message_id):
+        task = self.bot.loop.create_task(self.run_ban_job(job_id, channel, member_ids, reason=reason,
+                                                          total=total, failed=failed, message_id=message_id))
+        self._ban_jobs[job_id] = task
+        task.add_done_callback(lambda _: self._ban_jobs.pop(job_id, None))
+        return task
+
+    async def run_ban_job(self, job_id, channel, member_ids, *, reason, total, failed, message_id):
+        guild = channel.guild
+        pending = set(member_ids)
+        progress = channel.get_partial_message(message_id)
+        semaphore = asyncio.Semaphore(self.BAN_CONCURRENCY)
+
+        async def ban(member_id):
+            nonlocal failed
+            async with semaphore:
+                for attempt in range(3):
+                    try:
+                        await guild.ban(discord.Object(id=member_id), reason=reason)
+                    except discord.HTTPException as e:
+                        # discord.py already retries 429s a few times on its
+                        # own, so only back off further if it gave up
+                        if e.status == 429 and attempt < 2:
+                            await asyncio.sleep(2.0 ** (attempt + 1))
+                            continue
+                        failed += 1
+                    break
+            pending.discard(member_id)
+
+        async def report():
+            done = total - len(pending)
+            content = f'Banned {done - failed}/{total} members ({failed} failed, {len(pending)} remaining).'
+            try:
+                await progress.edit(content=content)
+            except discord.HTTPException:
+                pass
+
+        async def checkpoint():
+            query = "UPDATE mass_ban_jobs SET pending=$2, failed=$3 WHERE id=$1;"
+            while pending:
+                await asyncio.sleep(self.BAN_PROGRESS_INTERVAL)
+                await self.bot.pool.execute(query, job_id, list(pending), failed)
+                await report()
+
+        checkpointer = self.bot.loop.create_task(checkpoint())
+        try:
+            await asyncio.gather(*(ban(member_id) for member_id in member_ids))
+        finally:
+            checkpointer.cancel()
+
+        await self.bot.pool.execute("DELETE FROM mass_ban_jobs WHERE id=$1;", job_id)
+        await report()
+        return total - failed
+
     @commands.command()
     @commands.guild_only()
     @checks.has_permissions(ban_members=True)
@@ -799,14 +1088,8 @@ class Moderation(commands.Cog):
         if not confirm:
             return await ctx.send('Aborting.')
 
-        failed = 0
-        for member in members:
-            try:
-                await ctx.guild.ban(member, reason=reason)
-            except discord.HTTPException:
-                failed += 1
-
-        await ctx.send(f'Banned {total_members - failed}/{total_members} members.')
+        job = await self.create_ban_job(ctx, (m.id for m in members), reason=reason)
+        await job
 
     @commands.command()
     @commands.guild_only()
@@ -827,6 +1110,7 @@ class Moderation(commands.Cog):
         `--no-avatar`: Matches users who have no avatar. (no arguments)
         `--no-roles`: Matches users that have no role. (no arguments)
         `--show`: Show members instead of banning them (no arguments).
+        `--max`: Stop once this many members have been found.
         Message history filters (Requires `--channel`):
         `--contains`: A substring to search for in the message.
         `--starts`: A substring to search if the message starts with.
@@ -871,93 +1155,88 @@ class Moderation(commands.Cog):
         parser.add_argument('--files', action='store_const', const=lambda m: len(m.attachments))
         parser.add_argument('--after', type=int)
         parser.add_argument('--before', type=int)
+        parser.add_argument('--max', type=int)
 
         try:
             args = parser.parse_args(shlex.split(args))
         except Exception as e:
             return await ctx.send(str(e))
 
-        members = []
-
-        if args.channel:
-            channel = await commands.TextChannelConverter().convert(ctx, args.channel)
-            before = args.before and discord.Object(id=args.before)
-            after = args.after and discord.Object(id=args.after)
-            predicates = []
-            if args.contains:
-                predicates.append(lambda m: args.contains in m.content)
-            if args.starts:
-                predicates.append(lambda m: m.content.startswith(args.starts))
-            if args.ends:
-                predicates.append(lambda m: m.content.endswith(args.ends))
-            if args.match:
-                try:
-                    _match = re.compile(args.match)
-                except re.error as e:
-                    return await ctx.send(f'Invalid regex passed to `--match`: {e}')
-                else:
-                    predicates.append(lambda m, x=_match: x.match(m.content))
-            if args.embeds:
-                predicates.append(args.embeds)
-            if args.files:
-                predicates.append(args.files)
-
-            async for message in channel.history(limit=min(max(1, args.search), 2000), before=before, after=after):
-                if all(p(message) for p in predicates):
-                    members.append(message.author)
-        else:
-            if ctx.guild.chunked:
-                members = ctx.guild.members
-            else:
-                async with ctx.typing():
-                    await ctx.guild.chunk(cache=True)
-                members = ctx.guild.members
+        if args.max is not None and args.max < 1:
+            return await ctx.send('`--max` must be a positive number.')
 
         # member filters
-        predicates = [
-            lambda m: isinstance(m, discord.Member) and can_execute_action(ctx, author, m), # Only if applicable
-            lambda m: not m.bot, # No bots
-            lambda m: m.discriminator != '0000', # No deleted users
-        ]
-
         converter = commands.MemberConverter()
+        regex = None
         if args.regex:
             try:
-                _regex = re.compile(args.regex)
+                regex = re.compile(args.regex)
             except re.error as e:
                 return await ctx.send(f'Invalid regex passed to `--regex`: {e}')
-            else:
-                predicates.append(lambda m, x=_regex: x.match(m.name))
-
-        if args.no_avatar:
-            predicates.append(lambda m: m.avatar is None)
-        if args.no_roles:
-            predicates.append(lambda m: len(getattr(m, 'roles', [])) <= 1)
 
         now = datetime.datetime.utcnow()
-        if args.created:
-            def created(member, *, offset=now - datetime.timedelta(minutes=args.created)):
-                return member.created_at > offset
-            predicates.append(created)
-        if args.joined:
-            def joined(member, *, offset=now - datetime.timedelta(minutes=args.joined)):
-                if isinstance(member, discord.User):
-                    # If the member is a user then they left already
-                    return True
-                return member.joined_at and member.joined_at > offset
-            predicates.append(joined)
+        created_offset = args.created and now - datetime.timedelta(minutes=args.created)
+        joined_offset = args.joined and now - datetime.timedelta(minutes=args.joined)
+
+        joined_after = joined_before = None
         if args.joined_after:
-            _joined_after_member = await converter.convert(ctx, str(args.joined_after))
-            def joined_after(member, *, _other=_joined_after_member):
-                return member.joined_at and _other.joined_at and member.joined_at > _other.joined_at
-            predicates.append(joined_after)
+            joined_after = (await converter.convert(ctx, str(args.joined_after))).joined_at
         if args.joined_before:
-            _joined_before_member = await converter.convert(ctx, str(args.joined_before))
-            def joined_before(member, *, _other=_joined_before_member):
-                return member.joined_at and _other.joined_at and member.joined_at < _other.joined_at
-            predicates.append(joined_before)
+            joined_before = (await converter.convert(ctx, str(args.joined_before))).joined_at
+
+        # everything above is resolved once, so checking a member
+        # is a single function call with early exits
+        def predicate(m):
+            if not isinstance(m, discord.Member) or not can_execute_action(ctx, author, m):
+                return False
+            if m.bot or m.discriminator == '0000':  # No bots or deleted users
+                return False
+            if regex is not None and not regex.match(m.name):
+                return False
+            if args.no_avatar and m.avatar is not None:
+                return False
+            if args.no_roles and len(m.roles) > 1:
+                return False
+            if created_offset and not m.created_at > created_offset:
+                return False
+            if joined_offset and not (m.joined_at and m.joined_at > joined_offset):
+                return False
+            if args.joined_after and not (m.joined_at and joined_after and m.joined_at > joined_after):
+                return False
+            if args.joined_before and not (m.joined_at and joined_before and m.joined_at < joined_before):
+                return False
+            return True
+
+        if args.channel:
+            channel = await commands.TextChannelConverter().convert(ctx, args.channel)
+            before = args.before and discord.Object(id=args.before)
+            after = args.after and discord.Object(id=args.after)
+            try:
+                content = compile_content_matcher(contains=args.contains and [args.contains],
+                                                  starts=args.starts and [args.starts],
+                                                  ends=args.ends and [args.ends],
+                                                  pattern=args.match)
+            except re.error as e:
+                return await ctx.send(f'Invalid regex passed to `--match`: {e}')
+
+            # the member checks go last so that they are only
+            # run for messages that already passed the cheap ones
+            predicates = [p for p in (content, args.embeds, args.files) if p is not None]
+            predicates.append(lambda m: predicate(m.author))
+            def check(m):
+                return all(p(m) for p in predicates)
+
+            scanner = HistoryScanner(channel, limit=min(max(1, args.search), 2000), before=before, after=after,
+                                     check=check, target=args.max, unique_authors=True)
+            async with ctx.typing():
+                members = {message.author async for message in scanner}
+            await ctx.send(scanner.summary())
+        else:
+            if not ctx.guild.chunked:
+                async with ctx.typing():
+                    await ctx.guild.chunk(cache=True)
+            members = set(itertools.islice(filter(predicate, ctx.guild.members), args.max))
 
-        members = {m for m in members if all(p(m) for p in predicates)}
         if len(members) == 0:
             return await ctx.send('No members found matching criteria.')
 
@@ -977,16 +1256,9 @@ class Moderation(commands.Cog):
         if not confirm:
             return await ctx.send('Aborting.')
 
-        count = 0
-        for member in members:
-            try:
-                await ctx.guild.ban(member, reason=reason)
-            except discord.HTTPException:
-                pass
-            else:
-                count += 1
-
-        await ctx.send(f'Banned {count}/{len(members)}')
+        await ctx.release()
+        job = await self.create_ban_job(ctx, (m.id for m in members), reason=reason)
+        await job
 
     @commands.command()
     @commands.guild_only()
@@ -1221,7 +1493,7 @@ class Moderation(commands.Cog):
         if ctx.invoked_subcommand is None:
             await ctx.send_help(ctx.command)
 
-    async def do_removal(self, ctx, limit, predicate, *, before=None, after=None):
+    async def do_removal(self, ctx, limit, predicate, *, before=None, after=None, target=None):
         if limit > 2000:
             return await ctx.send(f'Too many messages to search given ({limit}/2000)')
 
@@ -1233,16 +1505,38 @@ class Moderation(commands.Cog):
         if after is not None:
             after = discord.Object(id=after)
 
+        # messages are deleted a chunk at a time while the history is
+        # still streaming, older than 14 days can't be bulk deleted
+        scanner = HistoryScanner(ctx.channel, limit=limit, check=predicate, before=before, after=after, target=target)
+        bulk_cutoff = discord.utils.time_snowflake(datetime.datetime.utcnow() - datetime.timedelta(days=14))
+        spammers = Counter()
+        chunk = []
+
+        async def flush():
+            await ctx.channel.delete_messages(chunk)
+            spammers.update(m.author.display_name for m in chunk)
+            chunk.clear()
+
         try:
-            deleted = await ctx.channel.purge(limit=limit, before=before, after=after, check=predicate)
+            async for message in scanner:
+                if message.id < bulk_cutoff:
+                    await message.delete()
+                    spammers[message.author.display_name] += 1
+                    continue
+
+                chunk.append(message)
+                if len(chunk) == 100:
+                    await flush()
+
+            if chunk:
+                await flush()
         except discord.Forbidden as e:
             return await ctx.send('I do not have permissions to delete messages.')
         except discord.HTTPException as e:
             return await ctx.send(f'Error: {e} (try a smaller search?)')
 
-        spammers = Counter(m.author.display_name for m in deleted)
-        deleted = len(deleted)
-        messages = [f'{deleted} message{" was" if deleted == 1 else "s were"} removed.']
+        deleted = sum(spammers.values())
+        messages = [f'{deleted} message{" was" if deleted == 1 else "s were"} removed.', scanner.summary()]
         if deleted:
             messages.append('')
             spammers = sorted(spammers.items(), key=lambda t: t[1], reverse=True)
@@ -1337,6 +1631,7 @@ class Moderation(commands.Cog):
         `--starts`: A substring to search if the message starts with.
         `--ends`: A substring to search if the message ends with.
         `--search`: How many messages to search. Default 100. Max 2000.
+        `--max`: Stop once this many messages have been removed.
         `--after`: Messages must come after this message ID.
         `--before`: Messages must come before this message ID.
         Flag options (no arguments):
@@ -1361,6 +1656,7 @@ class Moderation(commands.Cog):
         parser.add_argument('--files', action='store_const', const=lambda m: len(m.attachments))
         parser.add_argument('--reactions', action='store_const', const=lambda m: len(m.reactions))
         parser.add_argument('--search', type=int)
+        parser.add_argument('--max', type=int)
         parser.add_argument('--after', type=int)
         parser.add_argument('--before', type=int)
 
@@ -1370,6 +1666,9 @@ class Moderation(commands.Cog):
             await ctx.send(str(e))
             return
 
+        if args.max is not None and args.max < 1:
+            return await ctx.send('`--max` must be a positive number.')
+
         predicates = []
         if args.bot:
             predicates.append(args.bot)
@@ -1400,14 +1699,9 @@ class Moderation(commands.Cog):
 
             predicates.append(lambda m: m.author in users)
 
-        if args.contains:
-            predicates.append(lambda m: any(sub in m.content for sub in args.contains))
-
-        if args.starts:
-            predicates.append(lambda m: any(m.content.startswith(s) for s in args.starts))
-
-        if args.ends:
-            predicates.append(lambda m: any(m.content.endswith(s) for s in args.ends))
+        content = compile_content_matcher(contains=args.contains, starts=args.starts, ends=args.ends, any_=args._or)
+        if content is not None:
+            predicates.append(content)
 
         op = all if not args._or else any
         def predicate(m):
@@ -1424,7 +1718,7 @@ class Moderation(commands.Cog):
             args.search = 100
 
         args.search = max(0, min(2000, args.search)) # clamp from 0-2000
-        await self.do_removal(ctx, args.search, predicate, before=args.before, after=args.after)
+        await self.do_removal(ctx, args.search, predicate, before=args.before, after=args.after, target=args.max)
 
     # Mute related stuff
 
@@ -4,6 +4,7 @@ import discord
 import asyncio
 import asyncpg
 import datetime
+import heapq
 import textwrap
 
 class Reminders(db.Table):
@@ -57,10 +58,17 @@ class Timer:
 class Reminder(commands.Cog):
     """Reminders to do something"""
 
+    # how far ahead timers are loaded into memory at once
+    PRELOAD_WINDOW = datetime.timedelta(hours=1)
+
     def __init__(self, bot):
         self.bot = bot
-        self._have_data = asyncio.Event(loop=bot.loop)
-        self._current_timer = None
+        # (expires, id) pairs, entries whose ID is no longer
+        # in self._timers were deleted and are skipped when popped
+        self._heap = []
+        self._timers = {}
+        self._loaded_until = None
+        self._wakeup = asyncio.Event()
         self._task = bot.loop.create_task(self.dispatch_timers())
 
     def cog_unload(self):
@@ -72,55 +80,80 @@ class Reminder(commands.Cog):
         if isinstance(error, commands.TooManyArguments):
             await ctx.send(f"You called the {ctx.commands.name} command with too many arguments.")
 
-    async def get_active_timer(self, *, connection=None, days=7):
-        query = "SELECT * FROM reminders WHERE expires < (CURRENT_DATE + $1::interval) ORDER BY expires LIMIT 1;"
+    def _push_timer(self, timer):
+        self._timers[timer.id] = timer
+        heapq.heappush(self._heap, (timer.expires, timer.id))
+
+    async def preload_timers(self, *, connection=None):
+        """Loads every timer expiring before the end of the next window."""
+        until = datetime.datetime.utcnow() + self.PRELOAD_WINDOW
+        query = "SELECT * FROM reminders WHERE expires < $1 ORDER BY expires;"
         con = connection or self.bot.pool
 
-        record = await con.fetchrow(query, datetime.timedelta(days=days))
-        return Timer(record=record) if record else None
+        # moved up front so that create_timer pushes anything inserted while
+        # the query runs, the query's snapshot might not include it
+        previous, self._loaded_until = self._loaded_until, until
+        try:
+            records = await con.fetch(query, until)
+        except BaseException:
+            self._loaded_until = previous
+            raise
+
+        for record in records:
+            if record['id'] not in self._timers:
+                self._push_timer(Timer(record=record))
 
-    async def wait_for_active_timers(self, *, connection=None, days=7):
-        async with self.bot.pool.acquire() as con:
-            timer = await self.get_active_timer(connection=con, days=days)
+    def _pop_due_timers(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, timer_id = heapq.heappop(self._heap)
+            timer = self._timers.pop(timer_id, None)
             if timer is not None:
-                self._have_data.set()
-                return timer
+                due.append(timer)
+        return due
 
-            self._have_data.clear()
-            self._current_timer = None
-            await self._have_data.wait()
-            return await self.get_active_timer(connection=con, days=days)
+    async def call_timers(self, timers):
+        # timers deleted in the meantime aren't returned, so they don't fire
+        query = "DELETE FROM reminders WHERE id = ANY($1::int[]) RETURNING id;"
+        records = await self.bot.pool.fetch(query, [timer.id for timer in timers])
+        deleted = {record[0] for record in records}
 
-    async def call_timer(self, timer):
-        # delete the timer
-        query = "DELETE FROM reminders WHERE id = $1;"
-        await self.bot.pool.execute(query, timer.id)
-
-        # dispatch the event
-        event_name = f'{timer.event}_timer_complete'
-        self.bot.dispatch(event_name, timer)
+        # every listener gets its own task so these all run concurrently
+        for timer in timers:
+            if timer.id in deleted:
+                self.bot.dispatch(f'{timer.event}_timer_complete', timer)
 
     async def dispatch_timers(self):
         await self.bot.wait_until_ready()
         try:
             while not self.bot.is_closed():
-                # can only use asyncio.sleep for up to ~48 days reliably
-                # so we're gonna cap it off at 40 days
-                # see: http://bugs/python.org/issue20493
-                timer = self._current_timer = await self.wait_for_active_timers(days=40)
                 now = datetime.datetime.utcnow()
-
-                if timer.expires >= now:
-                    to_sleep = (timer.expires - now).total_seconds()
-                    await asyncio.sleep(to_sleep)
-
-                await self.call_timer(timer)
+                if self._loaded_until is None or now >= self._loaded_until:
+                    await self.preload_timers()
+
+                due = self._pop_due_timers(now)
+                if due:
+                    await self.call_timers(due)
+                    continue
+
+                wake_at = self._loaded_until
+                if self._heap:
+                    wake_at = min(wake_at, self._heap[0][0])
+
+                # create_timer sets this when an earlier timer comes in
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=(wake_at - now).total_seconds())
+                except asyncio.TimeoutError:
+                    pass
         except asyncio.CancelledError:
             raise
         except (OSError, discord.ConnectionClosed, asyncpg.PostgresConnectionError):
+            # anything popped but not deleted is picked up again by the reload
+            self._loaded_until = None
             self._task.cancel()
             self._task = self.bot.loop.create_task(self.dispatch_timers())
-    
+
     async def short_timer_optimisation(self, seconds, timer):
         await asyncio.sleep(seconds)
         event_name = f'{timer.event}_timer_complete'
@@ -179,18 +212,35 @@ class Reminder(commands.Cog):
         row = await connection.fetchrow(query, event, { "args": args, "kwargs": kwargs }, when, now)
         timer.id = row[0]
 
-        # only set the data check if it can be waited on
-        if delta <= (86400 * 40): # 40 days
-            self._have_data.set()
+        # anything past the loaded window is picked up by a later preload
+        if self._loaded_until is not None and when < self._loaded_until:
+            if db.in_transaction(connection):
+                # the row isn't visible to the dispatcher until it's committed,
+                # and it never will be if the transaction is rolled back
+                self.bot.loop.create_task(self._push_after_commit(timer, connection))
+            else:
+                self._push_timer(timer)
+                self._wakeup.set()
 
-        # check if this timer is earlier than our currently run timer
-        if self._current_timer and when < self._current_timer.expires:
-            # cancel the task and re-run it
-            self._task.cancel()
-            self._task = self.bot.loop.create_task(self.dispatch_timers())
-        
         return timer
 
+    async def _push_after_commit(self, timer, connection):
+        # asyncpg has no commit hook, so wait for the caller's transaction to end,
+        # a connection released back to the pool counts as ended
+        while db.in_transaction(connection):
+            if self._loaded_until is None or timer.expires >= self._loaded_until:
+                # it's up to a later preload now
+                return
+            await asyncio.sleep(0.5)
+
+        if timer.id in self._timers:
+            return
+
+        query = "SELECT 1 FROM reminders WHERE id=$1;"
+        if await self.bot.pool.fetchval(query, timer.id):
+            self._push_timer(timer)
+            self._wakeup.set()
+
     @commands.group(aliases=['timer', 'remind'], usage='<when>', invoke_without_command=True)
     async def reminder(self, ctx, *, when: time.UserFriendlyTime(commands.clean_content, default='\u2026')):
         """Reminds you of something after a certain amount of time.
@@ -261,10 +311,8 @@ class Reminder(commands.Cog):
         if status == 'DELETE 0':
             return await ctx.send("Could not delete any reminders with that ID")
 
-        # if the current timer is being deleted
-        if self._current_timer and self._current_timer.id == id:
-            self._task.cancel()
-            self._task = self.bot.loop.create_task(self.dispatch_timers())
+        # its heap entry is skipped once it comes up
+        self._timers.pop(id, None)
 
         await ctx.send("Successfully deleted reminder.")
 
@@ -1,11 +1,13 @@
+import asyncio
+import functools
 import inspect
-import io
+import logging
 import os
 import re
-import zlib
 from asyncio import TimeoutError
+from pathlib import Path
 
-from aiohttp import ClientTimeout
+from aiohttp import ClientError, ClientTimeout
 
 import discord
 import discord.http
@@ -18,77 +20,40 @@ from lxml import etree
 
 from discord.ext import commands, tasks
 from .utils import fuzzy
-
-
-class SphinxObjectFileReader:
-    """ A Sphinx file reader. """
-    # Inspired by Sphinx's InventoryFileReader
-    BUFSIZE = 16 * 1024
-
-    def __init__(self, buffer):
-        self.stream = io.BytesIO(buffer)
-
-    def readline(self):
-        return self.stream.readline().decode('utf-8')
-
-    def skipline(self):
-        self.stream.readline()
-
-    def read_compressed_chunks(self):
-        decompressor = zlib.decompressobj()
-        while True:
-            chunk = self.stream.read(self.BUFSIZE)
-            if len(chunk) == 0:
-                break
-            yield decompressor.decompress(chunk)
-        yield decompressor.flush()
-
-    def read_compressed_lines(self):
-        buf = b''
-        for chunk in self.read_compressed_chunks():
-            buf += chunk
-            pos = buf.find(b'\n')
-            while pos != -1:
-                yield buf[:pos].decode('utf-8')
-                buf = buf[pos + 1:]
-                pos = buf.find(b'\n')
-
+from .utils.inventory import parse_inventory
+
+log = logging.getLogger(__name__)
+
+RTFM_PAGE_TYPES = {
+    'discord.py': 'https://discordpy.readthedocs.io/en/latest',
+    'discord.py-jp': 'https://discordpy.readthedocs.io/ja/latest',
+    'discord.py-master': 'https://discordpy.readthedocs.io/en/master',
+    #'discord.py-master-jp': 'https://discordpy.readthedocs.io/ja/master',
+    'python': 'https://docs.python.org/3',
+    'python-jp': 'https://docs.python.org/ja/3',
+    'asyncpg': 'https://magicstack.github.io/asyncpg/current',
+    'twitchio': 'https://twitchio.readthedocs.io/en/latest',
+    'aiohttp': 'https://docs.aiohttp.org/en/stable',
+    'wavelink': 'https://wavelink.readthedocs.io/en/latest'
+}
+
+# objects.inv files are kept here along with their ETag
+RTFM_CACHE_DIRECTORY = Path('rtfm_cache')
 
 class RTFX(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self._rtfm_lock = asyncio.Lock()
+        # key: SubsequenceIndex, built on first use
+        self._rtfm_index = {}
 
-    def parse_object_inv(self, stream, url):
+    def parse_object_inv(self, inventory, url):
         # key: URL
         # n.b.: key doesn't have `discord` or `discord.ext.commands` namespaces
         result = {}
 
-        # first line is version info
-        inv_version = stream.readline().rstrip()
-
-        if inv_version != '# Sphinx inventory version 2':
-            raise RuntimeError('Invalid objects.inv file version.')
-
-        # next line is "# Project: <name>"
-        # then after that is "# Version: <version>"
-        projname = stream.readline().rstrip()[11:]
-        version = stream.readline().rstrip()[11:]
-
-        # next line says if it's a zlib header
-        line = stream.readline()
-        if 'zlib' not in line:
-            raise RuntimeError(
-                'Invalid objects.inv file, not z-lib compatible.')
-
-        # This code mostly comes from the Sphinx repository.
-        entry_regex = re.compile(
-            r'(?x)(.+?)\s+(\S*:\S*)\s+(-?\d+)\s+(\S+)\s+(.*)')
-        for line in stream.read_compressed_lines():
-            match = entry_regex.match(line.rstrip())
-            if not match:
-                continue
-
-            name, directive, _, location, dispname = match.groups()
+        projname = inventory.project
+        for name, directive, _, location, dispname in inventory.entries:
             domain, _, subdirective = directive.partition(':')
             if directive == 'py:module' and name in result:
                 # From the Sphinx Repository:
@@ -102,9 +67,6 @@ class RTFX(commands.Cog):
             if directive == 'std:doc':
                 subdirective = 'label'
 
-            if location.endswith('$'):
-                location = location[:-1] + name
-
             key = name if dispname == '-' else dispname
             prefix = f'{subdirective}:' if domain == 'std' else ''
 
@@ -116,41 +78,95 @@ class RTFX(commands.Cog):
 
         return result
 
+    def _read_cached_inventory(self, path, etag_path):
+        # returns (data, etag), either of which may be None
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None, None
+
+        try:
+            return data, etag_path.read_text(encoding='utf-8')
+        except FileNotFoundError:
+            return data, None
+
+    def _write_cached_inventory(self, path, etag_path, data, etag):
+        RTFM_CACHE_DIRECTORY.mkdir(exist_ok=True)
+        path.write_bytes(data)
+        if etag:
+            etag_path.write_text(etag, encoding='utf-8')
+        elif etag_path.exists():
+            etag_path.unlink()
+
+    async def fetch_inventory(self, key, page):
+        """Fetches the objects.inv of a page, revalidating the copy on disk if there is one."""
+        path = RTFM_CACHE_DIRECTORY / f'{key}.inv'
+        etag_path = path.with_suffix('.etag')
+        cached, etag = await self.bot.loop.run_in_executor(None, self._read_cached_inventory, path, etag_path)
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+
+        try:
+            async with self.bot.session.get(page + '/objects.inv', headers=headers) as resp:
+                if resp.status == 304:
+                    return cached
+
+                if resp.status == 200:
+                    data = await resp.read()
+                    try:
+                        await self.bot.loop.run_in_executor(None, self._write_cached_inventory, path, etag_path,
+                                                            data, resp.headers.get('ETag'))
+                    except OSError:
+                        log.warning('Could not cache the %s inventory on disk.', key, exc_info=True)
+                    return data
+
+                error = 'Cannot build rtfm lookup table, try again later. Code {} page {}'.format(resp.status, resp.url)
+        except (OSError, TimeoutError, ClientError) as e:
+            error = f'Cannot build rtfm lookup table, try again later. {e.__class__.__name__} page {page}'
+
+        # a stale inventory is better than none at all
+        if cached is not None:
+            log.warning('%s, using the cached copy.', error)
+            return cached
+        raise RuntimeError(error)
+
     async def build_rtfm_lookup_table(self, page_types):
-        cache = {}
-        for key, page in page_types.items():
-            # sub = cache[key] = {}
-            async with self.bot.session.get(page + '/objects.inv') as resp:
-                if resp.status != 200:
-                    raise RuntimeError(
-                        'Cannot build rtfm lookup table, try again later. Code {} page {}'.format(resp.status, resp.url))
+        keys = list(page_types)
+        inventories = await asyncio.gather(*(self.fetch_inventory(key, page_types[key]) for key in keys))
 
-                stream = SphinxObjectFileReader(await resp.read())
-                cache[key] = self.parse_object_inv(stream, page)
+        cache = {}
+        for key, data in zip(keys, inventories):
+            inventory = await self.bot.loop.run_in_executor(None, parse_inventory, data)
+            cache[key] = self.parse_object_inv(inventory, page_types[key])
 
         self._rtfm_cache = cache
+        self._rtfm_index.clear()
 
-    async def do_rtfm(self, ctx, key, obj):
-        page_types = {
-            'discord.py': 'https://discordpy.readthedocs.io/en/latest',
-            'discord.py-jp': 'https://discordpy.readthedocs.io/ja/latest',
-            'discord.py-master': 'https://discordpy.readthedocs.io/en/master',
-            #'discord.py-master-jp': 'https://discordpy.readthedocs.io/ja/master',
-            'python': 'https://docs.python.org/3',
-            'python-jp': 'https://docs.python.org/ja/3',
-            'asyncpg': 'https://magicstack.github.io/asyncpg/current',
-            'twitchio': 'https://twitchio.readthedocs.io/en/latest',
-            'aiohttp': 'https://docs.aiohttp.org/en/stable',
-            'wavelink': 'https://wavelink.readthedocs.io/en/latest'
-        }
+    async def get_rtfm_index(self, key):
+        async with self._rtfm_lock:
+            if not hasattr(self, '_rtfm_cache'):
+                await self.build_rtfm_lookup_table(RTFM_PAGE_TYPES)
+
+            try:
+                return self._rtfm_index[key]
+            except KeyError:
+                pass
 
+            # building it takes a moment for the larger inventories
+            items = list(self._rtfm_cache[key].items())
+            build = functools.partial(fuzzy.SubsequenceIndex, items, key=lambda t: t[0])
+            index = self._rtfm_index[key] = await self.bot.loop.run_in_executor(None, build)
+            return index
+
+    async def do_rtfm(self, ctx, key, obj):
         if obj is None:
-            await ctx.send(page_types[key])
+            await ctx.send(RTFM_PAGE_TYPES[key])
             return
 
-        if not hasattr(self, '_rtfm_cache'):
+        if key not in self._rtfm_index:
             await ctx.trigger_typing()
-            await self.build_rtfm_lookup_table(page_types)
+        index = await self.get_rtfm_index(key)
 
         obj = re.sub(
             r'^(?:discord\.(?:ext\.)?)?(?:commands\.)?(.+)', r'\1', obj)
@@ -165,16 +181,14 @@ class RTFX(commands.Cog):
                     obj = f'abc.Messageable.{name}'
                     break
 
-        cache = list(self._rtfm_cache[key].items())
-
-        matches = fuzzy.finder(obj, cache, key=lambda t: t[0], lazy=False)
+        total, matches = index.search(obj, limit=8)
 
         e = discord.Embed(colour=discord.Colour.blurple())
         if not matches:
             return await ctx.send('Could not find anything. Sorry.')
         e.title = f"RTFM for __**`{key}`**__: {obj}"
-        e.description = '\n'.join(f'[`{key}`]({url})' for key, url in matches[:8])
-        e.set_footer(text=f"{len(matches)} possible results.")
+        e.description = '\n'.join(f'[`{key}`]({url})' for key, url in matches)
+        e.set_footer(text=f"{total} possible results.")
         await ctx.send(embed=e, reference=ctx.replied_reference)
 
     @commands.group(aliases=['rtfd'], invoke_without_command=True)
@@ -1,15 +1,18 @@
 import asyncio
 import datetime
 import difflib
+import logging
 import typing
 
 import discord
 from asyncpg import Record
 from discord.ext import commands, tasks, menus
 
-from .utils import cache, db, formats
+from .utils import cache, db, formats, spill
 from .utils.paginator import RoboPages
 
+log = logging.getLogger(__name__)
+
 class RequiresSnipe(commands.CheckFailure):
     """Requires snipe configured."""
 
@@ -31,7 +34,9 @@ class SnipeDeleteTable(db.Table, table_name='snipe_deletes'):
     message_id = db.Column(db.Integer(big=True))
     message_content = db.Column(db.String)
     attachment_urls = db.Column(db.Array(db.String), nullable=True)
-    delete_time = db.Column(db.Integer(big=True))
+    delete_time = db.Column(db.Integer(big=True), index=True)
+
+    recent_idx = db.Index('guild_id', 'channel_id', 'id')
 
 class SnipeEditTable(db.Table, table_name='snipe_edits'):
     id = db.PrimaryKeyColumn()
@@ -42,17 +47,105 @@ class SnipeEditTable(db.Table, table_name='snipe_edits'):
     message_id = db.Column(db.Integer(big=True))
     before_content = db.Column(db.String)
     after_content = db.Column(db.String)
-    edited_time = db.Column(db.Integer(big=True))
+    edited_time = db.Column(db.Integer(big=True), index=True)
     jump_url = db.Column(db.String)
 
+    recent_idx = db.Index('guild_id', 'channel_id', 'id')
+
+class SnipeBuffer:
+    """A bounded write-behind buffer for one of the snipe tables.
+
+    Rows are stored as tuples in ``columns`` order, grouped by channel, so
+    reads only touch the channel being sniped and flushing can hand them
+    straight to ``COPY``. A flush happens once ``flush_at`` rows are waiting
+    or when the cog's loop comes around, whichever is first.
+
+    If Postgres can't be reached the batch is appended to a local spill file
+    instead of being lost, and replayed in front of the next flush. The same
+    happens if the buffer reaches ``maxsize`` so that memory stays bounded.
+    Rows Postgres rejects outright are dead lettered rather than replayed.
+    """
+
+    def __init__(self, bot, table, columns, *, flush_at=500, maxsize=5000):
+        self.bot = bot
+        self.table = table
+        self.columns = columns
+        self.flush_at = flush_at
+        self.maxsize = maxsize
+        self.spill = spill.SpillFile(f'{table}.spill')
+        self._rows = {}
+        self._flushing = {}
+        self._size = 0
+        self._lock = asyncio.Lock()
+        self._pending_flush = None
+
+    def __len__(self):
+        return self._size
+
+    def append(self, channel_id, row):
+        self._rows.setdefault(channel_id, []).append(row)
+        self._size += 1
+        if self._size >= self.maxsize:
+            # nothing is keeping up, get it out of memory right away
+            rows = [row for entries in self._take().values() for row in entries]
+            self.bot.loop.create_task(self.spill.append(rows))
+        elif self._size >= self.flush_at and self._pending_flush is None:
+            self._pending_flush = self.bot.loop.create_task(self.flush())
+
+    def recent(self, channel_id, amount):
+        """Returns up to ``amount`` of the newest buffered rows for a channel as dicts."""
+        if amount <= 0:
+            return []
+        rows = self._flushing.get(channel_id, []) + self._rows.get(channel_id, [])
+        return [dict(zip(self.columns, row)) for row in rows[-amount:]]
+
+    def remove(self, *, column, value):
+        """Drops every buffered row where ``column`` equals ``value``."""
+        index = self.columns.index(column)
+        for rows in (self._rows, self._flushing):
+            for channel_id, entries in list(rows.items()):
+                entries[:] = [row for row in entries if row[index] != value]
+                if not entries:
+                    del rows[channel_id]
+        self._size = sum(map(len, self._rows.values()))
+
+    def _take(self):
+        rows, self._rows = self._rows, {}
+        self._size = 0
+        return rows
+
+    async def flush(self):
+        async with self._lock:
+            self._pending_flush = None
+            self._flushing = self._take()
+            spilled, offset = await self.spill.read()
+            records = spilled + [row for entries in self._flushing.values() for row in entries]
+            if not records:
+                return
+
+            async def copy(chunk):
+                await self.bot.pool.copy_records_to_table(self.table, columns=self.columns, records=chunk)
+
+            try:
+                await spill.write_records(copy, records, spill=self.spill, name=self.table)
+                # whatever couldn't be written has been spilled again behind the offset
+                await self.spill.consume(offset)
+            finally:
+                self._flushing = {}
+
 class SnipeConfigTable(db.Table, table_name='snipe_config'):
     id = db.Column(db.Integer(big=True), primary_key=True)
 
     blocklisted_channels = db.Column(db.Array(db.Integer(big=True)))
     blocklisted_members = db.Column(db.Array(db.Integer(big=True)))
+    retention_days = db.Column(db.Integer(small=True), nullable=True)
+
+# how long snipes are kept for when a guild hasn't set its own horizon
+DEFAULT_RETENTION_DAYS = 14
+MAX_RETENTION_DAYS = 90
 
 class SnipeConfig:
-    __slots__ = ('bot', 'guild_id', 'record', 'channel_ids', 'member_ids')
+    __slots__ = ('bot', 'guild_id', 'record', 'channel_ids', 'member_ids', 'retention_days')
 
     def __init__(self, *, guild_id, bot, record=None):
         self.guild_id = guild_id
@@ -62,9 +155,11 @@ class SnipeConfig:
         if record:
             self.channel_ids = record['blocklisted_channels']
             self.member_ids = record['blocklisted_members']
+            self.retention_days = record['retention_days'] or DEFAULT_RETENTION_DAYS
         else:
             self.channel_ids = []
             self.member_ids = []
+            self.retention_days = DEFAULT_RETENTION_DAYS
 
     @property
     def configured(self):
@@ -86,20 +181,22 @@ def requires_snipe():
         return True
     return commands.check(predicate)
 
+DELETE_COLUMNS = ('user_id', 'guild_id', 'channel_id', 'message_id', 'message_content', 'attachment_urls', 'delete_time')
+EDIT_COLUMNS = ('user_id', 'guild_id', 'channel_id', 'message_id', 'before_content', 'after_content', 'edited_time', 'jump_url')
+
 class Snipe(commands.Cog):
     """Sniping cog."""
 
     def __init__(self, bot):
         self.bot = bot
-        self.snipe_deletes = []
-        self.snipe_edits = []
-        self._snipe_lock = asyncio.Lock(loop=bot.loop)
-        self.snipe_delete_update.start()
-        self.snipe_edit_update.start()
+        self.snipe_deletes = SnipeBuffer(bot, 'snipe_deletes', DELETE_COLUMNS)
+        self.snipe_edits = SnipeBuffer(bot, 'snipe_edits', EDIT_COLUMNS)
+        self.flush_snipes.start()
+        self.purge_old_snipes.start()
 
     def cog_unload(self):
-        self.snipe_delete_update.stop()
-        self.snipe_edit_update.stop()
+        self.flush_snipes.stop()
+        self.purge_old_snipes.cancel()
 
     async def cog_command_error(self, ctx, error):
         error = getattr(error, 'original', error)
@@ -194,22 +291,16 @@ class Snipe(commands.Cog):
         if message.channel.id in config.channel_ids:
             return
         delete_time = datetime.datetime.now().replace(microsecond=0).timestamp()
-        a_id = message.author.id
-        g_id = message.guild.id
-        c_id = message.channel.id
-        m_id = message.id
-        m_content = message.content
-        attachs = [attachment.proxy_url for attachment in message.attachments if message.attachments]
-        async with self._snipe_lock:
-            self.snipe_deletes.append({
-                'user_id': a_id,
-                'guild_id': g_id,
-                'channel_id': c_id,
-                'message_id': m_id,
-                'message_content': m_content,
-                'attachment_urls': attachs,
-                'delete_time': int(delete_time)
-            })
+        attachs = [attachment.proxy_url for attachment in message.attachments]
+        self.snipe_deletes.append(message.channel.id, (
+            message.author.id,
+            message.guild.id,
+            message.channel.id,
+            message.id,
+            message.content,
+            attachs,
+            int(delete_time)
+        ))
 
     @commands.Cog.listener()
     async def on_message_edit(self, before: discord.Message, after: discord.Message):
@@ -230,23 +321,16 @@ class Snipe(commands.Cog):
             return
         edited_time = after.edited_at or datetime.datetime.now()
         edited_time = edited_time.replace(microsecond=0).timestamp()
-        a_id = after.author.id
-        g_id = after.guild.id
-        c_id = after.channel.id
-        m_id = after.id
-        before_content = before.content
-        after_content = after.content
-        async with self._snipe_lock:
-            self.snipe_edits.append({
-                'user_id': a_id,
-                'guild_id': g_id,
-                'channel_id': c_id,
-                'message_id': m_id,
-                'before_content': before_content,
-                'after_content': after_content,
-                'edited_time': int(edited_time),
-                'jump_url': after.jump_url
-            })
+        self.snipe_edits.append(after.channel.id, (
+            after.author.id,
+            after.guild.id,
+            after.channel.id,
+            after.id,
+            before.content,
+            after.content,
+            int(edited_time),
+            after.jump_url
+        ))
     
     @commands.group(name='snipe', aliases=['s'], invoke_without_command=True, cooldown_after_parsing=True)
     @commands.guild_only()
@@ -263,7 +347,7 @@ class Snipe(commands.Cog):
         query = "SELECT * FROM snipe_deletes WHERE guild_id = $2 AND channel_id = $3 ORDER BY id DESC LIMIT $1;"
         results = await self.bot.pool.fetch(query, amount, ctx.guild.id, channel.id)
         dict_results = [dict(result) for result in results] if results else []
-        local_snipes = [snipe for snipe in self.snipe_deletes if snipe['channel_id'] == channel.id]
+        local_snipes = self.snipe_deletes.recent(channel.id, amount)
         full_results = dict_results + local_snipes
         if not full_results:
             return await ctx.send('No snipes for this channel.')
@@ -292,14 +376,19 @@ class Snipe(commands.Cog):
     @commands.has_guild_permissions(manage_messages=True)
     async def snipe_desetup(self, ctx):
         """Remove the ability to snipe here."""
-        query = "DELETE from snipe_config WHERE id = $1;"
         config = await self.get_snipe_config(ctx.guild.id, connection=ctx.db)
         if not config.configured:
             return await ctx.send('Sniping is not enabled for this guild.')
         confirm = await ctx.prompt('This will delete all data stored from this guild from my snipes. Are you sure?')
         if not confirm:
             return await ctx.message.add_reaction(ctx.tick(False))
-        await ctx.db.execute(query, ctx.guild.id)
+        # the hourly purge only goes by age, so the stored snipes go right away
+        async with ctx.db.transaction():
+            await ctx.db.execute("DELETE FROM snipe_config WHERE id = $1;", ctx.guild.id)
+            await ctx.db.execute("DELETE FROM snipe_edits WHERE guild_id = $1;", ctx.guild.id)
+            await ctx.db.execute("DELETE FROM snipe_deletes WHERE guild_id = $1;", ctx.guild.id)
+        self.snipe_deletes.remove(column='guild_id', value=ctx.guild.id)
+        self.snipe_edits.remove(column='guild_id', value=ctx.guild.id)
         self.get_snipe_config.invalidate(self, ctx.guild.id)
         await ctx.message.add_reaction(ctx.tick(True))
 
@@ -366,7 +455,7 @@ class Snipe(commands.Cog):
         query = "SELECT * FROM snipe_edits WHERE guild_id = $2 AND channel_id = $3 ORDER BY id DESC LIMIT $1;"
         results = await self.bot.pool.fetch(query, amount, ctx.guild.id, channel.id)
         dict_results = [dict(result) for result in results] if results else []
-        local_snipes = [snipe for snipe in self.snipe_edits if snipe['channel_id'] == channel.id]
+        local_snipes = self.snipe_edits.recent(channel.id, amount)
         full_results = dict_results + local_snipes
         full_results = sorted(full_results, key=lambda d: d['edited_time'], reverse=True)[:amount]
         embeds = await self._gen_edit_embeds(full_results)
@@ -383,16 +472,14 @@ class Snipe(commands.Cog):
         
         Must have the 'manage_messages' permission to do this.
         """
-        member = False
-        channel = False
         if isinstance(target, discord.Member):
-            deletes = "DELETE FROM snipe_deltes WHERE guild_id = $1 AND user_id = $2;"
+            deletes = "DELETE FROM snipe_deletes WHERE guild_id = $1 AND user_id = $2;"
             edits = "DELETE FROM snipe_edits WHERE guild_id = $1 AND user_id = $2;"
-            member = True
+            column = 'user_id'
         elif isinstance(target, discord.TextChannel):
             deletes = "DELETE FROM snipe_deletes WHERE guild_id = $1 AND channel_id = $2;"
             edits = "DELETE FROM snipe_edits WHERE guild_id = $1 AND channel_id = $2;"
-            channel = True
+            column = 'channel_id'
         else:
             # shouldn't happen
             return
@@ -401,49 +488,96 @@ class Snipe(commands.Cog):
             return
         await ctx.db.execute('\n'.join([deletes, edits]), ctx.guild.id, target.id)
 
-        for item in self.snipe_deletes:
-            if member:
-                if item['user_id'] == target.id:
-                    self.snipe_deletes.remove(item)
-            elif channel:
-                if item['channel_id'] == target.id:
-                    self.snipe_deletes.remove(item)
-        
-        for item in self.snipe_edits:
-            if member:
-                if item['user_id'] == target.id:
-                    self.snipe_edits.remove(item)
-            elif channel:
-                if item['channel_id'] == target.id:
-                    self.snipe_edits.remove(item)
+        self.snipe_deletes.remove(column=column, value=target.id)
+        self.snipe_edits.remove(column=column, value=target.id)
 
         return await ctx.message.add_reaction(ctx.tick(True))
 
     @tasks.loop(minutes=1)
-    async def snipe_delete_update(self):
+    async def flush_snipes(self):
         """Batch updates for the snipes."""
-        await self.bot.wait_until_ready()
-        query = """INSERT INTO snipe_deletes (user_id, guild_id, channel_id, message_id, message_content, attachment_urls, delete_time)
-                   SELECT x.user_id, x.guild_id, x.channel_id, x.message_id, x.message_content, x.attachment_urls, x.delete_time
-                   FROM jsonb_to_recordset($1::jsonb) AS
-                   x(user_id BIGINT, guild_id BIGINT, channel_id BIGINT, message_id BIGINT, message_content TEXT, attachment_urls TEXT ARRAY, delete_time BIGINT)
-                """
-        async with self._snipe_lock:
-            await self.bot.pool.execute(query, self.snipe_deletes)
-            self.snipe_deletes.clear()
+        await self.snipe_deletes.flush()
+        await self.snipe_edits.flush()
 
-    @tasks.loop(minutes=1)
-    async def snipe_edit_update(self):
-        """Batch updates for the snipes."""
+    @flush_snipes.before_loop
+    async def before_flush_snipes(self):
         await self.bot.wait_until_ready()
-        query = """INSERT INTO snipe_edits (user_id, guild_id, channel_id, message_id, before_content, after_content, edited_time, jump_url)
-                   SELECT x.user_id, x.guild_id, x.channel_id, x.message_id, x.before_content, x.after_content, x.edited_time, x.jump_url
-                   FROM jsonb_to_recordset($1::jsonb) AS
-                   x(user_id BIGINT, guild_id BIGINT, channel_id BIGINT, message_id BIGINT, before_content TEXT, after_content TEXT, edited_time BIGINT, jump_url TEXT)
+
+    @flush_snipes.after_loop
+    async def after_flush_snipes(self):
+        # whatever is left over on unload
+        await self.snipe_deletes.flush()
+        await self.snipe_edits.flush()
+
+    async def _purge_table(self, table, time_column, *, batch_size=5000):
+        # purged one retention horizon at a time so that every batch is a plain range scan
+        # over the time index, guilds that keep snipes longer than the default are left out
+        # of the default pass and get a pass of their own like the shorter ones
+        query = """SELECT retention_days, array_agg(id) AS guild_ids
+                   FROM snipe_config
+                   WHERE retention_days IS NOT NULL AND retention_days <> $1
+                   GROUP BY retention_days;
                 """
-        async with self._snipe_lock:
-            await self.bot.pool.execute(query, self.snipe_edits)
-            self.snipe_edits.clear()
+        records = await self.bot.pool.fetch(query, DEFAULT_RETENTION_DAYS)
+        longer = [guild_id for record in records if record['retention_days'] > DEFAULT_RETENTION_DAYS
+                  for guild_id in record['guild_ids']]
+
+        passes = [(DEFAULT_RETENTION_DAYS, 'guild_id <> ALL($3::bigint[])', longer)]
+        passes.extend((record['retention_days'], 'guild_id = ANY($3::bigint[])', record['guild_ids'])
+                      for record in records)
+
+        # deleted in batches to keep each statement's locks short
+        now = int(datetime.datetime.now().timestamp())
+        total = 0
+        for days, condition, guild_ids in passes:
+            query = f"""DELETE FROM {table}
+                        WHERE id IN (
+                            SELECT id FROM {table}
+                            WHERE {time_column} < $1 AND {condition}
+                            LIMIT $2
+                        );
+                     """
+            cutoff = now - days * 86400
+            while True:
+                status = await self.bot.pool.execute(query, cutoff, batch_size, guild_ids)
+                deleted = int(status.split()[-1])
+                total += deleted
+                if deleted < batch_size:
+                    break
+                await asyncio.sleep(0)
+        return total
+
+    @tasks.loop(hours=1)
+    async def purge_old_snipes(self):
+        """Drops snipes older than each guild's retention horizon."""
+        deletes = await self._purge_table('snipe_deletes', 'delete_time')
+        edits = await self._purge_table('snipe_edits', 'edited_time')
+        if deletes or edits:
+            log.info('Purged %s deleted and %s edited snipes past retention.', deletes, edits)
+
+    @purge_old_snipes.before_loop
+    async def before_purge_old_snipes(self):
+        await self.bot.wait_until_ready()
+
+    @show_snipes.command(name='retention')
+    @commands.has_guild_permissions(manage_messages=True)
+    @requires_snipe()
+    async def snipe_retention(self, ctx, days: int = None):
+        """Shows or sets how many days snipes are kept for here.
+
+        Snipes older than this are removed every hour.
+        Must have the 'manage_messages' permission to change it.
+        """
+        if days is None:
+            return await ctx.send(f'Snipes are kept for {formats.plural(ctx.snipe_conf.retention_days):day} in this server.')
+
+        if not 1 <= days <= MAX_RETENTION_DAYS:
+            return await ctx.send(f'Retention must be between 1 and {MAX_RETENTION_DAYS} days.')
+
+        query = "UPDATE snipe_config SET retention_days = $2 WHERE id = $1;"
+        await ctx.db.execute(query, ctx.guild.id, days)
+        self.get_snipe_config.invalidate(self, ctx.guild.id)
+        await ctx.message.add_reaction(ctx.tick(True))
 
     @show_snipes.error
     @show_edit_snipes.error
@@ -18,9 +18,65 @@ import re
 
 log = logging.getLogger(__name__)
 
+# how long reaction events on a message are collected before being applied
+REACTION_BATCH_WINDOW = 2.0
+
 class StarError(commands.CheckFailure):
     pass
 
+async def apply_star_batch(connection, message_id, channel_id, guild_id, author_id, stars, unstars):
+    """Applies a batch of stars and unstars to a message's starboard entry.
+
+    The entry is created if there are stars to add. Returns the entry's
+    ``(id, bot_message_id, total_stars)`` afterwards, or ``None`` if the
+    message has no entry.
+    """
+
+    # DO UPDATE rather than DO NOTHING so that the entry is returned
+    # even when a concurrent batch inserted it after this statement began
+    query = """WITH new_entry AS (
+                   INSERT INTO starboard_entries AS entries (message_id, channel_id, guild_id, author_id)
+                   SELECT $1, $2, $3, $4
+                   WHERE cardinality($5::bigint[]) > 0
+                   ON CONFLICT (message_id) DO UPDATE SET message_id = EXCLUDED.message_id
+                   RETURNING entries.id, entries.bot_message_id
+               ),
+               entry AS (
+                   SELECT id, bot_message_id FROM new_entry
+                   UNION ALL
+                   SELECT id, bot_message_id FROM starboard_entries WHERE message_id=$1
+                   LIMIT 1
+               ),
+               removed AS (
+                   DELETE FROM starrers USING entry
+                   WHERE starrers.entry_id=entry.id
+                   AND   starrers.author_id = ANY($6::bigint[])
+                   RETURNING starrers.id
+               ),
+               added AS (
+                   INSERT INTO starrers (author_id, entry_id)
+                   SELECT starrer.id, entry.id
+                   FROM entry, unnest($5::bigint[]) AS starrer(id)
+                   ON CONFLICT (author_id, entry_id) DO NOTHING
+                   RETURNING starrers.id
+               )
+               SELECT entry.id, (SELECT COUNT(*) FROM added) - (SELECT COUNT(*) FROM removed)
+               FROM entry;
+            """
+
+    async with connection.transaction():
+        record = await connection.fetchrow(query, message_id, channel_id, guild_id, author_id, stars, unstars)
+        if record is None:
+            return None
+
+        # a freshly inserted entry isn't visible to other CTEs in the
+        # same statement, so the counter is bumped separately
+        query = """UPDATE starboard_entries SET total_stars = GREATEST(total_stars + $2, 0)
+                   WHERE id=$1
+                   RETURNING id, bot_message_id, total_stars;
+                """
+        return await connection.fetchrow(query, record[0], record[1])
+
 def requires_starboard():
     async def predicate(ctx):
         if ctx.guild is None:
@@ -28,7 +84,10 @@ def requires_starboard():
 
         cog = ctx.bot.get_cog('Stars')
 
-        ctx.starboard = await cog.get_starboard(ctx.guild.id, connection=ctx.db)
+        # the connection is only needed to see a starboard set up in a transaction
+        # that's still open, otherwise the lookup can be shared with other callers
+        connection = ctx.db if db.in_transaction(ctx.db) else None
+        ctx.starboard = await cog.get_starboard(ctx.guild.id, connection=connection)
         if ctx.starboard.channel is None:
             raise StarError("\N{WARNING SIGN} Starboard channel not found.")
 
@@ -58,6 +117,29 @@ class StarboardEntry(db.Table, table_name='starboard_entries'):
     author_id = db.Column(db.Integer(big=True))
     guild_id = db.Column(db.ForeignKey('starboard', 'id', sql_type=db.Integer(big=True)), index=True, nullable=False)
 
+    # denormalised COUNT(*) of starrers for this entry, kept in sync by the star queries
+    total_stars = db.Column(db.Integer, default=0, nullable=False)
+
+    @classmethod
+    def migration_sql(cls, path, *, downgrade=False):
+        # rows that predate the counter have to be backfilled from the starrers table
+        if not downgrade and any(column['name'] == 'total_stars' for column in path.get('add_columns', [])):
+            return cls.backfill_total_stars_sql()
+        return None
+
+    @classmethod
+    def backfill_total_stars_sql(cls):
+        return """UPDATE starboard_entries entry
+                  SET total_stars = counts.total
+                  FROM (
+                      SELECT entry_id, COUNT(*) AS total
+                      FROM starrers
+                      GROUP BY entry_id
+                  ) AS counts
+                  WHERE entry.id = counts.entry_id
+                  AND   entry.total_stars <> counts.total;
+               """
+
 class Starrers(db.Table):
     id = db.PrimaryKeyColumn()
     author_id = db.Column(db.Integer(big=True), nullable=False)
@@ -109,27 +191,32 @@ class Stars(commands.Cog):
         self.bot = bot
 
         # cache message objects to save Discord some HTTP requests.
-        self._message_cache = {}
-        self.clean_message_cache.start()
+        # entries are kept up to date by the raw edit/delete events
+        self._message_cache = cache.ExpiringCache(seconds=3600.0, maxsize=5000)
 
         # if it's in this set,
         self._about_to_be_deleted = set()
 
         self._locks = weakref.WeakValueDictionary()
+
+        # (channel_id, message_id): {starrer_id: True if starred, False if unstarred}
+        self._pending_reactions = {}
         self.spoilers = re.compile(r'\|\|(.+?)\|\|')
 
     def cog_unload(self):
-        self.clean_message_cache.cancel()
+        # apply whatever is still waiting for its batch window to close
+        for channel_id, message_id in list(self._pending_reactions):
+            channel = self.bot.get_channel(channel_id)
+            if channel is not None:
+                self.bot.loop.create_task(self.flush_reactions(channel, message_id))
 
     async def cog_command_error(self, ctx, error):
         if isinstance(error, StarError):
             await ctx.send(error)
 
-    @tasks.loop(hours=1.0)
-    async def clean_message_cache(self):
-        self._message_cache.clear()
-
-    @cache.cache()
+    # most guilds never set up a starboard, keep those apart so that
+    # they don't push the configured ones out of the cache
+    @cache.cache(negative_ttl=300.0, is_negative=lambda starboard: starboard.channel_id is None)
     async def get_starboard(self, guild_id, *, connection=None):
         connection = connection or self.bot.pool
         query = "SELECT * FROM starboard WHERE id = $1;"
@@ -202,7 +289,7 @@ class Stars(commands.Cog):
 
     async def get_message(self, channel, message_id):
         try:
-            return self._message_cache[message_id]
+            return self._message_cache[message_id][0]
         except KeyError:
             try:
                 o = discord.Object(id=message_id + 1)
@@ -230,16 +317,151 @@ class Stars(commands.Cog):
         if not isinstance(channel, discord.TextChannel):
             return
 
-        method = getattr(self, f'{fmt}_message')
-
         user = payload.member or (await self.bot.get_or_fetch_member(guild, payload.user_id))
         if user is None or user.bot:
             return
 
-        try:
-            await method(channel, payload.message_id, payload.user_id, verify=True)
-        except StarError:
-            pass
+        # reactions are collected per message and applied together once the
+        # window closes, only the latest action of each starrer matters
+        key = (channel.id, payload.message_id)
+        pending = self._pending_reactions.get(key)
+        if pending is None:
+            self._pending_reactions[key] = pending = {}
+            self.bot.loop.create_task(self._flush_reactions_later(channel, payload.message_id))
+
+        pending[payload.user_id] = fmt == 'star'
+
+    async def _flush_reactions_later(self, channel, message_id):
+        await asyncio.sleep(REACTION_BATCH_WINDOW)
+        await self.flush_reactions(channel, message_id)
+
+    async def flush_reactions(self, channel, message_id):
+        pending = self._pending_reactions.pop((channel.id, message_id), None)
+        if not pending:
+            return
+
+        guild_id = channel.guild.id
+        lock = self._locks.get(guild_id)
+        if lock is None:
+            self._locks[guild_id] = lock = asyncio.Lock(loop=self.bot.loop)
+
+        async with lock:
+            async with self.bot.pool.acquire(timeout=300.0) as con:
+                config = self.bot.get_cog('Config')
+                if config:
+                    perms = await config.get_command_permissions(guild_id, connection=con)
+                    if perms.is_command_blocked('star', channel.id):
+                        return
+
+                    for starrer_id in list(pending):
+                        plonked = await config.is_plonked(guild_id, starrer_id, channel_id=channel.id, connection=con)
+                        if plonked:
+                            del pending[starrer_id]
+
+                stars = [starrer_id for starrer_id, starred in pending.items() if starred]
+                unstars = [starrer_id for starrer_id, starred in pending.items() if not starred]
+                try:
+                    await self._apply_reactions(channel, message_id, stars, unstars, connection=con)
+                except StarError:
+                    pass
+
+    async def _apply_reactions(self, channel, message_id, stars, unstars, *, connection):
+        """Applies a batch of stars and unstars to a message in a single query.
+
+        Stars that would be rejected by :meth:`_star_message` are dropped
+        silently, since there is nobody to tell about them.
+
+        Parameters
+        ------------
+        channel: :class:`TextChannel`
+            The channel that the message belongs to.
+        message_id: int
+            The message ID of the message being starred or unstarred.
+        stars: List[int]
+            The IDs of the people who starred this message.
+        unstars: List[int]
+            The IDs of the people who unstarred this message.
+        connection: asyncpg.Connection
+            The connection to use.
+        """
+        guild_id = channel.guild.id
+        starboard = await self.get_starboard(guild_id)
+        starboard_channel = starboard.channel
+        if starboard_channel is None:
+            raise StarError('\N{WARNING SIGN} Starboard channel not found.')
+
+        if starboard.locked:
+            raise StarError('\N{NO ENTRY SIGN} Starboard is locked.')
+
+        if channel.id == starboard_channel.id:
+            query = "SELECT channel_id, message_id FROM starboard_entries WHERE bot_message_id=$1;"
+            record = await connection.fetchrow(query, message_id)
+            if record is None:
+                raise StarError('Could not find message in the starboard.')
+
+            ch = channel.guild.get_channel(record['channel_id'])
+            if ch is None:
+                raise StarError('Could not find the original channel.')
+
+            return await self._apply_reactions(ch, record['message_id'], stars, unstars, connection=connection)
+
+        if not starboard_channel.permissions_for(starboard_channel.guild.me).send_messages:
+            raise StarError('\N{NO ENTRY SIGN} Cannot post messages in starboard channel.')
+
+        msg = await self.get_message(channel, message_id)
+        oldest_allowed = datetime.datetime.utcnow() - starboard.max_age
+        if (msg is None
+                or (channel.is_nsfw() and not starboard_channel.is_nsfw())
+                or (len(msg.content) == 0 and len(msg.attachments) == 0)
+                or msg.type is not discord.MessageType.default
+                or msg.created_at < oldest_allowed):
+            stars = []
+        else:
+            stars = [starrer_id for starrer_id in stars if starrer_id != msg.author.id]
+
+        if not stars and not unstars:
+            return
+
+        author_id = msg.author.id if msg is not None else None
+        record = await apply_star_batch(connection, message_id, channel.id, guild_id, author_id, stars, unstars)
+        if record is None:
+            return
+
+        entry_id, bot_message_id, count = record
+        if count == 0:
+            # delete the entry if we have no more stars
+            query = "DELETE FROM starboard_entries WHERE id=$1;"
+            await connection.execute(query, entry_id)
+
+        if bot_message_id is None:
+            if msg is None or count < starboard.threshold:
+                return
+
+            content, embed = self.get_emoji_message(msg, count)
+            new_msg = await starboard_channel.send(content, embed=embed)
+            query = "UPDATE starboard_entries SET bot_message_id=$1 WHERE id=$2;"
+            await connection.execute(query, new_msg.id, entry_id)
+            return
+
+        bot_message = await self.get_message(starboard_channel, bot_message_id)
+        if bot_message is None:
+            if count:
+                # deleted? might as well purge the data
+                query = "DELETE FROM starboard_entries WHERE id=$1;"
+                await connection.execute(query, entry_id)
+            return
+
+        if count < starboard.threshold:
+            self._about_to_be_deleted.add(bot_message_id)
+            if count:
+                # update the bot_message_id to be NULL in the table since we're deleting it
+                query = "UPDATE starboard_entries SET bot_message_id=NULL WHERE id=$1;"
+                await connection.execute(query, entry_id)
+
+            await bot_message.delete()
+        elif msg is not None:
+            content, embed = self.get_emoji_message(msg, count)
+            await bot_message.edit(content=content, embed=embed)
 
     @commands.Cog.listener()
     async def on_guild_channel_delete(self, channel):
@@ -263,8 +485,15 @@ class Stars(commands.Cog):
     async def on_raw_reaction_remove(self, payload):
         await self.reaction_action('unstar', payload)
 
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload):
+        entry = self._message_cache.get(payload.message_id)
+        if entry is not None:
+            entry[0]._update(payload.data)
+
     @commands.Cog.listener()
     async def on_raw_message_delete(self, payload):
+        self._message_cache.pop(payload.message_id, None)
         if payload.message_id in self._about_to_be_deleted:
             # we triggered this deletion ourselves and 
             # we don't need to drop it from the database
@@ -283,6 +512,9 @@ class Stars(commands.Cog):
 
     @commands.Cog.listener()
     async def on_raw_bulk_message_delete(self, payload):
+        for message_id in payload.message_ids:
+            self._message_cache.pop(message_id, None)
+
         if payload.message_ids <= self._about_to_be_deleted:
             # see comment above
             self._about_to_be_deleted.difference_update(payload.message_ids)
@@ -417,16 +649,16 @@ class Stars(commands.Cog):
                    RETURNING entry_id;
                 """
         try:
-            record = await connection.fetchrow(query, message_id, channel.id, guild_id, msg.author.id, starrer_id)
+            async with connection.transaction():
+                record = await connection.fetchrow(query, message_id, channel.id, guild_id, msg.author.id, starrer_id)
+                query = """UPDATE starboard_entries SET total_stars = total_stars + 1
+                           WHERE id=$1
+                           RETURNING total_stars, bot_message_id;
+                        """
+                count, bot_message_id = await connection.fetchrow(query, record[0])
         except asyncpg.UniqueViolationError:
             raise StarError('\N{NO ENTRY SIGN} You already starred this message.')
 
-        entry_id = record[0]
-
-        query = "SELECT COUNT(*) FROM starrers WHERE entry_id=$1;"
-        record = await connection.fetchrow(query, entry_id)
-
-        count = record[0]
         if count < starboard.threshold:
             return
 
@@ -434,11 +666,6 @@ class Stars(commands.Cog):
         # with our star info
         content, embed = self.get_emoji_message(msg, count)
 
-        # get the message ID to edit:
-        query = "SELECT bot_message_id FROM starboard_entries WHERE message_id=$1;"
-        record = await connection.fetchrow(query, message_id)
-        bot_message_id = record[0]
-
         if bot_message_id is None:
             new_msg = await starboard_channel.send(content, embed=embed)
             query = "UPDATE starboard_entries SET bot_message_id=$1 WHERE message_id=$2;"
@@ -517,16 +744,16 @@ class Stars(commands.Cog):
                    RETURNING starrers.entry_id, entry.bot_message_id
                 """
 
-        record = await connection.fetchrow(query, message_id, starrer_id)
-        if record is None:
-            raise StarError('\N{NO ENTRY SIGN} You have not starred this message.')
+        async with connection.transaction():
+            record = await connection.fetchrow(query, message_id, starrer_id)
+            if record is None:
+                raise StarError('\N{NO ENTRY SIGN} You have not starred this message.')
 
-        entry_id = record[0]
-        bot_message_id = record[1]
+            entry_id = record[0]
+            bot_message_id = record[1]
 
-        query = "SELECT COUNT(*) FROM starrers WHERE entry_id=$1;"
-        count = await connection.fetchrow(query, entry_id)
-        count = count[0]
+            query = "UPDATE starboard_entries SET total_stars = GREATEST(total_stars - 1, 0) WHERE id=$1 RETURNING total_stars;"
+            count = await connection.fetchval(query, entry_id)
 
         if count == 0:
             # delete the entry if we have no more stars
@@ -571,7 +798,8 @@ class Stars(commands.Cog):
         # decided to use the !star command
         self.get_starboard.invalidate(self, ctx.guild.id)
 
-        starboard = await self.get_starboard(ctx.guild.id, connection=ctx.db)
+        connection = ctx.db if db.in_transaction(ctx.db) else None
+        starboard = await self.get_starboard(ctx.guild.id, connection=connection)
         if starboard.channel is not None:
             return await ctx.send(f'This server already has a starboard ({starboard.channel.mention}).')
 
@@ -685,19 +913,11 @@ class Stars(commands.Cog):
 
         last_messages = await channel.history(limit=100).map(lambda m: m.id).flatten()
 
-        query = """WITH bad_entries AS (
-                       SELECT entry_id
-                       FROM starrers
-                       INNER JOIN starboard_entries
-                       ON starboard_entries.id = starrers.entry_id
-                       WHERE starboard_entries.guild_id=$1
-                       AND   starboard_entries.bot_message_id = ANY($2::bigint[])
-                       GROUP BY entry_id
-                       HAVING COUNT(*) <= $3
-                   )
-                   DELETE FROM starboard_entries USING bad_entries
-                   WHERE starboard_entries.id = bad_entries.entry_id
-                   RETURNING starboard_entries.bot_message_id
+        query = """DELETE FROM starboard_entries
+                   WHERE guild_id=$1
+                   AND   bot_message_id = ANY($2::bigint[])
+                   AND   total_stars <= $3
+                   RETURNING bot_message_id
                 """
 
         to_delete = await ctx.db.fetch(query, ctx.guild.id, last_messages, stars)
@@ -724,15 +944,14 @@ class Stars(commands.Cog):
         You can only use this command once per 10 seconds.
         """
 
-        query = """SELECT entry.channel_id,
-                          entry.message_id,
-                          entry.bot_message_id,
-                          COUNT(*) OVER(PARTITION BY entry_id) AS "Stars"
-                   FROM starrers
-                   INNER JOIN starboard_entries entry
-                   ON entry.id = starrers.entry_id
-                   WHERE entry.guild_id=$1
-                   AND (entry.message_id=$2 OR entry.bot_message_id=$2)
+        query = """SELECT channel_id,
+                          message_id,
+                          bot_message_id,
+                          total_stars AS "Stars"
+                   FROM starboard_entries
+                   WHERE guild_id=$1
+                   AND (message_id=$2 OR bot_message_id=$2)
+                   AND total_stars > 0
                    LIMIT 1
                 """
 
@@ -813,22 +1032,10 @@ class Stars(commands.Cog):
         e.timestamp = ctx.starboard.channel.created_at
         e.set_footer(text='Adding stars since')
 
-        # messages starred
-        query = "SELECT COUNT(*) FROM starboard_entries WHERE guild_id=$1;"
-
-        record = await ctx.db.fetchrow(query, ctx.guild.id)
-        total_messages = record[0]
-
-        # total stars given
-        query = """SELECT COUNT(*)
-                   FROM starrers
-                   INNER JOIN starboard_entries entry
-                   ON entry.id = starrers.entry_id
-                   WHERE entry.guild_id=$1;
-                """
+        # messages starred and total stars given
+        query = "SELECT COUNT(*), COALESCE(SUM(total_stars), 0) FROM starboard_entries WHERE guild_id=$1;"
 
-        record = await ctx.db.fetchrow(query, ctx.guild.id)
-        total_stars = record[0]
+        total_messages, total_stars = await ctx.db.fetchrow(query, ctx.guild.id)
 
         e.description = f'{plural(total_messages):message} starred with a total of {total_stars} stars.'
         e.colour = discord.Colour.gold()
@@ -838,38 +1045,34 @@ class Stars(commands.Cog):
         # top 3 most starred authors  (Type 1)
         # top 3 star givers (Type 2)
 
-        query = """WITH t AS (
-                       SELECT
-                           entry.author_id AS entry_author_id,
-                           starrers.author_id,
-                           entry.bot_message_id
-                       FROM starrers
-                       INNER JOIN starboard_entries entry
-                       ON entry.id = starrers.entry_id
-                       WHERE entry.guild_id=$1
-                   )
-                   (
-                       SELECT t.entry_author_id AS "ID", 1 AS "Type", COUNT(*) AS "Stars"
-                       FROM t
-                       WHERE t.entry_author_id IS NOT NULL
-                       GROUP BY t.entry_author_id
+        # star receivers and starred posts come straight from the
+        # maintained total_stars, only the givers need the starrers table
+        query = """(
+                       SELECT author_id AS "ID", 1 AS "Type", SUM(total_stars) AS "Stars"
+                       FROM starboard_entries
+                       WHERE guild_id=$1
+                       AND author_id IS NOT NULL
+                       GROUP BY author_id
                        ORDER BY "Stars" DESC
                        LIMIT 3
                    )
                    UNION ALL
                    (
-                       SELECT t.author_id AS "ID", 2 AS "Type", COUNT(*) AS "Stars"
-                       FROM t
-                       GROUP BY t.author_id
+                       SELECT starrers.author_id AS "ID", 2 AS "Type", COUNT(*) AS "Stars"
+                       FROM starrers
+                       INNER JOIN starboard_entries entry
+                       ON entry.id = starrers.entry_id
+                       WHERE entry.guild_id=$1
+                       GROUP BY starrers.author_id
                        ORDER BY "Stars" DESC
                        LIMIT 3
                    )
                    UNION ALL
                    (
-                       SELECT t.bot_message_id AS "ID", 3 AS "Type", COUNT(*) AS "Stars"
-                       FROM t
-                       WHERE t.bot_message_id IS NOT NULL
-                       GROUP BY t.bot_message_id
+                       SELECT bot_message_id AS "ID", 3 AS "Type", total_stars AS "Stars"
+                       FROM starboard_entries
+                       WHERE guild_id=$1
+                       AND bot_message_id IS NOT NULL
                        ORDER BY "Stars" DESC
                        LIMIT 3
                    );
@@ -900,32 +1103,27 @@ class Stars(commands.Cog):
         # 2 - stars given
         # The rest are the top 3 starred posts
 
-        query = """WITH t AS (
-                       SELECT entry.author_id AS entry_author_id,
-                              starrers.author_id,
-                              entry.message_id
-                       FROM starrers
-                       INNER JOIN starboard_entries entry
-                       ON entry.id=starrers.entry_id
-                       WHERE entry.guild_id=$1
-                   )
-                   (
-                       SELECT '0'::bigint AS "ID", COUNT(*) AS "Stars"
-                       FROM t
-                       WHERE t.entry_author_id=$2
+        query = """(
+                       SELECT '0'::bigint AS "ID", COALESCE(SUM(total_stars), 0)::bigint AS "Stars"
+                       FROM starboard_entries
+                       WHERE guild_id=$1
+                       AND author_id=$2
                    )
                    UNION ALL
                    (
                        SELECT '0'::bigint AS "ID", COUNT(*) AS "Stars"
-                       FROM t
-                       WHERE t.author_id=$2
+                       FROM starrers
+                       INNER JOIN starboard_entries entry
+                       ON entry.id=starrers.entry_id
+                       WHERE entry.guild_id=$1
+                       AND starrers.author_id=$2
                    )
                    UNION ALL
                    (
-                       SELECT t.message_id AS "ID", COUNT(*) AS "Stars"
-                       FROM t
-                       WHERE t.entry_author_id=$2
-                       GROUP BY t.message_id
+                       SELECT message_id AS "ID", total_stars::bigint AS "Stars"
+                       FROM starboard_entries
+                       WHERE guild_id=$1
+                       AND author_id=$2
                        ORDER BY "Stars" DESC
                        LIMIT 3
                    )
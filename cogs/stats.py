@@ -674,6 +674,10 @@ class Stats(commands.Cog):
             f'Connections In Use: {len(pool._holders) - pool._queue.qsize()}'
         ]
 
+        stats = db.acquire_stats
+        description.append(f'Lazy Handles: {stats.handles} ({stats.unused} never needed a connection)')
+        description.append(f'Pool Wait: {stats.average_wait * 1000:.2f}ms avg, {stats.max_wait * 1000:.2f}ms max')
+
         questionable_connections = 0
         connection_value = []
         for index, holder in enumerate(pool._holders, start=1):
@@ -725,6 +729,23 @@ class Stats(commands.Cog):
         embed.add_field(name='Inner Tasks', value=f'Total: {len(inner_tasks)}\nFailed: {bad_inner_tasks or "None"}')
         embed.add_field(name='Events Waiting', value=f'Total: {len(event_tasks)}', inline=False)
 
+        parsed, parse_time = self.bot.message_parse_stats
+        if parsed:
+            description.append(f'Message Parse Time: {parse_time / parsed * 1000:.3f}ms avg over {parsed} messages')
+
+        config = self.bot.get_cog('Config')
+        if config is not None:
+            guilds, entries, size, hit_rate = config.plonk_stats()
+            description.append(f'Plonk Index: {guilds} guilds, {entries} entries, '
+                               f'{size / 1024:.1f} KiB, {hit_rate:.1%} hit rate')
+
+        stars = self.bot.get_cog('Stars')
+        if stars is not None:
+            message_cache = stars._message_cache
+            hits, misses = message_cache.get_stats()
+            hit_rate = hits / (hits + misses) if hits + misses else 0.0
+            description.append(f'Starboard Message Cache: {len(message_cache)} entries, {hit_rate:.1%} hit rate')
+
         command_waiters = len(self._data_batch)
         is_locked = self._batch_lock.locked()
         description.append(f'Commands Waiting: {command_waiters}, Batch Locked: {is_locked}')
@@ -747,6 +768,28 @@ class Stats(commands.Cog):
         embed.description = '\n'.join(description)
         await ctx.send(embed=embed)
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def startup_report(self, ctx):
+        """Shows how long each extension took to import and set up."""
+        timings = sorted(self.bot.extension_timings.items(), key=lambda t: t[1][0], reverse=True)
+        table = formats.TabularData()
+        table.set_columns(['Extension', 'Time (ms)', 'Status'])
+        table.add_rows((name, f'{elapsed * 1000:.2f}', 'OK' if error is None else type(error).__name__)
+                       for name, (elapsed, error) in timings)
+
+        total = sum(elapsed for elapsed, _ in self.bot.extension_timings.values())
+        pending = len(self.bot._deferred_extensions)
+        failed = [name for name, (_, error) in timings if error is not None]
+        render = table.render()
+        fmt = f'```\n{render}\n```\nTotal: {total * 1000:.2f}ms, {pending} extension(s) still pending.'
+        if failed:
+            fmt += f'\n\N{WARNING SIGN} {len(failed)} extension(s) failed to load: {", ".join(failed)}'
+        if len(fmt) > 2000:
+            fp = io.BytesIO(fmt.encode('utf-8'))
+            return await ctx.send('Too many results...', file=discord.File(fp, 'startup_report.txt'))
+        await ctx.send(fmt)
+
     @commands.command(hidden=True, aliases=['cancel_task'])
     @commands.is_owner()
     async def debug_task(self, ctx, memory_id: hex_value):
@@ -9,59 +9,217 @@ from lru import LRU
 from collections import OrderedDict
 from typing import Any, Callable
 
-def _wrap_and_store_coroutine(cache, key, coro):
+def _wrap_and_store_coroutine(store, key, coro, in_flight):
     async def func():
-        value = await coro
-        cache[key] = value
+        try:
+            value = await coro
+        except BaseException:
+            if in_flight.get(key) is task:
+                del in_flight[key]
+            raise
+
+        # if the key was invalidated while we were running then
+        # the result is already stale and shouldn't be stored
+        if in_flight.get(key) is task:
+            del in_flight[key]
+            store(value)
         return value
-    return func()
+
+    # this runs as a task so that callers coalesced onto it aren't
+    # affected if the first caller gets cancelled
+    task = asyncio.ensure_future(func())
+    in_flight[key] = task
+    return _wait_for_flight(task)
+
+async def _wait_for_flight(task):
+    return await asyncio.shield(task)
 
 def _wrap_new_coroutine(value):
     async def new_coroutine():
         return value
     return new_coroutine()
 
-class ExpiringCache(dict):
-    def __init__(self, seconds):
+class ExpiringCache(OrderedDict):
+    """A mapping whose entries expire ``seconds`` after they were last set.
+
+    Entries are kept in the order they were set, so the expired ones are always
+    at the front and expiry only ever looks at as many entries as it removes.
+    If ``maxsize`` is given, the oldest entries are evicted once it is exceeded.
+
+    Like :class:`lru.LRU`, a callback set with :meth:`set_callback` is called with
+    the key and value of every entry that expires or is evicted.
+    """
+
+    def __init__(self, seconds, *, maxsize=None):
         self.__ttl = seconds
+        self.__maxsize = maxsize
+        self.__callback = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
         super().__init__()
 
     def __verify_cache_integrity(self):
-        # Have to do this in two steps...
-        current_time = time.monotonic()
-        to_remove = [k for (k, (v, t)) in self.items() if current_time > (t + self.__ttl)]
-        for k in to_remove:
-            del self[k]
+        cutoff = time.monotonic() - self.__ttl
+        while self:
+            key = next(iter(self))
+            value, timestamp = super().__getitem__(key)
+            if timestamp >= cutoff:
+                break
+            super().__delitem__(key)
+            self.evictions += 1
+            if self.__callback is not None:
+                self.__callback(key, value)
 
     def __contains__(self, key):
         self.__verify_cache_integrity()
-        return super().__contains__(key)
+        if super().__contains__(key):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
 
     def __getitem__(self, key):
         self.__verify_cache_integrity()
-        return super().__getitem__(key)
+        try:
+            value = super().__getitem__(key)
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        return value
 
     def __setitem__(self, key, value):
         super().__setitem__(key, (value, time.monotonic()))
+        self.move_to_end(key)
+        if self.__maxsize is not None:
+            while len(self) > self.__maxsize:
+                key, (value, _) = self.popitem(last=False)
+                self.evictions += 1
+                if self.__callback is not None:
+                    self.__callback(key, value)
+
+    def set_callback(self, callback):
+        self.__callback = callback
+
+    def get_stats(self):
+        return self.hits, self.misses
 
 class Strategy(enum.Enum):
     lru = 1
     raw = 2
     timed = 3
 
-def cache(maxsize=128, strategy=Strategy.lru, ignore_kwargs=False):
+def cache(maxsize=128, strategy=Strategy.lru, ignore_kwargs=False, negative_ttl=None, is_negative=None):
+    """Caches the results of a function or coroutine.
+
+    Concurrent misses for the same key on a coroutine share a single call,
+    unless they pass a ``connection``. Those run on their own since the
+    connection might be in a transaction the other callers can't see.
+
+    If ``negative_ttl`` is given, "not found" results are kept in a separate
+    cache that expires after that many seconds, so they neither take up room
+    in the main cache nor stay around for good. A result is "not found" if it
+    is ``None`` or ``is_negative(result)`` returns true.
+
+    Every cached key is indexed by the arguments it was made from, so
+    ``invalidate_prefix`` and ``invalidate_containing`` with a whole argument
+    only touch the keys they remove rather than scanning the cache.
+
+    ``get_stats`` returns ``(hits, misses, coalesced)``.
+    """
     def decorator(func):
         if strategy is Strategy.lru:
             _internal_cache = LRU(maxsize)
-            _stats = _internal_cache.get_stats
+            _base_stats = _internal_cache.get_stats
         elif strategy is Strategy.raw:
             _internal_cache = {}
-            _stats = lambda: (0, 0)
+            _base_stats = lambda: (0, 0)
         elif strategy is Strategy.timed:
             _internal_cache = ExpiringCache(maxsize)
-            _stats = lambda: (0, 0)
+            _base_stats = _internal_cache.get_stats
 
-        def _make_key(args, kwargs):
+        _negative_cache = ExpiringCache(negative_ttl) if negative_ttl is not None else None
+        # key: asyncio.Task for coroutines that are currently running
+        _in_flight = {}
+        _coalesced = 0
+
+        # Secondary indexes over the cached keys, from every leading run of key
+        # parts (joined the same way as the key itself) and from every single
+        # argument to the keys made from them. Running calls aren't indexed,
+        # there are only ever a handful of those so they're scanned instead.
+        _by_prefix = {}
+        _by_argument = {}
+        # key: (prefixes, arguments) it was added to the indexes under
+        _indexed = {}
+
+        def _stats():
+            hits, misses = _base_stats()
+            if _negative_cache is not None:
+                # the main cache counted these as misses before they were found here
+                hits += _negative_cache.hits
+                misses -= _negative_cache.hits
+            return (hits, misses, _coalesced)
+
+        def _index_key(key, parts):
+            if key in _indexed:
+                return
+
+            prefixes = [':'.join(parts[:i]) for i in range(2, len(parts) + 1)]
+            arguments = set(parts[1:])
+            _indexed[key] = (prefixes, arguments)
+            for prefix in prefixes:
+                _by_prefix.setdefault(prefix, set()).add(key)
+            for argument in arguments:
+                _by_argument.setdefault(argument, set()).add(key)
+
+        def _unindex_key(key, *args):
+            try:
+                prefixes, arguments = _indexed.pop(key)
+            except KeyError:
+                return
+
+            for index, tokens in ((_by_prefix, prefixes), (_by_argument, arguments)):
+                for token in tokens:
+                    keys = index.get(token)
+                    if keys is not None:
+                        keys.discard(key)
+                        if not keys:
+                            del index[token]
+
+        # the underlying caches tell us about the keys they evict on their own
+        if hasattr(_internal_cache, 'set_callback'):
+            _internal_cache.set_callback(_unindex_key)
+        if _negative_cache is not None:
+            _negative_cache.set_callback(_unindex_key)
+
+        def _store(key, parts, value):
+            # a key only ever lives in one of the two caches
+            if _negative_cache is not None:
+                if value is None or (is_negative is not None and is_negative(value)):
+                    if key in _internal_cache:
+                        del _internal_cache[key]
+                    _negative_cache[key] = value
+                    _index_key(key, parts)
+                    return
+                _negative_cache.pop(key, None)
+
+            _internal_cache[key] = value
+            _index_key(key, parts)
+
+        def _drop(key):
+            _unindex_key(key)
+            _in_flight.pop(key, None)
+            if _negative_cache is not None and _negative_cache.pop(key, None) is not None:
+                return True
+            try:
+                del _internal_cache[key]
+            except KeyError:
+                return False
+            else:
+                return True
+
+        def _make_key_parts(args, kwargs):
             # this is a bit of a cluster fuck
             # we do care what 'self' parameter is when we __repr__ it
             def _true_repr(o):
@@ -83,20 +241,44 @@ def cache(maxsize=128, strategy=Strategy.lru, ignore_kwargs=False):
                     key.append(_true_repr(k))
                     key.append(_true_repr(v))
 
-            return ':'.join(key)
+            return key
+
+        def _make_key(args, kwargs):
+            return ':'.join(_make_key_parts(args, kwargs))
 
         @wraps(func)
         def wrapper(*args, **kwargs):
-            key = _make_key(args, kwargs)
+            nonlocal _coalesced
+            parts = _make_key_parts(args, kwargs)
+            key = ':'.join(parts)
             try:
                 value = _internal_cache[key]
             except KeyError:
+                if _negative_cache is not None:
+                    try:
+                        value, _ = _negative_cache[key]
+                    except KeyError:
+                        pass
+                    else:
+                        if asyncio.iscoroutinefunction(func):
+                            return _wrap_new_coroutine(value)
+                        return value
+
+                private = kwargs.get('connection') is not None
+                task = None if private else _in_flight.get(key)
+                if task is not None:
+                    _coalesced += 1
+                    return _wait_for_flight(task)
+
                 value = func(*args, **kwargs)
 
                 if inspect.isawaitable(value):
-                    return _wrap_and_store_coroutine(_internal_cache, key, value)
+                    # a call with its own connection is neither joined nor waited on by anyone else
+                    in_flight = {} if private else _in_flight
+                    store = lambda value: _store(key, parts, value)
+                    return _wrap_and_store_coroutine(store, key, value, in_flight)
 
-                _internal_cache[key] = value
+                _store(key, parts, value)
                 return value
             else:
                 if asyncio.iscoroutinefunction(func):
@@ -104,29 +286,38 @@ def cache(maxsize=128, strategy=Strategy.lru, ignore_kwargs=False):
                 return value
 
         def _invalidate(*args, **kwargs):
-            try:
-                del _internal_cache[_make_key(args, kwargs)]
-            except KeyError:
-                return False
-            else:
-                return True
+            return _drop(_make_key(args, kwargs))
+
+        def _invalidate_prefix(*args, **kwargs):
+            """Invalidates every key whose leading arguments are ``args``."""
+            prefix = _make_key(args, kwargs)
+            to_remove = set(_by_prefix.get(prefix, ()))
+            to_remove.update(k for k in _in_flight if k == prefix or k.startswith(prefix + ':'))
+            return sum(_drop(k) for k in to_remove)
 
         def _invalidate_containing(key):
-            to_remove = []
-            for k in _internal_cache.keys():
-                if key in k:
-                    to_remove.append(k)
+            # a single whole argument followed by the separator, as in f'{guild_id!r}:',
+            # is looked up in the index, any other string is still matched as a
+            # substring of every key
+            argument = key[:-1]
+            if key.endswith(':') and argument and ':' not in argument:
+                candidates = _by_argument.get(argument, ())
+            else:
+                candidates = list(_internal_cache.keys())
+                if _negative_cache is not None:
+                    candidates.extend(_negative_cache.keys())
+
+            to_remove = set(k for k in _in_flight if key in k)
+            to_remove.update(k for k in candidates if key in k)
             for k in to_remove:
-                try:
-                    del _internal_cache[k]
-                except KeyError:
-                    continue
+                _drop(k)
 
         wrapper.cache = _internal_cache
         wrapper.get_key = lambda *args, **kwargs: _make_key(args, kwargs)
         wrapper.invalidate = _invalidate
         wrapper.get_stats = _stats
         wrapper.invalidate_containing = _invalidate_containing
+        wrapper.invalidate_prefix = _invalidate_prefix
         return wrapper
     return decorator
 
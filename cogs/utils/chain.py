@@ -0,0 +1,238 @@
+import json
+import random
+import zlib
+
+# word id 0 pads the start of every sentence and word id 1 ends it
+BEGIN = 0
+END = 1
+
+# the state before a word is packed into a single int, one 32 bit slot per word
+WORD_BITS = 32
+WORD_MASK = (1 << WORD_BITS) - 1
+
+FORMAT_VERSION = 1
+
+class InvalidModel(ValueError):
+    """Raised when serialised model data can't be loaded."""
+
+class MarkovChain:
+    """A word level Markov chain that can be trained incrementally.
+
+    Words are interned to integer ids and the ``order`` words before a
+    transition are packed into one int, so a state costs a single dict entry.
+    A state that has only been seen once maps straight to the id of the word
+    that followed it; it's upgraded to a ``{word_id: count}`` dict the first
+    time it's seen again.
+
+    Training only ever adds counts, so a chain trained on two batches is the
+    same as one trained on both at once, which is what lets a persisted chain
+    be topped up with newly logged messages instead of being rebuilt.
+    """
+
+    __slots__ = ('order', 'words', '_word_ids', 'transitions', '_mask', '_seed_index')
+
+    def __init__(self, order):
+        self.order = order
+        self.words = ['', '']
+        self._word_ids = {}
+        self.transitions = {}
+        self._mask = (1 << (WORD_BITS * order)) - 1
+        self._seed_index = None
+
+    def __len__(self):
+        return len(self.transitions)
+
+    def __repr__(self):
+        return f'<MarkovChain order={self.order} words={len(self.words) - 2} states={len(self.transitions)}>'
+
+    def _word_id(self, word):
+        try:
+            return self._word_ids[word]
+        except KeyError:
+            self._word_ids[word] = word_id = len(self.words)
+            self.words.append(word)
+            return word_id
+
+    def _add(self, state, word_id, count=1):
+        transitions = self.transitions
+        seen = transitions.get(state)
+        if seen is None:
+            transitions[state] = word_id if count == 1 else {word_id: count}
+        elif type(seen) is int:
+            if seen == word_id:
+                transitions[state] = {word_id: count + 1}
+            else:
+                transitions[state] = {seen: 1, word_id: count}
+        else:
+            seen[word_id] = seen.get(word_id, 0) + count
+
+    def train(self, sentences):
+        """Adds every sentence in an iterable of strings to the chain."""
+        mask = self._mask
+        word_id = self._word_id
+        add = self._add
+        for sentence in sentences:
+            words = sentence.split()
+            if not words:
+                continue
+
+            state = 0
+            for word in words:
+                current = word_id(word)
+                add(state, current)
+                state = ((state << WORD_BITS) | current) & mask
+            add(state, END)
+
+        self._seed_index = None
+
+    def update(self, other):
+        """Adds the counts of another chain of the same order to this one."""
+        if other.order != self.order:
+            raise ValueError(f'cannot merge an order {other.order} chain into an order {self.order} chain')
+
+        # the padding ids aren't words, so they map straight across
+        remap = [BEGIN, END]
+        remap.extend(self._word_id(word) for word in other.words[END + 1:])
+        order = self.order
+
+        for state, seen in other.transitions.items():
+            packed = 0
+            for shift in range(order - 1, -1, -1):
+                packed = (packed << WORD_BITS) | remap[(state >> (shift * WORD_BITS)) & WORD_MASK]
+
+            if type(seen) is int:
+                self._add(packed, remap[seen])
+            else:
+                for word_id, count in seen.items():
+                    self._add(packed, remap[word_id], count)
+
+        self._seed_index = None
+
+    @classmethod
+    def merged(cls, chains):
+        chains = list(chains)
+        self = cls(chains[0].order)
+        for chain in chains:
+            self.update(chain)
+        return self
+
+    def _walk(self, state, max_words):
+        transitions = self.transitions
+        words = self.words
+        mask = self._mask
+        result = []
+        choices = random.choices
+        for _ in range(max_words):
+            seen = transitions.get(state)
+            if seen is None:
+                break
+            if type(seen) is int:
+                current = seen
+            else:
+                current = choices(tuple(seen), tuple(seen.values()))[0]
+            if current == END:
+                break
+            result.append(words[current])
+            state = ((state << WORD_BITS) | current) & mask
+        return result
+
+    def generate(self, *, max_words=250):
+        """Generates a sentence from the start of the chain."""
+        if not self.transitions:
+            raise KeyError('the chain is empty')
+        return ' '.join(self._walk(0, max_words))
+
+    def _build_seed_index(self):
+        # the seeded commands lower case the seed, so seed states are
+        # looked up case-insensitively through the lower cased words
+        index = {}
+        for word_id, word in enumerate(self.words[END + 1:], END + 1):
+            index.setdefault(word.lower(), []).append(word_id)
+
+        self._seed_index = index
+        return index
+
+    def generate_seeded(self, seed, *, max_words=250):
+        """Generates a sentence that starts with ``seed``.
+
+        Raises :exc:`KeyError` if the chain has never seen a sentence start
+        like that.
+        """
+        seed_words = seed.split()
+        if not seed_words:
+            return self.generate(max_words=max_words)
+
+        index = self._seed_index or self._build_seed_index()
+        mask = self._mask
+        transitions = self.transitions
+
+        # every casing of the seed that was actually seen at the start of a sentence
+        states = [0]
+        for word in seed_words:
+            candidates = index.get(word.lower())
+            if not candidates:
+                raise KeyError(seed)
+
+            states = [
+                ((state << WORD_BITS) | word_id) & mask
+                for state in states
+                for word_id in candidates
+                if self._follows(transitions.get(state), word_id)
+            ]
+            if not states:
+                raise KeyError(seed)
+
+        state = random.choice(states)
+        words = []
+        for shift in range(min(len(seed_words), self.order) - 1, -1, -1):
+            words.append(self.words[(state >> (shift * WORD_BITS)) & WORD_MASK])
+
+        prefix = seed_words[:-len(words)] if len(seed_words) > len(words) else []
+        return ' '.join(prefix + words + self._walk(state, max_words))
+
+    @staticmethod
+    def _follows(seen, word_id):
+        if seen is None:
+            return False
+        if type(seen) is int:
+            return seen == word_id
+        return word_id in seen
+
+    def to_bytes(self):
+        """Serialises the chain into zlib compressed JSON."""
+        rows = []
+        for state, seen in self.transitions.items():
+            if type(seen) is int:
+                rows.append([state, seen])
+            else:
+                row = [state]
+                for word_id, count in seen.items():
+                    row.append(word_id)
+                    row.append(count)
+                rows.append(row)
+
+        payload = {'v': FORMAT_VERSION, 'order': self.order, 'words': self.words[2:], 'transitions': rows}
+        return zlib.compress(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Loads a chain serialised with :meth:`to_bytes`."""
+        try:
+            payload = json.loads(zlib.decompress(data))
+        except (zlib.error, ValueError) as e:
+            raise InvalidModel(f'Could not decode markov model: {e}') from None
+
+        if payload.get('v') != FORMAT_VERSION:
+            raise InvalidModel(f'Unsupported markov model version {payload.get("v")!r}')
+
+        self = cls(payload['order'])
+        self.words.extend(payload['words'])
+        self._word_ids = {word: word_id for word_id, word in enumerate(self.words) if word_id > END}
+
+        transitions = self.transitions
+        for row in payload['transitions']:
+            if len(row) == 2:
+                transitions[row[0]] = row[1]
+            else:
+                transitions[row[0]] = dict(zip(row[1::2], row[2::2]))
+        return self
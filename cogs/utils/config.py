@@ -82,3 +82,116 @@ class Config:
 
     def all(self):
         return self._db
+
+class JournalledConfig(Config):
+    """A :class:`Config` that appends mutations to a journal instead of rewriting the file.
+
+    Every ``put`` and ``remove`` is written as a single JSON line to ``<name>.log``.
+    Mutations made while a write is in flight are grouped into the next write,
+    so a burst of changes costs one ``fsync`` rather than one full rewrite each.
+    Once the journal grows past ``compact_after`` entries it is folded back into
+    the JSON snapshot at ``name`` in the background.
+
+    On load the snapshot is read and the journal is replayed over it.
+    """
+
+    def __init__(self, name, **options):
+        self.log_name = f'{name}.log'
+        self.compact_after = options.pop('compact_after', 1000)
+        self._pending = []
+        self._flush_future = None
+        self._journal_size = 0
+        self._compacting = False
+        super().__init__(name, **options)
+
+    def load_from_file(self):
+        super().load_from_file()
+        self._journal_size = 0
+        torn = False
+        try:
+            with open(self.log_name, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line, object_hook=self.object_hook)
+                    except json.JSONDecodeError:
+                        # a torn write, only that entry is lost
+                        torn = True
+                        continue
+                    self._apply(entry)
+                    self._journal_size += 1
+        except FileNotFoundError:
+            pass
+
+        if torn:
+            # new entries would be appended onto the torn line and lost on the
+            # next load, so fold what was read into the snapshot right away
+            self._compact()
+            self._journal_size = 0
+
+    def _apply(self, entry):
+        if entry[0] == 'p':
+            self._db[entry[1]] = entry[2]
+        else:
+            self._db.pop(entry[1], None)
+
+    def _write_journal(self, entries):
+        lines = ''.join(
+            json.dumps(entry, ensure_ascii=True, cls=self.encoder, separators=(',', ':')) + '\n'
+            for entry in entries
+        )
+        with open(self.log_name, 'a', encoding='utf-8') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _compact(self):
+        self._dump()
+        # the snapshot now contains everything in the journal
+        with open(self.log_name, 'w', encoding='utf-8'):
+            pass
+
+    async def _flush(self):
+        async with self.lock:
+            future, self._flush_future = self._flush_future, None
+            entries, self._pending = self._pending, []
+            try:
+                await self.loop.run_in_executor(None, self._write_journal, entries)
+            except Exception as e:
+                future.set_exception(e)
+                return
+            else:
+                future.set_result(None)
+
+            self._journal_size += len(entries)
+
+        if self._journal_size >= self.compact_after and not self._compacting:
+            self._compacting = True
+            self.loop.create_task(self.save())
+
+    async def _append(self, entry):
+        self._pending.append(entry)
+        if self._flush_future is None:
+            self._flush_future = self.loop.create_future()
+            self.loop.create_task(self._flush())
+        await asyncio.shield(self._flush_future)
+
+    async def save(self):
+        """Compacts the journal into the snapshot file."""
+        try:
+            async with self.lock:
+                await self.loop.run_in_executor(None, self._compact)
+                self._journal_size = 0
+        finally:
+            self._compacting = False
+
+    async def put(self, key, value, *args):
+        """Edits a config entry."""
+        key = str(key)
+        self._db[key] = value
+        await self._append(('p', key, value))
+
+    async def remove(self, key):
+        """Removes a config entry."""
+        key = str(key)
+        del self._db[key]
+        await self._append(('r', key))
@@ -3,6 +3,7 @@ import asyncio
 import discord
 import io
 from . import objects as _objects
+from .db import LazyConnection
 
 class _ContextDBAcquire:
     __slots__ = ('ctx', 'timeout')
@@ -175,8 +176,9 @@ class Context(commands.Context):
         return self._db if self._db else self.pool
 
     async def _acquire(self, timeout):
+        # no connection is checked out until the first query runs
         if self._db is None:
-            self._db = await self.pool.acquire(timeout=timeout)
+            self._db = LazyConnection(self.pool, timeout=timeout)
         return self._db
 
     def acquire(self, *, timeout=300.0):
@@ -189,6 +191,9 @@ class Context(commands.Context):
                 await ctx.db.execute(...)
             finally:
                 await ctx.release()
+
+        The connection is only checked out of the pool once
+        a query is actually run.
         """
         return _ContextDBAcquire(self, timeout)
 
@@ -198,13 +203,10 @@ class Context(commands.Context):
         we want to release the connection and re-acquire later.
         Otherwise, this is called automatically by the bot.
         """
-        # from source digging asyncpg source, releasing an already
-        # released connection does nothing
         if self._db is not None:
-            await self.bot.pool.release(self._db)
-            self._db = None
+            db, self._db = self._db, None
+            await db.release()
 
-        
     async def show_help(self, command=None):
         """Shows the help command for the specified command if given.
         If no command is given, then it'll show help for the current
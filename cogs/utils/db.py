@@ -22,6 +22,7 @@ import decimal
 import asyncpg
 import logging
 import asyncio
+import time
 
 log = logging.getLogger(__name__)
 
@@ -354,6 +355,32 @@ class PrimaryKeyColumn(Column):
     def __init__(self):
         super().__init__(Integer(auto_increment=True), primary_key=True)
 
+class Index:
+    """A multi-column index on a table.
+
+    Single column indexes should keep using ``Column(index=True)``.
+    The columns are indexed in the order given.
+    """
+
+    __slots__ = ('columns', 'name')
+
+    def __init__(self, *columns, name=None):
+        if len(columns) < 2:
+            raise SchemaError('Index requires at least two columns, use Column(index=True) instead.')
+
+        self.columns = columns
+        self.name = name # to be filled later
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(*data['columns'], name=data['name'])
+
+    def _to_dict(self):
+        return {'name': self.name, 'columns': list(self.columns)}
+
+    def _create_index(self, table_name):
+        return 'CREATE INDEX IF NOT EXISTS {0} ON {1} ({2});'.format(self.name, table_name, ', '.join(self.columns))
+
 class SchemaDiff:
     __slots__ = ('table', 'upgrade', 'downgrade')
     
@@ -425,9 +452,159 @@ class SchemaDiff:
             fmt = 'CREATE INDEX IF NOT EXISTS {0[index]} ON {1.__tablename__} ({0[name]});'
             statements.append(fmt.format(added, self.table))
 
+        # data fix-ups that have to run in the same migration as the schema change
+        extra = self.table.migration_sql(path, downgrade=downgrade)
+        if extra:
+            statements.append(extra)
+
         return '\n'.join(statements)
 
+class AcquireStats:
+    """Counters for connections checked out through :class:`LazyConnection`."""
+
+    __slots__ = ('handles', 'acquires', 'unused', 'total_wait', 'max_wait')
+
+    def __init__(self):
+        self.handles = 0
+        self.acquires = 0
+        self.unused = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def average_wait(self):
+        return self.total_wait / self.acquires if self.acquires else 0.0
+
+acquire_stats = AcquireStats()
+
+class _LazyTransaction:
+    """Wraps :meth:`asyncpg.Connection.transaction` for a :class:`LazyConnection`.
+
+    Works both as an async context manager and through the manual
+    :meth:`start`, :meth:`commit` and :meth:`rollback` calls.
+    """
+
+    __slots__ = ('lazy', 'kwargs', '_transaction')
+
+    def __init__(self, lazy, kwargs):
+        self.lazy = lazy
+        self.kwargs = kwargs
+        self._transaction = None
+
+    async def _get_transaction(self):
+        if self._transaction is None:
+            connection = await self.lazy.acquire()
+            self._transaction = connection.transaction(**self.kwargs)
+        return self._transaction
+
+    async def __aenter__(self):
+        transaction = await self._get_transaction()
+        return await transaction.__aenter__()
+
+    async def __aexit__(self, *args):
+        return await self._transaction.__aexit__(*args)
+
+    async def start(self):
+        transaction = await self._get_transaction()
+        await transaction.start()
+
+    async def commit(self):
+        if self._transaction is None:
+            return
+        await self._transaction.commit()
+
+    async def rollback(self):
+        # nothing ran, so there is nothing to roll back
+        if self._transaction is None:
+            return
+        await self._transaction.rollback()
+
+class LazyConnection:
+    """A connection handle that only checks out a pool connection once a query runs.
+
+    The query methods of :class:`asyncpg.Connection` can be called on it directly
+    and :meth:`transaction` can be used as an async context manager. Once a
+    connection has been checked out it is held until :meth:`release`.
+    """
+
+    def __init__(self, pool, *, timeout=None):
+        self.pool = pool
+        self.timeout = timeout
+        self._connection = None
+        self._lock = asyncio.Lock()
+        acquire_stats.handles += 1
+
+    @property
+    def acquired(self):
+        return self._connection is not None
+
+    async def acquire(self):
+        if self._connection is not None:
+            return self._connection
+
+        # two concurrent first queries must not each check out a connection
+        async with self._lock:
+            if self._connection is None:
+                start = time.perf_counter()
+                self._connection = await self.pool.acquire(timeout=self.timeout)
+                waited = time.perf_counter() - start
+                acquire_stats.acquires += 1
+                acquire_stats.total_wait += waited
+                acquire_stats.max_wait = max(acquire_stats.max_wait, waited)
+        return self._connection
+
+    async def release(self):
+        if self._connection is None:
+            acquire_stats.unused += 1
+            return
+
+        connection, self._connection = self._connection, None
+        await self.pool.release(connection)
+
+    def transaction(self, **kwargs):
+        return _LazyTransaction(self, kwargs)
+
+    def __getattr__(self, name):
+        if self._connection is not None:
+            return getattr(self._connection, name)
+
+        # coroutine methods check out the connection when they are awaited
+        attr = getattr(asyncpg.Connection, name, None)
+        if inspect.iscoroutinefunction(attr):
+            async def method(*args, **kwargs):
+                connection = await self.acquire()
+                return await getattr(connection, name)(*args, **kwargs)
+            return method
+
+        # anything synchronous needs a real connection to exist already
+        raise AttributeError(f'{name!r} requires an acquired connection, await acquire() first')
+
+    def __repr__(self):
+        return f'<LazyConnection acquired={self.acquired}>'
+
+def in_transaction(connection):
+    """Returns whether ``connection`` has a transaction open.
+
+    Anything that can't be in one, such as ``None``, a pool, a
+    :class:`LazyConnection` that hasn't checked out a connection yet or a
+    connection that has already been released, returns ``False``.
+    """
+    if connection is None:
+        return False
+    if isinstance(connection, LazyConnection) and not connection.acquired:
+        return False
+    try:
+        return connection.is_in_transaction()
+    except (AttributeError, asyncpg.InterfaceError):
+        return False
+
 class MaybeAcquire:
+    """Uses ``connection`` if given, otherwise a :class:`LazyConnection` from ``pool``.
+
+    The lazy connection is only checked out if a query is actually run
+    inside the block and is released when the block exits.
+    """
+
     def __init__(self, connection, *, pool):
         self.connection = connection
         self.pool = pool
@@ -436,13 +613,13 @@ class MaybeAcquire:
     async def __aenter__(self):
         if self.connection is None:
             self._cleanup = True
-            self._connection = c = await self.pool.acquire()
+            self._connection = c = LazyConnection(self.pool)
             return c
         return self.connection
 
     async def __aexit__(self, *args):
         if self._cleanup:
-            await self.pool.release(self._connection)
+            await self._connection.release()
 
 class TableMeta(type):
     @classmethod
@@ -451,6 +628,7 @@ class TableMeta(type):
 
     def __new__(cls, name, parents, dct, **kwargs):
         columns = []
+        indexes = []
 
         try:
             table_name = kwargs['table_name']
@@ -468,8 +646,14 @@ class TableMeta(type):
                     value.index_name = '%s_%s_idx' % (table_name, value.name)
 
                 columns.append(value)
+            elif isinstance(value, Index):
+                if value.name is None:
+                    value.name = '%s_%s_idx' % (table_name, '_'.join(value.columns))
+
+                indexes.append(value)
 
         dct['columns'] = columns
+        dct['indexes'] = indexes
         return super().__new__(cls, name, parents, dct)
 
     def __init__(self, name, parents, dct, **kwargs):
@@ -571,6 +755,15 @@ class Table(metaclass=TableMeta):
             return True
         return False
     
+    @classmethod
+    def migration_sql(cls, path, *, downgrade=False):
+        """Extra SQL to run after the schema changes of a migration.
+
+        ``path`` is the upgrade or downgrade half of the migration being applied.
+        Subclasses can override this to backfill columns that were just added.
+        """
+        return None
+
     @classmethod
     async def migrate(cls, *, directory='migrations', index=-1, downgrade=False, verbose=False, connection=None):
         """Actually run the latest migration pointed by the data file.
@@ -776,6 +969,9 @@ class Table(metaclass=TableMeta):
                 fmt = 'CREATE INDEX IF NOT EXISTS {1.index_name} ON {0} ({1.name});'.format(cls.__tablename__, column)
                 statements.append(fmt)
 
+        for index in cls.indexes:
+            statements.append(index._create_index(cls.__tablename__))
+
         return '\n'.join(statements)
 
     @classmethod
@@ -814,6 +1010,8 @@ class Table(metaclass=TableMeta):
         # nb: columns is ordered due to the ordered dict usage
         #     this is used to help detect renames
         x['columns'] = [a._to_dict() for a in cls.columns]
+        if cls.indexes:
+            x['indexes'] = [a._to_dict() for a in cls.indexes]
         return x
 
     @classmethod
@@ -828,6 +1026,7 @@ class Table(metaclass=TableMeta):
         self = cls()
         self.__tablename__ = data['name']
         self.columns = [Column.from_dict(a) for a in data['columns']]
+        self.indexes = [Index.from_dict(a) for a in data.get('indexes', [])]
         return self
 
     @classmethod
@@ -859,10 +1058,10 @@ class Table(metaclass=TableMeta):
             before: str [The previous column name]
             after:  str [The new column name]
         drop_index:
-            name: str [The column name]
+            name: str [The column name, or comma separated names for an Index]
             index: str [The index name]
         add_index:
-            name: str [The column name]
+            name: str [The column name, or comma separated names for an Index]
             index: str [The index name]
         changed_constraints:
             name: str [The column name]
@@ -982,6 +1181,22 @@ class Table(metaclass=TableMeta):
             upgrade.setdefault('remove_columns', []).extend(removed)
             downgrade.setdefault('add_columns', []).extend(removed)
 
+        # multi-column indexes are diffed by name, which is derived
+        # from their columns, so a changed index is a drop and an add
+        ours = {index.name: index for index in self.indexes}
+        theirs = {index.name: index for index in before.indexes}
+        for index_name, index in ours.items():
+            if index_name not in theirs:
+                entry = { 'name': ', '.join(index.columns), 'index': index_name }
+                upgrade.setdefault('add_index', []).append(entry)
+                downgrade.setdefault('drop_index', []).append(entry)
+
+        for index_name, index in theirs.items():
+            if index_name not in ours:
+                entry = { 'name': ', '.join(index.columns), 'index': index_name }
+                upgrade.setdefault('drop_index', []).append(entry)
+                downgrade.setdefault('add_index', []).append(entry)
+
         return SchemaDiff(self, upgrade, downgrade)
 
 async def _table_creator(tables, *, verbose=True):
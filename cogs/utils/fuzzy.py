@@ -10,6 +10,7 @@ file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import re
 import heapq
+import itertools
 from difflib import SequenceMatcher
 
 def ratio(a, b):
@@ -152,4 +153,94 @@ def find(text, collection, *, key=None):
     try:
         return finder(text, collection, key=key, lazy=False)[0]
     except IndexError:
-        return None
\ No newline at end of file
+        return None
+
+
+_BITS = bytes.maketrans(b'01', b'\x00\x01')
+
+class SubsequenceIndex:
+    """A prebuilt index that answers :func:`finder` queries over a fixed collection.
+
+    Every key is recorded in a bitmap for each ordered pair of characters it
+    contains, e.g. ``'abc'`` is in the ``ab``, ``ac`` and ``bc`` bitmaps. A
+    query then only runs its match against the keys that contain every
+    consecutive pair of the query in order, which is a small fraction of the
+    collection for anything but the shortest queries.
+
+    The results and their order are the same as ``finder(text, collection, key=key, lazy=False)``.
+    """
+
+    def __init__(self, collection, *, key=None):
+        self.items = list(collection)
+        self.keys = [key(item) if key else item for item in self.items]
+
+        chars = {}
+        pairs = {}
+        for index, value in enumerate(self.keys):
+            value = value.lower()
+            first = {}
+            for position, char in enumerate(value):
+                first.setdefault(char, position)
+            last = {char: position for position, char in enumerate(value)}
+
+            for char in first:
+                chars.setdefault(char, []).append(index)
+
+            # a before b somewhere iff the first a comes before the last b
+            for a, first_a in first.items():
+                for b, last_b in last.items():
+                    if first_a < last_b:
+                        pairs.setdefault(a + b, []).append(index)
+
+        self._chars = {char: self._to_bitmap(indices) for char, indices in chars.items()}
+        self._pairs = {pair: self._to_bitmap(indices) for pair, indices in pairs.items()}
+
+    def __len__(self):
+        return len(self.items)
+
+    def _to_bitmap(self, indices):
+        bits = bytearray(len(self.items) // 8 + 1)
+        for index in indices:
+            bits[index >> 3] |= 1 << (index & 7)
+        return int.from_bytes(bits, 'little')
+
+    def _candidates(self, text):
+        if len(text) == 1:
+            bitmap = self._chars.get(text, 0)
+        else:
+            bitmap = -1
+            for a, b in zip(text, text[1:]):
+                bitmap &= self._pairs.get(a + b, 0)
+                if not bitmap:
+                    return ()
+
+        # least significant bit first, as bytes of 0 and 1 so compress can pick the set ones
+        bits = bin(bitmap)[:1:-1].encode('ascii').translate(_BITS)
+        return itertools.compress(range(len(bits)), bits)
+
+    def search(self, text, *, limit=None):
+        """Returns a tuple of the total number of matches and the best ``limit`` of them."""
+        text = str(text)
+        if not text:
+            items = sorted(zip(self.keys, self.items), key=lambda t: t[0])
+            return len(items), [item for _, item in items[:limit]]
+
+        # [^b]*b matches the same as .*?b without backtracking, so
+        # this is the same match finder's regex would find
+        folded = text.lower()
+        pattern = re.escape(folded[0]) + ''.join(f'[^{re.escape(c)}]*{re.escape(c)}' for c in folded[1:])
+        search = re.compile(pattern, flags=re.IGNORECASE).search
+
+        suggestions = []
+        keys = self.keys
+        for index in self._candidates(folded):
+            r = search(keys[index])
+            if r:
+                start, end = r.span()
+                suggestions.append((end - start, start, keys[index], index))
+
+        if limit is None:
+            best = sorted(suggestions)
+        else:
+            best = heapq.nsmallest(limit, suggestions)
+        return len(suggestions), [self.items[index] for *_, index in best]
@@ -0,0 +1,119 @@
+import io
+import re
+import zlib
+
+# This comes from the Sphinx repository.
+ENTRY_REGEX = re.compile(r'(?x)(.+?)\s+(\S*:\S*)\s+(-?\d+)\s+(\S+)\s+(.*)')
+
+class InvalidInventory(ValueError):
+    """Raised when a file isn't a version 2 objects.inv."""
+
+class SphinxObjectFileReader:
+    """ A Sphinx file reader. """
+    # Inspired by Sphinx's InventoryFileReader
+    BUFSIZE = 16 * 1024
+
+    def __init__(self, buffer):
+        self.stream = io.BytesIO(buffer)
+
+    def readline(self):
+        return self.stream.readline().decode('utf-8')
+
+    def skipline(self):
+        self.stream.readline()
+
+    def read_compressed_chunks(self):
+        decompressor = zlib.decompressobj()
+        while True:
+            chunk = self.stream.read(self.BUFSIZE)
+            if len(chunk) == 0:
+                break
+            yield decompressor.decompress(chunk)
+        yield decompressor.flush()
+
+    def read_compressed_lines(self):
+        # only the unfinished last line of a chunk is carried over,
+        # so every byte is copied a constant number of times
+        buf = b''
+        for chunk in self.read_compressed_chunks():
+            *lines, buf = (buf + chunk).split(b'\n')
+            for line in lines:
+                yield line.decode('utf-8')
+
+        if buf:
+            yield buf.decode('utf-8')
+
+class Inventory:
+    """A parsed objects.inv file.
+
+    ``entries`` is a list of ``(name, directive, priority, location, dispname)``
+    tuples in file order, with the ``$`` shorthand in locations expanded.
+    """
+
+    __slots__ = ('project', 'version', 'entries')
+
+    def __init__(self, project, version, entries):
+        self.project = project
+        self.version = version
+        self.entries = entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f'<Inventory project={self.project!r} version={self.version!r} entries={len(self.entries)}>'
+
+def parse_inventory(data):
+    """Parses the raw bytes of an objects.inv file into an :class:`Inventory`.
+
+    This is CPU bound, so callers on the event loop should run it in an executor.
+    Raises :exc:`InvalidInventory` if the file is not a zlib compressed
+    version 2 inventory.
+    """
+    stream = SphinxObjectFileReader(data)
+
+    # first line is version info
+    inv_version = stream.readline().rstrip()
+
+    if inv_version != '# Sphinx inventory version 2':
+        raise InvalidInventory('Invalid objects.inv file version.')
+
+    # next line is "# Project: <name>"
+    # then after that is "# Version: <version>"
+    project = stream.readline().rstrip()[11:]
+    version = stream.readline().rstrip()[11:]
+
+    # next line says if it's a zlib header
+    line = stream.readline()
+    if 'zlib' not in line:
+        raise InvalidInventory('Invalid objects.inv file, not z-lib compatible.')
+
+    entries = []
+    match = ENTRY_REGEX.match
+    try:
+        for line in stream.read_compressed_lines():
+            line = line.rstrip()
+            parts = line.split(None, 4)
+
+            # the vast majority of names have no spaces in them, in which case
+            # splitting on whitespace gives the same groups as the regex does
+            if (
+                len(parts) == 5 and line[:1] and not line[0].isspace() and ':' in parts[1]
+                and (parts[2][1:] if parts[2][:1] == '-' else parts[2]).isdecimal()
+            ):
+                name, directive, priority, location, dispname = parts
+            else:
+                m = match(line)
+                if m is None:
+                    continue
+
+                name, directive, priority, location, dispname = m.groups()
+
+            if location.endswith('$'):
+                location = location[:-1] + name
+
+            entries.append((name, directive, priority, location, dispname))
+    except zlib.error as e:
+        raise InvalidInventory(f'Invalid objects.inv file, {e}.') from None
+
+    return Inventory(project, version, entries)
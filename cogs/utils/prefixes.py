@@ -0,0 +1,52 @@
+class PrefixMatcher:
+    """A precompiled prefix trie for a single guild.
+
+    Matching walks the message content one character at a time, so a message
+    that doesn't start with any prefix is rejected after a single dict lookup.
+    When several prefixes match, the one that comes first in the order they
+    were given wins, the same as trying a prefix list front to back.
+
+    Owner-only prefixes are stored in the same trie, after the public ones,
+    and are only considered when ``owner=True`` is passed to :meth:`match`.
+    """
+
+    __slots__ = ('_root', 'prefixes')
+
+    def __init__(self, prefixes=(), owner_prefixes=()):
+        self._root = {}
+        self.prefixes = []
+        for prefix in prefixes:
+            self._insert(prefix, False)
+        for prefix in owner_prefixes:
+            self._insert(prefix, True)
+
+    def _insert(self, prefix, owner_only):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+
+        # the None key marks a terminal node as (position, prefix, owner_only),
+        # a prefix given twice keeps its first position
+        if None not in node:
+            node[None] = (len(self.prefixes), prefix, owner_only)
+            self.prefixes.append(prefix)
+
+    def match(self, content, *, owner=False):
+        """Returns the first prefix ``content`` starts with, or ``None``."""
+        node = self._root
+        found = None
+        terminal = node.get(None)
+        if terminal is not None and (owner or not terminal[2]):
+            found = terminal
+
+        for char in content:
+            node = node.get(char)
+            if node is None:
+                break
+            terminal = node.get(None)
+            if terminal is not None and (owner or not terminal[2]) and (found is None or terminal[0] < found[0]):
+                found = terminal
+        return found[1] if found is not None else None
+
+    def __repr__(self):
+        return f'<PrefixMatcher prefixes={self.prefixes!r}>'
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+
+import asyncpg
+
+log = logging.getLogger(__name__)
+
+# errors that say nothing about the rows themselves, so the same batch may go through later
+TRANSIENT_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.InterfaceError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InsufficientResourcesError,
+    asyncpg.OperatorInterventionError,
+)
+
+class SpillFile:
+    """An append-only JSON lines file for rows that couldn't be written to Postgres.
+
+    Rows that Postgres rejected for good go to a separate ``<path>.dead`` file
+    instead, so that they are kept for inspection without being replayed.
+
+    All file access runs in the default executor. A lock is held around every
+    access so that rows appended while a replay is in flight are never lost
+    when the replayed part is cut off the front of the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dead_letter_path = f'{path}.dead'
+        self.spilled = 0
+        self.dead = 0
+        self._lock = threading.Lock()
+
+    def _append(self, path, lines):
+        with self._lock:
+            with open(path, 'a+b') as fp:
+                # a crash can leave a torn last line behind, start on a fresh
+                # line so that it doesn't swallow the first new row
+                if fp.tell() > 0:
+                    fp.seek(-1, os.SEEK_END)
+                    if fp.read(1) != b'\n':
+                        fp.write(b'\n')
+                fp.write(''.join(lines).encode('utf-8'))
+
+    async def append(self, rows):
+        if not rows:
+            return
+
+        lines = [json.dumps(row, ensure_ascii=True, default=str) + '\n' for row in rows]
+        await asyncio.get_running_loop().run_in_executor(None, self._append, self.path, lines)
+        self.spilled += len(rows)
+        log.warning('Spilled %s rows to %s', len(rows), self.path)
+
+    async def dead_letter(self, rejected):
+        """Keeps ``(row, error)`` pairs that Postgres refused in the dead letter file."""
+        if not rejected:
+            return
+
+        lines = [json.dumps({'row': row, 'error': str(error)}, ensure_ascii=True, default=str) + '\n'
+                 for row, error in rejected]
+        await asyncio.get_running_loop().run_in_executor(None, self._append, self.dead_letter_path, lines)
+        self.dead += len(rejected)
+        log.error('Rejected %s rows, kept in %s', len(rejected), self.dead_letter_path)
+
+    def _read(self):
+        with self._lock:
+            try:
+                with open(self.path, 'rb') as fp:
+                    data = fp.read()
+            except FileNotFoundError:
+                return [], 0
+
+        rows = []
+        torn = 0
+        for line in data.split(b'\n'):
+            if not line:
+                continue
+            try:
+                rows.append(tuple(json.loads(line)))
+            except ValueError:
+                torn += 1
+
+        if torn:
+            log.warning('Skipped %s torn lines in %s', torn, self.path)
+        return rows, len(data)
+
+    async def read(self):
+        """Returns the spilled rows as tuples and the offset they were read up to.
+
+        Torn lines are skipped. Pass the offset to :meth:`consume` once the
+        rows have been dealt with.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self._read)
+
+    def _consume(self, offset):
+        with self._lock:
+            try:
+                with open(self.path, 'rb') as fp:
+                    fp.seek(offset)
+                    rest = fp.read()
+            except FileNotFoundError:
+                return
+
+            if not rest.strip(b'\n'):
+                os.remove(self.path)
+                return
+
+            temp = f'{self.path}.tmp'
+            with open(temp, 'wb') as fp:
+                fp.write(rest)
+            os.replace(temp, self.path)
+
+    async def consume(self, offset):
+        """Drops the first ``offset`` bytes of the file, keeping whatever was appended since."""
+        if offset:
+            await asyncio.get_running_loop().run_in_executor(None, self._consume, offset)
+
+async def copy_isolating(copy, records):
+    """Calls ``copy`` on ``records``, narrowing permanent failures down to the offending rows.
+
+    When Postgres rejects a batch for a reason other than :data:`TRANSIENT_ERRORS`
+    the batch is split in half until the bad rows are on their own.
+
+    Returns a tuple of the records that were written, the ``(record, error)`` pairs
+    that were rejected and the records that were not attempted because of a
+    transient error, in that order.
+    """
+    written = []
+    rejected = []
+    pending = [records]
+    while pending:
+        chunk = pending.pop()
+        try:
+            await copy(chunk)
+        except TRANSIENT_ERRORS:
+            remaining = list(chunk)
+            for rest in reversed(pending):
+                remaining.extend(rest)
+            return written, rejected, remaining
+        except asyncpg.PostgresError as e:
+            if len(chunk) == 1:
+                rejected.append((chunk[0], e))
+                continue
+            middle = len(chunk) // 2
+            pending.append(chunk[middle:])
+            pending.append(chunk[:middle])
+        else:
+            written.extend(chunk)
+
+    return written, rejected, []
+
+async def write_records(copy, records, *, spill, attempts=3, name=None):
+    """Writes ``records`` through ``copy``, retrying transient failures with backoff.
+
+    Rows Postgres rejects for good are dead lettered and anything still left
+    after the last attempt is appended to ``spill``. Returns the records that
+    were written.
+    """
+    written = []
+    remaining = records
+    for attempt in range(attempts):
+        done, rejected, remaining = await copy_isolating(copy, remaining)
+        written.extend(done)
+        await spill.dead_letter(rejected)
+        if not remaining:
+            break
+
+        log.warning('Could not write %s rows to %s (attempt %s)', len(remaining), name, attempt + 1)
+        if attempt + 1 < attempts:
+            await asyncio.sleep(2 ** attempt)
+    else:
+        await spill.append(remaining)
+
+    return written
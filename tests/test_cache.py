@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+cache = pytest.importorskip('cogs.utils.cache')
+
+
+def make_guilds():
+    # a fresh class each time, the cache lives on the decorated function
+    class Guilds:
+        def __init__(self):
+            self.calls = 0
+
+        def __repr__(self):
+            return '<Guilds>'
+
+        @cache.cache(maxsize=4)
+        def get(self, guild_id, member_id=None):
+            self.calls += 1
+            return (guild_id, member_id)
+
+    return Guilds()
+
+
+def test_invalidate_prefix_only_drops_matching_keys():
+    guilds = make_guilds()
+    Guilds = type(guilds)
+    guilds.get(1, 10)
+    guilds.get(1, 11)
+    guilds.get(12, 10)
+
+    assert Guilds.get.invalidate_prefix(guilds, 1) == 2
+    assert Guilds.get.invalidate_prefix(guilds, 1) == 0
+    guilds.get(12, 10)
+    assert guilds.calls == 3
+
+
+def test_invalidate_containing_whole_argument_and_raw_substring():
+    guilds = make_guilds()
+    Guilds = type(guilds)
+    guilds.get(1, 10)
+    guilds.get(2, 1)
+    guilds.get(21, 3)
+
+    # a whole argument followed by the separator
+    Guilds.get.invalidate_containing('1:')
+    assert len(Guilds.get.cache) == 2
+
+    # anything else is still a substring match
+    Guilds.get.invalidate_containing('21')
+    assert list(Guilds.get.cache.keys()) == [Guilds.get.get_key(guilds, 2, 1)]
+
+
+def test_evicted_keys_leave_the_index():
+    guilds = make_guilds()
+    Guilds = type(guilds)
+    for guild_id in range(10):
+        guilds.get(guild_id)
+
+    # only the last four are still cached
+    assert Guilds.get.invalidate_prefix(guilds, 0) == 0
+    assert Guilds.get.invalidate_prefix(guilds, 9) == 1
+    for guild_id in range(6, 9):
+        Guilds.get.invalidate(guilds, guild_id)
+    assert len(Guilds.get.cache) == 0
+
+
+def test_invalidate_prefix_cancels_running_calls():
+    class Slow:
+        def __repr__(self):
+            return '<Slow>'
+
+        @cache.cache()
+        async def get(self, guild_id):
+            await asyncio.sleep(0.01)
+            return guild_id
+
+    async def run():
+        slow = Slow()
+        task = asyncio.ensure_future(slow.get(1))
+        await asyncio.sleep(0)
+        Slow.get.invalidate_prefix(slow, 1)
+        assert await task == 1
+        # the result was stale, so it wasn't stored
+        assert len(Slow.get.cache) == 0
+
+    asyncio.run(run())
+
+
+def test_negative_results_expire_on_their_own(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(cache, 'time', type('Clock', (), {'monotonic': staticmethod(lambda: clock[0])}))
+    calls = []
+
+    class Boards:
+        def __repr__(self):
+            return '<Boards>'
+
+        @cache.cache(maxsize=2, negative_ttl=60, is_negative=lambda board: board == 'missing')
+        def get(self, guild_id):
+            calls.append(guild_id)
+            return 'missing' if guild_id % 2 else 'found'
+
+    boards = Boards()
+    for _ in range(2):
+        for guild_id in range(1, 10):
+            boards.get(guild_id)
+
+    # the missing ones don't take up the main cache's slots
+    assert calls.count(1) == 1
+    assert len(Boards.get.cache) == 2
+    assert Boards.get.get_stats() == (5, 13, 0)
+
+    clock[0] += 61
+    boards.get(1)
+    assert calls.count(1) == 2
+
+    assert Boards.get.invalidate(boards, 1)
+    boards.get(1)
+    assert calls.count(1) == 3
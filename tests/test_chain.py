@@ -0,0 +1,98 @@
+import random
+
+import pytest
+
+from cogs.utils.chain import InvalidModel, MarkovChain
+
+SENTENCES = [
+    'the quick brown fox jumps over the lazy dog',
+    'the quick red fox runs away',
+    'a lazy dog sleeps all day',
+    'The dog barks at the quick fox',
+    'the quick brown fox jumps again',
+]
+
+
+def trained(sentences=SENTENCES, order=2):
+    chain = MarkovChain(order)
+    chain.train(sentences)
+    return chain
+
+
+def counts(chain):
+    """The chain's transitions spelled out in words, so chains with different ids compare."""
+    result = {}
+    for state, seen in chain.transitions.items():
+        words = tuple(chain.words[(state >> (32 * shift)) & 0xFFFFFFFF] for shift in range(chain.order - 1, -1, -1))
+        if type(seen) is int:
+            seen = {seen: 1}
+        result[words] = {chain.words[word_id] if word_id > 1 else word_id: count for word_id, count in seen.items()}
+    return result
+
+
+def test_generate_is_deterministic_for_a_seed():
+    first, second = trained(), trained()
+    random.seed(1234)
+    expected = [first.generate() for _ in range(20)]
+    random.seed(1234)
+    assert [second.generate() for _ in range(20)] == expected
+    assert all(sentence.split() for sentence in expected)
+
+
+def test_generate_seeded():
+    chain = trained()
+    random.seed(5)
+    for _ in range(20):
+        sentence = chain.generate_seeded('the quick')
+        assert sentence.startswith('the quick ')
+        # order 2, so "the quick" also continues the way it did mid-sentence
+        assert sentence.split()[2] in ('brown', 'red', 'fox')
+
+    # the seed is matched case-insensitively against sentence starts
+    assert chain.generate_seeded('the dog').startswith('The dog')
+    with pytest.raises(KeyError):
+        chain.generate_seeded('lazy')
+    with pytest.raises(KeyError):
+        chain.generate_seeded('unknown words')
+
+
+def test_train_in_batches_matches_training_at_once():
+    chain = trained(SENTENCES[:2])
+    chain.train(SENTENCES[2:])
+    assert counts(chain) == counts(trained())
+
+
+def test_merged_matches_training_on_everything():
+    merged = MarkovChain.merged([trained(SENTENCES[:3]), trained(SENTENCES[3:])])
+    whole = trained()
+    assert counts(merged) == counts(whole)
+    # the padding words don't turn up as vocabulary
+    assert sorted(merged.words[2:]) == sorted(whole.words[2:])
+    assert '' not in merged.words[2:]
+
+
+def test_merging_different_orders_fails():
+    with pytest.raises(ValueError):
+        trained(order=2).update(trained(order=3))
+
+
+def test_serialisation_round_trip():
+    chain = trained()
+    loaded = MarkovChain.from_bytes(chain.to_bytes())
+    assert loaded.order == chain.order
+    assert loaded.words == chain.words
+    assert loaded.transitions == chain.transitions
+
+    random.seed(99)
+    expected = [chain.generate_seeded('the') for _ in range(10)]
+    random.seed(99)
+    assert [loaded.generate_seeded('the') for _ in range(10)] == expected
+
+    # the loaded chain keeps training where the original left off
+    loaded.train(['brand new sentence'])
+    assert 'brand' in loaded.words
+
+
+def test_invalid_models():
+    with pytest.raises(InvalidModel):
+        MarkovChain.from_bytes(b'not a model')
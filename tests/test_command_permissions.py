@@ -0,0 +1,86 @@
+from collections import defaultdict
+from itertools import accumulate
+
+import pytest
+
+hypothesis = pytest.importorskip('hypothesis')
+config = pytest.importorskip('cogs.config')
+
+from hypothesis import given, settings, strategies as st
+
+
+class ReferencePermissions:
+    """The resolver as it was before verdicts were memoised, kept to compare against."""
+
+    class _Entry:
+        def __init__(self):
+            self.allow = set()
+            self.deny = set()
+
+    def __init__(self, records):
+        self._lookup = defaultdict(self._Entry)
+        for name, channel_id, whitelist in records:
+            entry = self._lookup[channel_id]
+            if whitelist:
+                entry.allow.add(name)
+            else:
+                entry.deny.add(name)
+
+    def get_blocked_commands(self, channel_id):
+        if len(self._lookup) == 0:
+            return set()
+
+        guild = self._lookup[None]
+        channel = self._lookup[channel_id]
+        return (guild.deny - guild.allow) | (channel.deny - channel.allow)
+
+    def is_command_blocked(self, name, channel_id):
+        if len(self._lookup) == 0:
+            return False
+
+        command_names = list(accumulate(name.split(), lambda x, y: f'{x} {y}'))
+        guild = self._lookup[None]
+        channel = self._lookup[channel_id]
+
+        blocked = None
+        for command in command_names:
+            if command in guild.deny:
+                blocked = True
+            if command in guild.allow:
+                blocked = False
+
+        for command in command_names:
+            if command in channel.deny:
+                blocked = True
+            if command in channel.allow:
+                blocked = False
+
+        return blocked
+
+
+# a handful of names and channels so that rules actually overlap
+words = st.sampled_from(['tag', 'create', 'edit', 'remind', 'me'])
+command_names = st.lists(words, min_size=1, max_size=3).map(' '.join)
+channel_ids = st.one_of(st.none(), st.integers(min_value=1, max_value=4))
+records = st.lists(st.tuples(command_names, channel_ids, st.booleans()), max_size=20)
+queries = st.lists(st.tuples(command_names, st.integers(min_value=1, max_value=6)), min_size=1, max_size=20)
+
+
+@settings(max_examples=500, deadline=None)
+@given(records, queries)
+def test_verdicts_match_reference(records, queries):
+    resolved = config.ResolvedCommandPermissions(1, records)
+    reference = ReferencePermissions(records)
+
+    # asked twice so that the second round comes from the memoised verdicts
+    for _ in range(2):
+        for name, channel_id in queries:
+            assert resolved.is_command_blocked(name, channel_id) == reference.is_command_blocked(name, channel_id)
+
+
+@settings(max_examples=200, deadline=None)
+@given(records, st.integers(min_value=1, max_value=6))
+def test_blocked_commands_match_reference(records, channel_id):
+    resolved = config.ResolvedCommandPermissions(1, records)
+    reference = ReferencePermissions(records)
+    assert resolved.get_blocked_commands(channel_id) == reference.get_blocked_commands(channel_id)
@@ -0,0 +1,102 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+docs = pytest.importorskip('cogs.docs')
+
+# built with Sphinx's classic theme from a small module exercising every symbol kind
+PAGE = (Path(__file__).parent / 'data' / 'sphinx_page.html').read_text(encoding='utf-8')
+
+
+def test_parse_symbols_finds_every_symbol():
+    symbols = docs.parse_symbols(PAGE)
+    assert set(symbols) == {
+        'module-sample',
+        'sample.greet',
+        'sample.Greeter',
+        'sample.Greeter.greet',
+        'sample.Greeter.prefix',
+        'sample.GreetingError',
+        'sample.DEFAULT_PREFIX',
+    }
+
+
+def test_parse_symbols_signatures():
+    symbols = docs.parse_symbols(PAGE)
+    signatures, description = symbols['sample.greet']
+    assert [s.strip() for s in signatures] == ['sample.greet(name, *, loud=False)', 'sample.greet(name, times)']
+    assert description.startswith('<dd><p>Return a greeting for <em>name</em>.</p>')
+    assert '¶' not in description
+
+    signatures, _ = symbols['sample.GreetingError']
+    assert [s.strip() for s in signatures] == ['exception sample.GreetingError']
+
+
+def test_parse_symbols_module_description():
+    signatures, description = docs.parse_symbols(PAGE)['module-sample']
+    assert signatures is None
+    markdown = docs.markdownify(description)
+    assert 'This module is used to exercise the documentation parser.' in markdown
+    assert 'Return a greeting' not in markdown
+
+
+def test_markdownify_code_blocks():
+    _, description = docs.parse_symbols(PAGE)['sample.greet']
+    markdown = docs.markdownify(description)
+    assert '`loud`' in markdown
+    assert "```py\n>>> greet('vj', loud=True)\n'HELLO VJ'\n```" in markdown
+
+
+class FakeResponse:
+    def __init__(self, status, text):
+        self.status = status
+        self._text = text
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def text(self, encoding=None):
+        return self._text
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = responses
+
+    def get(self, url):
+        return self.responses.pop(0)
+
+
+class FakeBot:
+    def __init__(self, session):
+        self.session = session
+        self.loop = asyncio.get_running_loop()
+
+
+async def make_cog(*responses):
+    cog = docs.Doc.__new__(docs.Doc)
+    cog.bot = FakeBot(FakeSession(list(responses)))
+    cog.page_cache = docs.PageCache(docs.PAGE_CACHE_SIZE)
+    cog._page_tasks = {}
+    cog._parser = ThreadPoolExecutor(max_workers=1)
+    return cog
+
+
+def test_failed_pages_are_not_cached():
+    async def run():
+        cog = await make_cog(FakeResponse(503, 'unavailable'), FakeResponse(200, PAGE))
+        url = 'https://example.com/sample.html'
+        with pytest.raises(docs.PageFetchError):
+            await cog.get_page_symbols(url)
+        assert cog.page_cache.get(url) is None
+
+        symbols = await cog.get_page_symbols(url)
+        assert 'sample.greet' in symbols
+        assert cog.page_cache.get(url) is symbols
+
+    asyncio.run(run())
@@ -0,0 +1,64 @@
+import types
+
+import pytest
+
+cache = pytest.importorskip('cogs.utils.cache')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(cache, 'time', types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_entries_expire_after_ttl(clock):
+    expiring = cache.ExpiringCache(10)
+    expiring['a'] = 1
+    clock.now += 5
+    expiring['b'] = 2
+
+    clock.now += 5
+    assert 'a' in expiring
+    clock.now += 0.5
+    assert 'a' not in expiring
+    assert expiring['b'][0] == 2
+
+    clock.now += 5
+    with pytest.raises(KeyError):
+        expiring['b']
+    assert len(expiring) == 0
+    assert expiring.evictions == 2
+
+
+def test_setting_again_refreshes_the_entry(clock):
+    expiring = cache.ExpiringCache(10)
+    expiring['a'] = 1
+    expiring['b'] = 2
+    clock.now += 8
+    expiring['a'] = 3
+
+    clock.now += 5
+    assert 'b' not in expiring
+    assert expiring['a'][0] == 3
+
+
+def test_maxsize_evicts_the_oldest(clock):
+    expiring = cache.ExpiringCache(10, maxsize=2)
+    expiring['a'] = 1
+    expiring['b'] = 2
+    expiring['a'] = 3
+    expiring['c'] = 4
+
+    assert list(expiring) == ['a', 'c']
+    assert expiring.evictions == 1
+
+
+def test_stats(clock):
+    expiring = cache.ExpiringCache(10)
+    expiring['a'] = 1
+    assert 'a' in expiring
+    assert 'b' not in expiring
+    with pytest.raises(KeyError):
+        expiring['b']
+    assert expiring.get_stats() == (1, 2)
@@ -0,0 +1,57 @@
+import asyncio
+import collections
+import json
+import random
+
+from cogs.utils import fuzzy
+
+
+def symbols():
+    """Dotted names shaped like the ones in an objects.inv, with a URL attached like rtfm's."""
+    names = set()
+    for module in (asyncio, collections, json, random, fuzzy):
+        names.add(module.__name__)
+        for name, obj in vars(module).items():
+            names.add(f'{module.__name__}.{name}')
+            if isinstance(obj, type):
+                names.update(f'{module.__name__}.{name}.{attr}' for attr in vars(obj))
+    names.update(['label:Message Content', 'label:ext/commands/api', 'Embed.set_author',
+                  'aaa', 'AAAA', 'a.b.c', 'x[y]', 'foo(bar)', 'ünïcode', 'ÜNÏCODE.lower', ''])
+    return [(name, f'https://example.com/#{name}') for name in sorted(names)]
+
+
+def queries(items):
+    rng = random.Random(0)
+    result = ['', 'a', 'A', 'aa', 'aaa', 'aaaa', '.', '..', '_', '__init__', '[y]', '(', 'a.b', 'ü',
+              'Ü', 'message content', 'zzzzzz', 'get', 'Task.cancel', 'loads', 'setauthor']
+    for key, _ in rng.sample(items, 150):
+        if not key:
+            continue
+        # substrings, subsequences and miscased versions of real keys
+        start = rng.randrange(len(key))
+        query = key[start:start + rng.randint(1, 10)]
+        if rng.random() < 0.4:
+            query = ''.join(c for c in query if rng.random() < 0.7) or query
+        if rng.random() < 0.3:
+            query = query.swapcase()
+        result.append(query)
+    return result
+
+
+def test_subsequence_index_matches_finder():
+    items = symbols()
+    index = fuzzy.SubsequenceIndex(items, key=lambda t: t[0])
+    assert len(index) == len(items)
+
+    for query in queries(items):
+        expected = fuzzy.finder(query, items, key=lambda t: t[0], lazy=False)
+        assert index.search(query) == (len(expected), expected), query
+        assert index.search(query, limit=8) == (len(expected), expected[:8]), query
+
+
+def test_subsequence_index_without_key():
+    words = ['banana', 'bandana', 'cabana', 'Nab', 'ban', 'an']
+    index = fuzzy.SubsequenceIndex(words)
+    for query in ('an', 'ban', 'NA', 'bna', 'x', 'aaa'):
+        expected = fuzzy.finder(query, words, lazy=False)
+        assert index.search(query) == (len(expected), expected), query
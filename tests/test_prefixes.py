@@ -0,0 +1,20 @@
+from cogs.utils.prefixes import PrefixMatcher
+
+
+def test_first_prefix_in_order_wins():
+    assert PrefixMatcher(['!!', '!']).match('!!ping') == '!!'
+    assert PrefixMatcher(['!', '!!']).match('!!ping') == '!'
+
+
+def test_owner_prefixes_come_after_public_ones():
+    matcher = PrefixMatcher(['hey', '?'], owner_prefixes=('hey babe ',))
+    assert matcher.match('hey babe ping', owner=True) == 'hey'
+    assert PrefixMatcher(['?'], owner_prefixes=('hey babe ',)).match('hey babe ping', owner=True) == 'hey babe '
+    assert PrefixMatcher(['?'], owner_prefixes=('hey babe ',)).match('hey babe ping') is None
+
+
+def test_no_match():
+    matcher = PrefixMatcher(['<@1> ', '?'])
+    assert matcher.match('hello') is None
+    assert matcher.match('') is None
+    assert matcher.match('<@1>') is None
@@ -0,0 +1,92 @@
+import asyncio
+import datetime
+import types
+
+import pytest
+
+reminder = pytest.importorskip('cogs.reminder')
+db = reminder.db
+
+
+class FakeConnection:
+    def __init__(self):
+        self.transaction_open = True
+
+    def is_in_transaction(self):
+        return self.transaction_open
+
+
+class FakePool:
+    def __init__(self, committed):
+        self.committed = committed
+        self.connection = FakeConnection()
+
+    async def acquire(self, *, timeout=None):
+        return self.connection
+
+    async def release(self, connection):
+        pass
+
+    async def fetchval(self, query, timer_id):
+        return 1 if timer_id in self.committed else None
+
+
+def make_cog(pool):
+    cog = reminder.Reminder.__new__(reminder.Reminder)
+    cog.bot = types.SimpleNamespace(pool=pool)
+    cog._heap = []
+    cog._timers = {}
+    cog._loaded_until = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+    cog._wakeup = asyncio.Event()
+    return cog
+
+
+def make_timer(timer_id):
+    now = datetime.datetime.utcnow()
+    timer = reminder.Timer.temporary(event='reminder', args=[], kwargs={}, created=now,
+                                     expires=now + datetime.timedelta(minutes=5))
+    timer.id = timer_id
+    return timer
+
+
+def test_push_after_commit_with_released_lazy_connection():
+    async def run():
+        pool = FakePool(committed={1})
+        cog = make_cog(pool)
+        connection = db.LazyConnection(pool)
+        await connection.acquire()
+        timer = make_timer(1)
+
+        # the command finished and released the connection before the task ran
+        await connection.release()
+        await cog._push_after_commit(timer, connection)
+        assert cog._timers == {1: timer}
+        assert cog._wakeup.is_set()
+
+    asyncio.run(run())
+
+
+def test_push_after_commit_waits_for_the_transaction():
+    async def run():
+        pool = FakePool(committed=set())
+        cog = make_cog(pool)
+        connection = db.LazyConnection(pool)
+        await connection.acquire()
+        timer = make_timer(2)
+
+        task = asyncio.ensure_future(cog._push_after_commit(timer, connection))
+        await asyncio.sleep(0)
+        assert not task.done()
+
+        # rolled back, so the row is gone once the connection is released
+        pool.connection.transaction_open = False
+        await connection.release()
+        await task
+        assert cog._timers == {}
+
+    asyncio.run(run())
+
+
+def test_never_acquired_lazy_connection_is_not_in_a_transaction():
+    connection = db.LazyConnection(FakePool(committed=set()))
+    assert not db.in_transaction(connection)